@@ -1,9 +1,14 @@
 
 import os
-import requests
 import ADSCitationCapture.url as url
+from ADSCitationCapture import http_session
+from ADSCitationCapture import db
+from ADSCitationCapture.cache import TTLCache
 import urllib.request, urllib.parse, urllib.error
 import math
+import time
+import random
+from collections import OrderedDict
 from adsputils import setup_logging
 
 # ============================= INITIALIZATION ==================================== #
@@ -18,9 +23,14 @@ logger = setup_logging(__name__, proj_home=proj_home,
                         level=config.get('LOGGING_LEVEL', 'INFO'),
                         attach_stdout=config.get('LOG_STDOUT', False))
 
+# Canonical bibcodes resolved by this process (created on first use)
+_canonical_bibcode_cache = None
+# Bibcodes that could not be resolved by this process mapped to the time of the miss
+_unresolved_bibcode_cache = None
+
 
 # =============================== FUNCTIONS ======================================= #
-def _request_citations_page(app, bibcode, start, rows):
+def _request_citations_page(app, bibcode, start, rows, timeout=30):
     params = urllib.parse.urlencode({
                 'fl': 'bibcode',
                 'q': 'citations(bibcode:{0})'.format(bibcode),
@@ -33,7 +43,7 @@ def _request_citations_page(app, bibcode, start, rows):
     url = app.conf['ADS_API_URL']+"search/query?"+params
     r_json = {}
     try:
-        r = requests.get(url, headers=headers)
+        r = http_session.get(url, headers=headers, timeout=timeout)
     except:
         logger.error("Search API request failed for citations (start: %i): %s", start, bibcode)
         raise
@@ -81,36 +91,132 @@ def request_existing_citations(app, bibcode):
     existing_citation_bibcodes = [b['bibcode'] for b in existing_citation_bibcodes]
     return existing_citation_bibcodes
 
-def get_canonical_bibcodes(app, bibcodes, timeout=30):
+def _get_canonical_bibcode_cache(app):
+    global _canonical_bibcode_cache
+    if _canonical_bibcode_cache is None:
+        _canonical_bibcode_cache = TTLCache(max_size=app.conf.get('CANONICAL_BIBCODE_CACHE_SIZE', 100000),
+                                            ttl=app.conf.get('CANONICAL_BIBCODE_CACHE_TTL', 24*60*60))
+    return _canonical_bibcode_cache
+
+def _get_unresolved_bibcode_cache(app):
+    global _unresolved_bibcode_cache
+    if _unresolved_bibcode_cache is None:
+        _unresolved_bibcode_cache = TTLCache(max_size=app.conf.get('UNRESOLVED_BIBCODE_CACHE_SIZE', 100000),
+                                             ttl=app.conf.get('UNRESOLVED_BIBCODE_CACHE_TTL', 60*60))
+    return _unresolved_bibcode_cache
+
+def get_canonical_bibcode_cache_stats(app):
+    """
+    Return the hit/miss counters and size of the canonical bibcode cache
+    """
+    return _get_canonical_bibcode_cache(app).stats()
+
+def get_canonical_bibcodes(app, bibcodes, timeout=30, use_cache=True):
     """
     Convert input bibcodes into their canonical form if they exist, hence
     the returned list can be smaller than the input bibcode list
+
+    Resolved bibcodes are cached, only bibcodes that are not in the cache
+    (or in the database if CANONICAL_BIBCODE_CACHE_PERSIST is enabled) are
+    requested to the API. If use_cache is False, all the bibcodes are
+    requested and the cache is refreshed with the answer.
+
+    Bibcodes that could not be resolved are also cached (for a shorter
+    time) and they are not requested again until they expire, unless
+    use_cache is False.
+    """
+    canonical_bibcodes = resolve_canonical_bibcodes(app, bibcodes, timeout=timeout, use_cache=use_cache)
+    return list(OrderedDict.fromkeys(canonical_bibcodes.values()))
+
+def resolve_canonical_bibcodes(app, bibcodes, timeout=30, use_cache=True):
+    """
+    Same as get_canonical_bibcodes but return a dictionary that maps the
+    input bibcodes to their canonical form (bibcodes that do not exist are
+    not included)
+    """
+    cache = _get_canonical_bibcode_cache(app)
+    unresolved_cache = _get_unresolved_bibcode_cache(app)
+    persist = app.conf.get('CANONICAL_BIBCODE_CACHE_PERSIST', False)
+    if use_cache:
+        cached, missing = cache.get_many(bibcodes)
+        if len(missing) > 0 and persist:
+            stored = db.get_stored_canonical_bibcodes(app, missing, cache.ttl)
+            cache.set_many(stored)
+            cached.update(stored)
+            missing = [bibcode for bibcode in missing if bibcode not in stored]
+        # Skip bibcodes that recently failed to resolve (e.g., not ingested yet)
+        missing = [bibcode for bibcode in missing if unresolved_cache.get(bibcode) is None]
+    else:
+        cached, missing = {}, list(bibcodes)
+    missing = list(OrderedDict.fromkeys(missing)) # Remove duplicates keeping the order
+
+    resolved = _request_canonical_bibcodes(app, missing, timeout)
+    cache.set_many(resolved)
+    now = time.time()
+    for bibcode in missing:
+        if bibcode in resolved:
+            unresolved_cache.delete(bibcode)
+        else:
+            unresolved_cache.set(bibcode, now)
+    if persist:
+        db.store_canonical_bibcodes(app, resolved)
+
+    canonical_bibcodes = OrderedDict((bibcode, cached[bibcode]) for bibcode in bibcodes if bibcode in cached)
+    canonical_bibcodes.update(resolved)
+    logger.debug("Canonical bibcodes: %i requested, %i cached, %i sent to the API (cache: %s, unresolved cache: %s)", len(bibcodes), len(cached), len(missing), cache.stats(), unresolved_cache.stats())
+    return canonical_bibcodes
+
+def _request_canonical_bibcodes(app, bibcodes, timeout):
+    """
+    Request to the API the canonical form of the bibcodes and return a
+    dictionary that maps input bibcodes to their canonical form
     """
     chunk_size = 2000 # Max number of records supported by bigquery
     bibcodes_chunks = [bibcodes[i * chunk_size:(i + 1) * chunk_size] for i in range(int(round(((len(bibcodes) + chunk_size - 1))) / chunk_size ))]
-    canonical_bibcodes = []
+    canonical_bibcodes = OrderedDict()
     total_n_chunks = len(bibcodes_chunks)
-    # Execute multiple requests to bigquery if the list of bibcodes is longer than the accepted maximum
-    for n_chunk, bibcodes_chunk in enumerate(bibcodes_chunks):
-        retries = 0
-        while True:
-            try:
-                canonical_bibcodes += _get_canonical_bibcodes(app, n_chunk, total_n_chunks, bibcodes_chunk, timeout)
-            except:
-                if retries < 3:
-                    logger.info("Retrying BigQuery API request for bibcodes (chunk: %i/%i): %s", n_chunk+1, total_n_chunks, " ".join(bibcodes_chunk))
-                    retries += 1
-                else:
-                    logger.exception("Failed BigQuery API request for bibcodes (chunk: %i/%i): %s", n_chunk+1, total_n_chunks, " ".join(bibcodes_chunk))
-                    raise
-            else:
-                break
+    # Execute multiple concurrent requests to bigquery if the list of bibcodes is longer than the accepted maximum
+    fetch = lambda n_chunk: _get_canonical_bibcodes_with_retries(app, n_chunk, total_n_chunks, bibcodes_chunks[n_chunk], timeout)
+    max_workers = max(1, min(app.conf.get('CANONICAL_BIBCODES_MAX_CONCURRENT_CHUNKS', 4), total_n_chunks))
+    for n_chunk, future in http_session.fetch_concurrently(fetch, range(total_n_chunks), max_workers=max_workers):
+        # Chunks do not share input bibcodes, hence the merge does not depend on the order of completion
+        canonical_bibcodes.update(future.result())
     return canonical_bibcodes
 
+def _get_canonical_bibcodes_with_retries(app, n_chunk, total_n_chunks, bibcodes_chunk, timeout):
+    """
+    Request a chunk of bibcodes retrying failed requests with exponential
+    backoff and full jitter (a random delay between zero and
+    CANONICAL_BIBCODES_BACKOFF * 2^retry seconds, capped), so that
+    concurrent chunks that failed together do not retry in lockstep
+    """
+    max_retries = app.conf.get('CANONICAL_BIBCODES_RETRIES', 3)
+    backoff = app.conf.get('CANONICAL_BIBCODES_BACKOFF', 1)
+    max_backoff = app.conf.get('CANONICAL_BIBCODES_MAX_BACKOFF', 30)
+    retries = 0
+    while True:
+        try:
+            return _get_canonical_bibcodes(app, n_chunk, total_n_chunks, bibcodes_chunk, timeout)
+        except:
+            if retries < max_retries:
+                delay = random.uniform(0, min(max_backoff, backoff * 2**retries))
+                logger.info("Retrying in %.2f seconds BigQuery API request for bibcodes (chunk: %i/%i): %s", delay, n_chunk+1, total_n_chunks, " ".join(bibcodes_chunk))
+                time.sleep(delay)
+                retries += 1
+            else:
+                logger.exception("Failed BigQuery API request for bibcodes (chunk: %i/%i): %s", n_chunk+1, total_n_chunks, " ".join(bibcodes_chunk))
+                raise
+
 def _get_canonical_bibcodes(app, n_chunk, total_n_chunks, bibcodes_chunk, timeout):
-    canonical_bibcodes = []
+    """
+    Return a dictionary that maps the bibcodes in the chunk to their canonical
+    form. Records that cannot be matched to an input bibcode (neither via
+    bibcode nor alternate bibcode) are ignored, hence only the requested
+    bibcodes are cached and stored.
+    """
+    canonical_bibcodes = OrderedDict()
     params = urllib.parse.urlencode({
-                'fl': 'bibcode',
+                'fl': 'bibcode,alternate_bibcode',
                 'q': '*:*',
                 'wt': 'json',
                 'fq':'{!bitset}',
@@ -123,7 +229,7 @@ def _get_canonical_bibcodes(app, n_chunk, total_n_chunks, bibcodes_chunk, timeou
     r_json = {}
     data = "bibcode\n" + "\n".join(bibcodes_chunk)
     try:
-        r = requests.post(url, headers=headers, data=data, timeout=timeout)
+        r = http_session.post(url, headers=headers, data=data, timeout=timeout)
     except:
         logger.error("BigQuery API request failed for bibcodes (chunk: %i/%i): %s", n_chunk+1, total_n_chunks, " ".join(bibcodes_chunk))
         raise
@@ -139,8 +245,15 @@ def _get_canonical_bibcodes(app, n_chunk, total_n_chunks, bibcodes_chunk, timeou
             logger.error(msg)
             raise Exception(msg)
         else:
+            requested_bibcodes = set(bibcodes_chunk)
             for paper in r_json.get('response', {}).get('docs', []):
-                canonical_bibcodes.append(paper['bibcode'])
+                matched = False
+                for bibcode in [paper['bibcode']] + paper.get('alternate_bibcode', []):
+                    if bibcode in requested_bibcodes:
+                        canonical_bibcodes[bibcode] = paper['bibcode']
+                        matched = True
+                if not matched:
+                    logger.warning("BigQuery API returned bibcode '%s' that does not match any requested bibcode (chunk: %i/%i)", paper['bibcode'], n_chunk+1, total_n_chunks)
     return canonical_bibcodes
 
 def get_canonical_bibcode(app, bibcode, timeout=30):
@@ -153,7 +266,7 @@ def get_canonical_bibcode(app, bibcode, timeout=30):
     else:
         return canonical[0]
 
-def get_github_metadata(app, citation_url):
+def get_github_metadata(app, citation_url, timeout=30):
     """
     Retrieve License and related metadata from GitHub API
     """
@@ -175,7 +288,7 @@ def get_github_metadata(app, citation_url):
         
         if github_api:
             try:
-                git_return = requests.get(github_api, headers=headers)
+                git_return = http_session.get(github_api, headers=headers, timeout=timeout)
                 json_return = git_return.json()
                 license_name = json_return["license"]["key"] 
                 license_url = json_return["license"]["url"] if json_return["license"]["url"] is not None else ""
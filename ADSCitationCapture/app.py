@@ -1,6 +1,80 @@
+import os
+import time
 from adsputils import ADSCelery
+from adsmsg import NonBibRecord, NonBibRecordList
 from .models import *
 
+class OutputBatcher(object):
+    """
+    Forwards records to master packing the nonbib records in NonBibRecordList
+    messages, which are sent when they reach max_records records or max_bytes
+    bytes, or when a record is added max_delay seconds or more after the
+    first buffered record. DenormalizedRecord messages do not have a list
+    counterpart, hence they are forwarded right away.
+
+    The batcher is only used from the thread that runs the tasks (the broker
+    producer is not thread-safe) and tasks flush it when they end, hence
+    buffered records never outlive the task that produced them and a killed
+    worker process does not lose records from tasks that already finished.
+    """
+
+    def __init__(self, forward_message, logger, max_records=100, max_bytes=1024*1024, max_delay=5):
+        self.forward_message = forward_message
+        self.logger = logger
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.records = []
+        self.n_bytes = 0
+        self.first_record_time = None
+        # Instrumentation
+        self.start_time = None
+        self.n_sent_messages = 0
+        self.n_sent_records = 0
+        self.n_sent_bytes = 0
+
+    def forward(self, record):
+        """
+        Forward a record or buffer it if it is a nonbib record
+        """
+        if not isinstance(record, NonBibRecord) or self.max_records <= 1:
+            self._send(record, 1)
+            return
+        if self.first_record_time is None:
+            self.first_record_time = time.time()
+        self.records.append(record)
+        self.n_bytes += record._data.ByteSize()
+        if len(self.records) >= self.max_records or self.n_bytes >= self.max_bytes or time.time() - self.first_record_time >= self.max_delay:
+            self.flush()
+
+    def __len__(self):
+        return len(self.records)
+
+    def flush(self):
+        """
+        Forward the buffered nonbib records in a single message
+        """
+        if len(self.records) == 0:
+            return
+        records = self.records
+        self.records = []
+        self.n_bytes = 0
+        self.first_record_time = None
+        message = NonBibRecordList(nonbib_records=[record._data for record in records])
+        self._send(message, len(records))
+        elapsed_time = time.time() - self.start_time
+        if elapsed_time > 0:
+            self.logger.info("Forwarded %i records in %i messages to master (%.2f messages/s, %.2f bytes/s)", self.n_sent_records, self.n_sent_messages, self.n_sent_messages/elapsed_time, self.n_sent_bytes/elapsed_time)
+
+    def _send(self, message, n_records):
+        if self.start_time is None:
+            self.start_time = time.time()
+        self.forward_message(message)
+        self.n_sent_messages += 1
+        self.n_sent_records += n_records
+        self.n_sent_bytes += message._data.ByteSize()
+
+
 class ADSCitationCaptureCelery(ADSCelery):
     def attempt_recovery(self, task, args=None, kwargs=None, einfo=None, retval=None):
         """
@@ -8,3 +82,28 @@ class ADSCitationCaptureCelery(ADSCelery):
         """
         #task.apply_async(args=args, kwargs=kwargs)
         pass
+
+    def forward_record(self, record):
+        """
+        Forward a record to master through the output batcher of this process
+        """
+        self._get_output_batcher().forward(record)
+
+    def flush_forwarded_records(self):
+        """
+        Forward the nonbib records buffered by this process (e.g., when a task
+        ends or before exiting)
+        """
+        output_batcher = getattr(self, '_output_batcher', None)
+        if output_batcher is not None and self._output_batcher_pid == os.getpid():
+            output_batcher.flush()
+
+    def _get_output_batcher(self):
+        # Batchers are never shared between celery worker processes (forked after import)
+        if getattr(self, '_output_batcher', None) is None or self._output_batcher_pid != os.getpid():
+            self._output_batcher = OutputBatcher(lambda message: self.forward_message(message), self.logger,
+                                                 max_records=self.conf.get('OUTPUT_BATCH_MAX_RECORDS', 1),
+                                                 max_bytes=self.conf.get('OUTPUT_BATCH_MAX_BYTES', 1024*1024),
+                                                 max_delay=self.conf.get('OUTPUT_BATCH_MAX_DELAY', 5))
+            self._output_batcher_pid = os.getpid()
+        return self._output_batcher
@@ -0,0 +1,86 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache():
+    """
+    Bounded in-memory cache with least-recently-used eviction and a time to
+    live per entry. It is local to the process (i.e., each worker has its own)
+    and safe to be used from multiple threads.
+    """
+
+    def __init__(self, max_size=10000, ttl=3600):
+        """
+        :param max_size: Maximum number of entries, the least recently used
+            entry is evicted when it is exceeded.
+        :param ttl: Number of seconds an entry is considered valid.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the cached value or default if it is not cached or it expired
+        """
+        with self._lock:
+            entry = self._data.get(key, None)
+            if entry is not None:
+                value, expiration = entry
+                if expiration > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def get_many(self, keys):
+        """
+        Return a dictionary with the cached values and a list with the keys
+        that are not cached (or expired)
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.get(key, None)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        return found, missing
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def set_many(self, mapping):
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Return hit/miss counters and current size
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+    def __len__(self):
+        return len(self._data)
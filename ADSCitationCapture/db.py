@@ -1,13 +1,21 @@
 import os
+import time
+import json
+import heapq
+import threading
+from contextlib import contextmanager
 from typing import OrderedDict
 from psycopg2 import IntegrityError
 from dateutil.tz import tzutc
-from ADSCitationCapture.models import Citation, CitationTarget, Event, Reader
+from ADSCitationCapture.models import Citation, CitationTarget, Event, Reader, CanonicalBibcode, DoiMetadataCache, MaintenanceJob, MaintenanceJobChunk, DirtyCitationTarget, DeferredCitation, ConceptDoiVersions
 from ADSCitationCapture import doi
 from adsmsg import CitationChange
 import datetime
-from adsputils import setup_logging
-from sqlalchemy_continuum import version_class
+from adsputils import setup_logging, get_date
+from sqlalchemy_continuum import version_class, versioning_manager
+from sqlalchemy_continuum.operation import Operation
+from sqlalchemy import tuple_, func, select, bindparam
+from sqlalchemy.dialects.postgresql import insert, array
 
 # ============================= INITIALIZATION ==================================== #
 # - Use app logger:
@@ -32,48 +40,240 @@ env_name = config.get('ENVIRONMENT', 'back-dev')
 for key in file_names.keys():
     file_names[key] = file_names[key] + str(env_name)
 
+#Date of the last export, used to update the files incrementally
+nonbib_watermark_file_name = proj_home+'/logs/output/watermark_CC.json.'+str(env_name)
+
 # =============================== FUNCTIONS ======================================= #
-def store_event(app, data):
+# Session shared by all the helpers called within a task unit of work (see task_session_scope)
+_task_session = threading.local()
+
+@contextmanager
+def task_session_scope(app):
+    """
+    Unit of work for a task: all the db helpers called within this context
+    share a single session/transaction, which is committed at the end (or
+    rolled back if an exception is raised). Callbacks registered with
+    call_after_commit are executed once the transaction has been committed.
+    Nested calls re-use the outer unit of work.
+    """
+    if getattr(_task_session, 'session', None) is not None:
+        yield _task_session.session
+        return
+    _task_session.after_commit = []
+    try:
+        with app.session_scope() as session:
+            _task_session.session = session
+            yield session
+        after_commit = _task_session.after_commit
+    finally:
+        _task_session.session = None
+        _task_session.after_commit = []
+    for callback, args, kwargs in after_commit:
+        callback(*args, **kwargs)
+
+def call_after_commit(callback, *args, **kwargs):
+    """
+    Call a function once the current task unit of work is committed (e.g.,
+    to queue tasks that will read what this one stored), or immediately if
+    there is none
+    """
+    if getattr(_task_session, 'session', None) is None:
+        callback(*args, **kwargs)
+    else:
+        _task_session.after_commit.append((callback, args, kwargs))
+
+def call_once_after_commit(callback, *args, **kwargs):
+    """
+    Same as call_after_commit but the callback is not registered again if
+    the current task unit of work already did it with the same arguments
+    (e.g., to schedule a single flush for everything it stored)
+    """
+    if getattr(_task_session, 'session', None) is not None and (callback, args, kwargs) in _task_session.after_commit:
+        return
+    call_after_commit(callback, *args, **kwargs)
+
+@contextmanager
+def _session_scope(app):
+    """
+    Session of the current task unit of work if there is one (commit and
+    close are left to the unit of work), or a new transactional session
+    """
+    session = getattr(_task_session, 'session', None)
+    if session is None:
+        with app.session_scope() as session:
+            yield session
+    else:
+        yield session
+
+def _commit(session):
     """
-    Stores a new event in the DB
+    Commit, or only flush if the session belongs to a task unit of work
+    """
+    if session is getattr(_task_session, 'session', None):
+        session.flush()
+    else:
+        session.commit()
+
+@contextmanager
+def _savepoint(session):
+    """
+    Writes that can fail without failing the whole task unit of work (the
+    error is handled by the caller) are executed in a savepoint, hence only
+    them are rolled back and the shared session can still be used
+    """
+    if session is getattr(_task_session, 'session', None):
+        with session.begin_nested():
+            yield
+    else:
+        try:
+            yield
+        except:
+            session.rollback()
+            raise
+
+def store_event(app, data, status='EMITTED', dump_prefix=None):
+    """
+    Stores a new event in the DB (PENDING events are emitted later on by
+    the outbox flusher)
     """
     stored = False
-    with app.session_scope() as session:
+    with _session_scope(app) as session:
         event = Event()
         event.data = data
-        session.add(event)
+        event.status = status
+        event.dump_prefix = dump_prefix
+        event.attempts = 0
         try:
-            session.commit()
+            with _savepoint(session):
+                session.add(event)
+                _commit(session)
         except:
             logger.exception("Problem storing event '%s'", str(event))
         else:
             stored = True
     return stored
 
+def get_pending_events(app, limit, exclude_ids=()):
+    """
+    Return the oldest PENDING events that can be emitted now (i.e., not
+    waiting to be retried and not in exclude_ids) as a list of dicts. Rows
+    are locked until the end of the transaction and events locked by a
+    concurrent flush are skipped, hence this should be called within a task
+    unit of work.
+    """
+    with _session_scope(app) as session:
+        now = get_date()
+        query = session.query(Event.id, Event.data, Event.dump_prefix, Event.attempts) \
+            .filter(Event.status == 'PENDING') \
+            .filter((Event.next_attempt == None) | (Event.next_attempt <= now))
+        if len(exclude_ids) > 0:
+            query = query.filter(~Event.id.in_(list(exclude_ids)))
+        query = query \
+            .order_by(Event.id).limit(limit).with_for_update(skip_locked=True)
+        events = [{'id': event_id, 'data': data, 'dump_prefix': dump_prefix, 'attempts': attempts or 0} for event_id, data, dump_prefix, attempts in query]
+    return events
+
+def mark_events_as_emitted(app, event_ids):
+    """
+    Mark the events as emitted
+    """
+    with _session_scope(app) as session:
+        session.query(Event).filter(Event.id.in_(event_ids)).update({Event.status: 'EMITTED', Event.updated: get_date()}, synchronize_session=False)
+        _commit(session)
+
+def mark_events_as_failed(app, event_ids, retry_delay, max_attempts):
+    """
+    Count a failed attempt to emit the events, which will be retried after
+    retry_delay seconds unless they reached max_attempts (then they are
+    marked as FAILED)
+    """
+    with _session_scope(app) as session:
+        now = get_date()
+        session.query(Event).filter(Event.id.in_(event_ids)).update({
+            Event.attempts: func.coalesce(Event.attempts, 0) + 1,
+            Event.next_attempt: now + datetime.timedelta(seconds=retry_delay),
+            Event.updated: now,
+            }, synchronize_session=False)
+        session.query(Event).filter(Event.id.in_(event_ids)).filter(Event.attempts >= max_attempts).update({Event.status: 'FAILED'}, synchronize_session=False)
+        _commit(session)
+
+def _insert_versions_session(session, model, rows):
+    """
+    Record the versions of rows inserted with Core statements, which are not
+    tracked by sqlalchemy_continuum (it only sees ORM flushes): one versioning
+    transaction and one INSERT operation per row, as continuum would do
+    """
+    if len(rows) == 0:
+        return
+    transaction = versioning_manager.transaction_cls()
+    session.add(transaction)
+    session.flush()
+    values = [dict(row, transaction_id=transaction.id, operation_type=Operation.INSERT) for row in rows]
+    session.execute(version_class(model).__table__.insert(), values)
+
+def store_citation_targets_bulk(app, citation_targets):
+    """
+    Stores new citation targets in the DB, where citation_targets is a list of
+    tuples with the arguments of store_citation_target (without app). Targets
+    that already exist are ignored. Returns the list of contents that were new.
+    """
+    now = get_date()
+    values = OrderedDict()
+    for citation_target in citation_targets:
+        citation_change, content_type, raw_metadata, parsed_metadata, status = citation_target[:5]
+        associated = citation_target[5] if len(citation_target) > 5 else None
+        values.setdefault(citation_change.content, {
+            'content': citation_change.content,
+            'content_type': content_type,
+            'raw_cited_metadata': raw_metadata,
+            'parsed_cited_metadata': parsed_metadata,
+            'curated_metadata': {},
+            'status': status,
+            'bibcode': parsed_metadata.get("bibcode", None),
+            'associated_works': associated,
+            'created': now,
+        })
+    if len(values) == 0:
+        return []
+    with _session_scope(app) as session:
+        stmt = insert(CitationTarget.__table__).values(list(values.values()))
+        stmt = stmt.on_conflict_do_nothing(index_elements=['content']).returning(*CitationTarget.__table__.c)
+        rows = session.execute(stmt).fetchall()
+        _insert_versions_session(session, CitationTarget, rows)
+        _commit(session)
+    new_contents = set(row['content'] for row in rows)
+    stored_contents = [content for content in values if content in new_contents]
+    for citation_target in citation_targets:
+        citation_change = citation_target[0]
+        if citation_change.content in new_contents:
+            new_contents.remove(citation_change.content) # Duplicates in the input are ignored
+            logger.info("Stored new citation target (citing '%s', content '%s' and timestamp '%s')", citation_change.citing, citation_change.content, citation_change.timestamp.ToJsonString())
+        else:
+            logger.error("Ignoring new citation target (citing '%s', content '%s' and timestamp '%s') because it already exists in the database (another new citation may have been processed before this one)", citation_change.citing, citation_change.content, citation_change.timestamp.ToJsonString())
+    return stored_contents
+
+def lock_citation_target(app, content):
+    """
+    Lock a citation target content until the end of the current task unit of
+    work (transaction-level advisory lock), so that only one worker at a time
+    processes a citation target that is not in the database yet. Returns False
+    if the lock was held by another worker and it had to wait for it.
+    A waiting worker keeps its database connection checked out while it is
+    blocked (i.e., during the whole fetch of the worker holding the lock),
+    hence the connection pool has to allow for as many waiting workers.
+    """
+    with _session_scope(app) as session:
+        acquired = session.execute(select([func.pg_try_advisory_xact_lock(func.hashtext(content))])).scalar()
+        if not acquired:
+            logger.debug("Waiting for another worker to finish processing citation target '%s'", content)
+            session.execute(select([func.pg_advisory_xact_lock(func.hashtext(content))]))
+    return acquired
+
 def store_citation_target(app, citation_change, content_type, raw_metadata, parsed_metadata, status, associated=None):
     """
     Stores a new citation target in the DB
     """
-    stored = False
-    with app.session_scope() as session:
-        citation_target = CitationTarget()
-        citation_target.content = citation_change.content
-        citation_target.content_type = content_type
-        citation_target.raw_cited_metadata = raw_metadata
-        citation_target.parsed_cited_metadata = parsed_metadata
-        citation_target.curated_metadata = {}
-        citation_target.status = status
-        citation_target.bibcode = parsed_metadata.get("bibcode", None)
-        citation_target.associated_works = associated
-        session.add(citation_target)
-        try:
-            session.commit()
-        except IntegrityError as e:
-            # IntegrityError: (psycopg2.IntegrityError) duplicate key value violates unique constraint "citing_content_unique_constraint"
-            logger.error("Ignoring new citation target (citing '%s', content '%s' and timestamp '%s') because it already exists in the database (another new citation may have been processed before this one): '%s'", citation_change.citing, citation_change.content, citation_change.timestamp.ToJsonString(), str(e))
-        else:
-            logger.info("Stored new citation target (citing '%s', content '%s' and timestamp '%s')", citation_change.citing, citation_change.content, citation_change.timestamp.ToJsonString())
-            stored = True
+    stored = len(store_citation_targets_bulk(app, [(citation_change, content_type, raw_metadata, parsed_metadata, status, associated)])) > 0
     return stored
 
 def _update_citation_target_metadata_session(session, content, raw_metadata, parsed_metadata, curated_metadata={}, status=None, bibcode=None, associated=None):
@@ -99,7 +299,7 @@ def _update_citation_target_metadata_session(session, content, raw_metadata, par
         if status is not None:
             citation_target.status = status
         session.add(citation_target)
-        session.commit()
+        _commit(session)
         logger.info("Updated metadata for citation target '%s' (alternative bibcodes '%s')", content, ", ".join(curated_metadata.get('alternate_bibcode', [])))
         metadata_updated = True
         return metadata_updated
@@ -110,78 +310,196 @@ def update_citation_target_metadata(app, content, raw_metadata, parsed_metadata,
     """
     metadata_updated = False
     if not bibcode: bibcode = parsed_metadata.get('bibcode', None)
-    with app.session_scope() as session:
+    with _session_scope(app) as session:
         metadata_updated =  _update_citation_target_metadata_session(session, content, raw_metadata, parsed_metadata, curated_metadata, status=status, bibcode=bibcode, associated=associated)
     return metadata_updated
 
-def write_citation_target_data(app, only_status=None):
+def write_citation_target_data(app, only_status=None, incremental=False):
     """
     Writes Canonical bibcodes to file for DataPipeline
     returns: Reference Network File
              Citation Network File
              Canonical Bibcodes File
              Facet Authors File
-    """
-    with app.session_scope() as session:
-        if only_status:
-            records_db = session.query(CitationTarget).filter_by(status=only_status).all()
-            disable_filter = only_status in ['DISCARDED','EMITTABLE']
+
+    Rows are streamed from the database (server-side cursors) sorted by
+    bibcode, written to temporary files and moved to their final name once
+    all of them are complete.
+
+    If incremental is True and a previous export exists (see watermark file),
+    only the bibcodes of the citation targets/citations modified since the
+    previous export are queried and merged into the previous files, the result
+    is identical to a full export.
+    """
+    start_time = time.time()
+    # Rows modified while the export is running will be considered again by the
+    # next incremental export (overlap covers transactions that commit late)
+    export_date = get_date()
+    since = _read_nonbib_watermark(only_status) if incremental else None
+    with _session_scope(app) as session:
+        if since is None:
+            bibcodes = None
         else:
-            records_db = session.query(CitationTarget).all()
-            disable_filter = True
-        bibcodes = [r.bibcode for r in records_db]
-        records = _extract_key_citation_target_data(records_db, disable_filter=disable_filter)
-        #writes canonical bibcodes to file.
-        with open(file_names['bibcode']+".tmp", 'w') as f:
-            f.write("\n".join(bibcodes))
+            bibcodes = _get_modified_bibcodes_session(session, since)
+            logger.info("Incremental export of nonbib files for %i bibcodes modified since %s", len(bibcodes), since.isoformat())
+        n_targets = _write_key_citation_target_data(session, only_status, bibcodes=bibcodes)
         logger.info("Writing Citation/Reference Network Files.")
-        _write_key_citation_reference_data(app, bibcodes)
-        logger.info("Writing author data for {} records".format(len(records)))
-        _write_key_citation_target_authors(app, records)
-        for file in file_names:
-            status = os.system('cp {} {}'.format(file_names[file]+".tmp", file_names[file]))
-            if status == 0:    
-                logger.info("Copied {}.tmp to {}".format(file_names[file], file_names[file]))
-                os.system('rm {}'.format(file_names[file]+".tmp"))
-                logger.debug('Removed {}.tmp file from /app/logs/output/'.format(file_names[file]))
-            else:
-                logger.warning("Copying file: {} Failed with exit code: {}".format(file_names[file], status))
+        n_citations = _write_key_citation_reference_data(session, bibcodes=bibcodes)
+    for file in file_names:
+        os.replace(file_names[file]+".tmp", file_names[file])
+        logger.info("Moved {}.tmp to {}".format(file_names[file], file_names[file]))
+    _write_nonbib_watermark(export_date, only_status)
+    elapsed_time = time.time() - start_time
+    if elapsed_time > 0:
+        logger.info("Wrote nonbib files with %i citation targets and %i citations in %.2f seconds (%.2f rows/s)", n_targets, n_citations, elapsed_time, (n_targets + n_citations)/elapsed_time)
 
-def _write_key_citation_target_authors(app, records):
+def _read_nonbib_watermark(only_status):
     """
-    Writes facet author data to file.
+    Return the date from which modified rows have to be exported to update the
+    current nonbib files, or None if a full export is required (no previous
+    export, missing files or previous export with a different status filter)
     """
+    if not all(os.path.exists(file_names[file]) for file in file_names) or not os.path.exists(nonbib_watermark_file_name):
+        return None
     try:
-        with open(file_names['authors']+".tmp", 'w') as f:
-            for rec in records:
-                parsed_metadata = get_citation_target_metadata(app, rec['content']).get('parsed', {})
-                if parsed_metadata:
-                    f.write(str(rec['bibcode'])+"\t"+"\t".join(parsed_metadata.get('normalized_authors',''))+"\n")
+        with open(nonbib_watermark_file_name, 'r') as f:
+            watermark = json.load(f)
+        if watermark.get('only_status', None) != only_status:
+            return None
+        export_date = datetime.datetime.fromisoformat(watermark['date'])
+    except (ValueError, KeyError):
+        logger.exception("Ignoring invalid watermark file '%s'", nonbib_watermark_file_name)
+        return None
+    return export_date - datetime.timedelta(seconds=config.get('NONBIB_EXPORT_WATERMARK_OVERLAP', 3600))
 
-        logger.info("Wrote file {} to disk.".format('authors'))
+def _write_nonbib_watermark(export_date, only_status):
+    with open(nonbib_watermark_file_name+".tmp", 'w') as f:
+        json.dump({'date': export_date.isoformat(), 'only_status': only_status}, f)
+    os.replace(nonbib_watermark_file_name+".tmp", nonbib_watermark_file_name)
+
+def _get_modified_bibcodes_session(session, since):
+    """
+    Return the bibcodes that have to be re-exported because their citation
+    targets or citations were created/modified after a given date. Bibcodes
+    previously assigned to modified citation targets are included too, so that
+    their rows are removed if they are not valid anymore.
+    """
+    CitationTargetVersion = version_class(CitationTarget)
+    modified_targets = session.query(CitationTarget.content).filter(func.coalesce(CitationTarget.updated, CitationTarget.created) >= since)
+    modified_citations = session.query(Citation.content).filter(func.coalesce(Citation.updated, Citation.created) >= since)
+    contents = modified_targets.union(modified_citations).subquery()
+    current_bibcodes = session.query(CitationTarget.bibcode).filter(CitationTarget.content.in_(contents))
+    previous_bibcodes = session.query(CitationTargetVersion.bibcode).filter(CitationTargetVersion.content.in_(contents))
+    query = current_bibcodes.union(previous_bibcodes)
+    return set(bibcode for bibcode, in query.all() if bibcode is not None)
+
+def _merge_nonbib_file(file_name, key_column, bibcodes, lines, trailing_newline=True):
+    """
+    Write to a temporary file the lines of a previous nonbib file merged with
+    the new lines (sorted by bibcode) computed for a set of bibcodes. Previous
+    lines for these bibcodes are dropped, the other are kept in the same order.
+    """
+    key = lambda line: line.split("\t")[key_column]
+    with open(file_name, 'r') as previous_file, open(file_name+".tmp", 'w') as f:
+        previous_lines = (line.rstrip("\n") for line in previous_file)
+        previous_lines = (line for line in previous_lines if key(line) not in bibcodes)
+        for i, line in enumerate(heapq.merge(previous_lines, lines, key=key)):
+            if trailing_newline:
+                f.write(line+"\n")
+            else:
+                f.write(("\n" if i > 0 else "")+line)
+
+def _write_nonbib_files(files, bibcodes, lines):
+    """
+    Write the lines of two nonbib files to temporary files. Each file is
+    described by a (name, key column, trailing newline) tuple and lines is an
+    iterable of (line for the first file, line for the second file), where
+    None means there is no line for that file. If bibcodes is not None, the
+    lines only correspond to these bibcodes and they are merged with the
+    previous version of the files.
+    """
+    if bibcodes is None:
+        with open(files[0][0]+".tmp", 'w') as f, open(files[1][0]+".tmp", 'w') as g:
+            n_lines = [0, 0]
+            for line_pair in lines:
+                for i, (output, line, (file_name, key_column, trailing_newline)) in enumerate(zip((f, g), line_pair, files)):
+                    if line is None:
+                        continue
+                    if trailing_newline:
+                        output.write(line+"\n")
+                    else:
+                        output.write(("\n" if n_lines[i] > 0 else "")+line)
+                    n_lines[i] += 1
+    else:
+        lines = list(lines)
+        for i, (file_name, key_column, trailing_newline) in enumerate(files):
+            new_lines = [line_pair[i] for line_pair in lines if line_pair[i] is not None]
+            _merge_nonbib_file(file_name, key_column, bibcodes, new_lines, trailing_newline=trailing_newline)
+
+def _write_key_citation_target_data(session, only_status=None, bibcodes=None):
+    """
+    Writes canonical bibcodes and facet author data to file.
+    """
+    query = session.query(CitationTarget.bibcode, CitationTarget.parsed_cited_metadata, CitationTarget.curated_metadata)
+    if only_status:
+        query = query.filter(CitationTarget.status == only_status)
+        disable_filter = only_status in ['DISCARDED','EMITTABLE']
+    else:
+        disable_filter = True
+    if bibcodes is not None:
+        query = query.filter(CitationTarget.bibcode.in_(bibcodes))
+    # Binary collation so that database and python agree on the order (required to merge files)
+    query = query.filter(CitationTarget.bibcode.isnot(None)).order_by(CitationTarget.bibcode.collate('C'), CitationTarget.content.collate('C'))
+    n_targets = 0
+    def lines():
+        nonlocal n_targets
+        for bibcode, parsed_cited_metadata, curated_metadata in query.yield_per(1000):
+            n_targets += 1
+            #writes canonical bibcodes to file.
+            if parsed_cited_metadata is None or (not disable_filter and parsed_cited_metadata.get('bibcode', None) is None):
+                yield bibcode, None
+                continue
+            parsed_metadata = generate_modified_metadata(parsed_cited_metadata, curated_metadata if curated_metadata is not None else {})
+            if parsed_metadata:
+                yield bibcode, str(bibcode)+"\t"+"\t".join(parsed_metadata.get('normalized_authors',''))
+            else:
+                yield bibcode, None
+    try:
+        _write_nonbib_files(((file_names['bibcode'], 0, False), (file_names['authors'], 0, True)), bibcodes, lines())
+        logger.info("Wrote files {} and {} to disk.".format(file_names['bibcode'], file_names['authors']))
     except Exception as e:
-        logger.exception("Failed to write file {}.".format(file_names['authors']+".tmp"))
-        raise Exception("Failed to write file {}.".format(file_names['authors']+".tmp"))
+        logger.exception("Failed to write files {} and {}.".format(file_names['bibcode']+".tmp", file_names['authors']+".tmp"))
+        raise Exception("Failed to write files {} and {}.".format(file_names['bibcode']+".tmp", file_names['authors']+".tmp"))
+    return n_targets
 
-def _write_key_citation_reference_data(app, bibcodes):
+def _write_key_citation_reference_data(session, bibcodes=None):
     """
     Write the two network files:
     Citation Network File: X cites software record
     Reference Network File: software record is cited by X
 
     Both are needed to integrate software records into classic record metrics.
+    It will ignore DELETED and DISCARDED citations and citations targets.
     """
+    query = session.query(CitationTarget.bibcode, Citation.citing).join(Citation, Citation.content == CitationTarget.content)
+    query = query.filter(CitationTarget.status == 'REGISTERED').filter(CitationTarget.bibcode.isnot(None)).filter(Citation.status == 'REGISTERED')
+    if bibcodes is not None:
+        query = query.filter(CitationTarget.bibcode.in_(bibcodes))
+    # Binary collation so that database and python agree on the order (required to merge files)
+    query = query.order_by(CitationTarget.bibcode.collate('C'), Citation.citing.collate('C'))
+    n_citations = 0
+    def lines():
+        nonlocal n_citations
+        for bib, cite in query.yield_per(1000):
+            n_citations += 1
+            yield str(bib)+"\t"+str(cite), str(cite)+"\t"+str(bib)
     try:
-        with open(file_names['citations']+".tmp", 'w') as f, open(file_names['references']+".tmp", 'w') as g:
-            for bib in bibcodes:
-                cites=get_citations_by_bibcode(app, bib)
-                for cite in cites:
-                    g.write(str(cite)+"\t"+str(bib)+"\n")
-                    f.write(str(bib)+"\t"+str(cite)+"\n")
+        _write_nonbib_files(((file_names['citations'], 0, True), (file_names['references'], 1, True)), bibcodes, lines())
         logger.info("Wrote files {} and {} to disk.".format(file_names['citations'], file_names['references']))
     except Exception as e:
         logger.exception("Failed to write files {} and {}.".format(file_names['citations']+".tmp", file_names['references']+".tmp"))
         raise Exception("Failed to write files {} and {}.".format(file_names['citations']+".tmp", file_names['references']+".tmp"))
+    return n_citations
 
 def _update_citation_target_curator_message_session(session, content, msg):
     """
@@ -191,7 +509,7 @@ def _update_citation_target_curator_message_session(session, content, msg):
     if citation_target:
         citation_target.curated_metadata = msg
         session.add(citation_target)
-        session.commit()
+        _commit(session)
         msg_updated = True
         return msg_updated
 
@@ -200,32 +518,56 @@ def update_citation_target_curator_message(app, content, msg):
     Update metadata for a citation target
     """
     msg_updated = False
-    with app.session_scope() as session:
+    with _session_scope(app) as session:
         msg_updated =  _update_citation_target_curator_message_session(session, content, msg)
     return msg_updated
 
-def store_citation(app, citation_change, content_type, raw_metadata, parsed_metadata, status):
+def store_citations_bulk(app, citations):
+    """
+    Stores new citations in the DB, where citations is a list of tuples with
+    the arguments of store_citation (without app, canonical_citing can be
+    omitted). Citations that already exist are ignored. Returns the list of
+    (citing, content) that were new.
+    """
+    now = get_date()
+    values = OrderedDict()
+    for citation in citations:
+        citation_change, content_type, raw_metadata, parsed_metadata, status = citation[:5]
+        canonical_citing = citation[5] if len(citation) > 5 else None
+        values.setdefault((citation_change.citing, citation_change.content), {
+            'citing': citation_change.citing,
+            'canonical_citing': canonical_citing,
+            'cited': citation_change.cited,
+            'content': citation_change.content,
+            'resolved': citation_change.resolved,
+            'timestamp': citation_change.timestamp.ToDatetime().replace(tzinfo=tzutc()),
+            'status': status,
+            'created': now,
+        })
+    if len(values) == 0:
+        return []
+    with _session_scope(app) as session:
+        stmt = insert(Citation.__table__).values(list(values.values()))
+        stmt = stmt.on_conflict_do_nothing(index_elements=['citing', 'content']).returning(*Citation.__table__.c)
+        rows = session.execute(stmt).fetchall()
+        _insert_versions_session(session, Citation, rows)
+        _commit(session)
+    new_citations = set((row['citing'], row['content']) for row in rows)
+    stored_citations = [key for key in values if key in new_citations]
+    for citation in citations:
+        citation_change = citation[0]
+        if (citation_change.citing, citation_change.content) in new_citations:
+            new_citations.remove((citation_change.citing, citation_change.content)) # Duplicates in the input are ignored
+            logger.info("Stored new citation (citing '%s', content '%s' and timestamp '%s')", citation_change.citing, citation_change.content, citation_change.timestamp.ToJsonString())
+        else:
+            logger.error("Ignoring new citation (citing '%s', content '%s' and timestamp '%s') because it already exists in the database when it is not supposed to (race condition?)", citation_change.citing, citation_change.content, citation_change.timestamp.ToJsonString())
+    return stored_citations
+
+def store_citation(app, citation_change, content_type, raw_metadata, parsed_metadata, status, canonical_citing=None):
     """
     Stores a new citation in the DB
     """
-    stored = False
-    with app.session_scope() as session:
-        citation = Citation()
-        citation.citing = citation_change.citing
-        citation.cited = citation_change.cited
-        citation.content = citation_change.content
-        citation.resolved = citation_change.resolved
-        citation.timestamp = citation_change.timestamp.ToDatetime().replace(tzinfo=tzutc())
-        citation.status = status
-        session.add(citation)
-        try:
-            session.commit()
-        except IntegrityError as e:
-            # IntegrityError: (psycopg2.IntegrityError) duplicate key value violates unique constraint "citing_content_unique_constraint"
-            logger.error("Ignoring new citation (citing '%s', content '%s' and timestamp '%s') because it already exists in the database when it is not supposed to (race condition?): '%s'", citation_change.citing, citation_change.content, citation_change.timestamp.ToJsonString(), str(e))
-        else:
-            logger.info("Stored new citation (citing '%s', content '%s' and timestamp '%s')", citation_change.citing, citation_change.content, citation_change.timestamp.ToJsonString())
-            stored = True
+    stored = len(store_citations_bulk(app, [(citation_change, content_type, raw_metadata, parsed_metadata, status, canonical_citing)])) > 0
     return stored
 
 def store_reader_data(app, reader_change, status):
@@ -233,15 +575,16 @@ def store_reader_data(app, reader_change, status):
     Stores a new citation in the DB
     """
     stored = False
-    with app.session_scope() as session:
+    with _session_scope(app) as session:
         reads = Reader()
         reads.bibcode = reader_change['bibcode']
         reads.reader = reader_change['reader']
         reads.timestamp = reader_change['timestamp']#.ToDatetime().replace(tzinfo=tzutc())
         reads.status = status
-        session.add(reads)
         try:
-            session.commit()
+            with _savepoint(session):
+                session.add(reads)
+                _commit(session)
         except IntegrityError as e:
             # IntegrityError: (psycopg2.IntegrityError) duplicate key value violates unique constraint "citing_content_unique_constraint"
             logger.error("Ignoring new reader information (bibcode '%s', reader '%s') because it already exists in the database when it is not supposed to (race condition?): '%s'", reader_change['bibcode'], reader_change['readers'], str(e))
@@ -255,7 +598,7 @@ def get_citation_target_count(app):
     Return the number of citation targets registered in the database
     """
     citation_target_count = 0
-    with app.session_scope() as session:
+    with _session_scope(app) as session:
         citation_target_count = session.query(CitationTarget).count()
     return citation_target_count
 
@@ -264,13 +607,19 @@ def get_citation_count(app):
     Return the number of citations registered in the database
     """
     citation_count = 0
-    with app.session_scope() as session:
+    with _session_scope(app) as session:
         citation_count = session.query(Citation).count()
     return citation_count
 
+# Columns read by _extract_key_citation_target_data, listings do not load the
+# rest (e.g., the raw metadata can be a large XML document)
+_key_citation_target_columns = (CitationTarget.content, CitationTarget.content_type, CitationTarget.bibcode,
+                                CitationTarget.parsed_cited_metadata, CitationTarget.curated_metadata, CitationTarget.associated_works)
+
 def _extract_key_citation_target_data(records_db, disable_filter=False):
     """
-    Convert list of CitationTarget to a list of dictionaries with key data
+    Convert list of CitationTarget (or rows with _key_citation_target_columns)
+    to a list of dictionaries with key data
     """
     records = [
         {
@@ -287,19 +636,28 @@ def _extract_key_citation_target_data(records_db, disable_filter=False):
     ]
     return records
 
+def _get_citation_targets_by_bibcode_session(session, bibcodes, only_status='REGISTERED', chunk_size=1000):
+    """
+    Actual calls to database session for get_citation_targets_by_bibcode
+    """
+    matches = {}
+    unique_bibcodes = list(dict.fromkeys(bibcodes))
+    for i in range(0, len(unique_bibcodes), chunk_size):
+        query = session.query(*_key_citation_target_columns).filter(CitationTarget.bibcode.in_(unique_bibcodes[i:i+chunk_size]))
+        if only_status:
+            query = query.filter(CitationTarget.status == only_status)
+        for record_db in query.order_by(CitationTarget.content):
+            # Keep only the first match per bibcode
+            matches.setdefault(record_db.bibcode, record_db)
+    return [matches[bibcode] for bibcode in bibcodes if bibcode in matches]
+
 def get_citation_targets_by_bibcode(app, bibcodes, only_status='REGISTERED'):
     """
     Return a list of dict with the requested citation targets based on their bibcode
+    (one per requested bibcode that matches a citation target, in the same order)
     """
-    with app.session_scope() as session:
-        records_db = []
-        for bibcode in bibcodes:
-            if only_status:
-                record_db = session.query(CitationTarget).filter(CitationTarget.bibcode == bibcode).filter_by(status=only_status).first()
-            else:
-                record_db = session.query(CitationTarget).filter(CitationTarget.bibcode == bibcode).first()
-            if record_db:
-                records_db.append(record_db)
+    with _session_scope(app) as session:
+        records_db = _get_citation_targets_by_bibcode_session(session, bibcodes, only_status=only_status)
 
         if only_status:
             disable_filter = only_status == 'DISCARDED'
@@ -308,19 +666,33 @@ def get_citation_targets_by_bibcode(app, bibcodes, only_status='REGISTERED'):
         records = _extract_key_citation_target_data(records_db, disable_filter=disable_filter)
     return records
 
+def _get_citation_targets_by_alt_bibcode_session(session, alt_bibcodes, only_status='REGISTERED', chunk_size=1000):
+    """
+    Actual calls to database session for get_citation_targets_by_alt_bibcode
+    """
+    matches = {}
+    unique_alt_bibcodes = list(dict.fromkeys(alt_bibcodes))
+    for i in range(0, len(unique_alt_bibcodes), chunk_size):
+        chunk = unique_alt_bibcodes[i:i+chunk_size]
+        # JSONB operator '?|': the list of alternate bibcodes contains any of the requested ones
+        query = session.query(*_key_citation_target_columns).filter(CitationTarget.parsed_cited_metadata['alternate_bibcode'].has_any(array(chunk)))
+        if only_status:
+            query = query.filter(CitationTarget.status == only_status)
+        requested = set(chunk)
+        for record_db in query.order_by(CitationTarget.content):
+            # Keep only the first match per alternate bibcode
+            for alt_bibcode in record_db.parsed_cited_metadata.get('alternate_bibcode', []):
+                if alt_bibcode in requested:
+                    matches.setdefault(alt_bibcode, record_db)
+    return [matches[alt_bibcode] for alt_bibcode in alt_bibcodes if alt_bibcode in matches]
+
 def get_citation_targets_by_alt_bibcode(app, alt_bibcodes, only_status='REGISTERED'):
     """
-    Return a list of dict with the requested citation targets based on their bibcode
+    Return a list of dict with the requested citation targets based on their alternate bibcodes
+    (one per requested bibcode that matches a citation target, in the same order)
     """
-    with app.session_scope() as session:
-        records_db = []
-        for alt_bibcode in alt_bibcodes:
-            if only_status:
-                record_db = session.query(CitationTarget).filter(CitationTarget.parsed_cited_metadata['alternate_bibcode'].contains([alt_bibcode])).filter_by(status=only_status).first()
-            else:
-                record_db = session.query(CitationTarget).filter(CitationTarget.parsed_cited_metadata['alternate_bibcode'].contains([alt_bibcode])).first()
-            if record_db:
-                records_db.append(record_db)
+    with _session_scope(app) as session:
+        records_db = _get_citation_targets_by_alt_bibcode_session(session, alt_bibcodes, only_status=only_status)
 
         if only_status:
             disable_filter = only_status == 'DISCARDED'
@@ -334,25 +706,30 @@ def get_citation_targets_by_doi(app, dois, only_status='REGISTERED'):
     Return a list of dict with the requested citation targets based on their DOI
     - Records without a bibcode in the database will not be returned
     """
-    with app.session_scope() as session:
+    with _session_scope(app) as session:
         if only_status:
-            records_db = session.query(CitationTarget).filter(CitationTarget.content.in_(dois)).filter_by(status=only_status).all()
+            records_db = session.query(*_key_citation_target_columns).filter(CitationTarget.content.in_(dois)).filter(CitationTarget.status == only_status).all()
             disable_filter = only_status == 'DISCARDED'
         else:
-            records_db = session.query(CitationTarget).filter(CitationTarget.content.in_(dois)).all()
+            records_db = session.query(*_key_citation_target_columns).filter(CitationTarget.content.in_(dois)).all()
             disable_filter = True
         records = _extract_key_citation_target_data(records_db, disable_filter=disable_filter)
     return records
 
-def _get_citation_targets_session(session, only_status='REGISTERED'):
+def _get_citation_targets_session(session, only_status='REGISTERED', after_content=None, last_content=None):
     """
     Actual calls to database session for get_citation_targets
     """
+    query = session.query(*_key_citation_target_columns)
+    if after_content is not None:
+        query = query.filter(CitationTarget.content > after_content)
+    if last_content is not None:
+        query = query.filter(CitationTarget.content <= last_content)
     if only_status:
-        records_db = session.query(CitationTarget).filter_by(status=only_status).all()
+        records_db = query.filter(CitationTarget.status == only_status).all()
         disable_filter = only_status in ['DISCARDED', 'EMITTABLE']
     else:
-        records_db = session.query(CitationTarget).all()
+        records_db = query.all()
         disable_filter = True
     records = _extract_key_citation_target_data(records_db, disable_filter=disable_filter)
     return records
@@ -375,13 +752,15 @@ def get_associated_works_by_doi(app, all_versions_doi, only_status='REGISTERED')
         logger.info('No associated works for %s in database', dois[0])
         return None
         
-def get_citation_targets(app, only_status='REGISTERED'):
+def get_citation_targets(app, only_status='REGISTERED', after_content=None, last_content=None):
     """
     Return a list of dict with all citation targets (or only the registered ones)
     - Records without a bibcode in the database will not be returned
+    - If after_content and/or last_content are specified, only the targets
+      with content in the range (after_content, last_content] are returned
     """
-    with app.session_scope() as session:
-        records = _get_citation_targets_session(session, only_status)
+    with _session_scope(app) as session:
+        records = _get_citation_targets_session(session, only_status, after_content=after_content, last_content=last_content)
     return records
 
 def _get_citation_target_metadata_session(session, doi, citation_in_db, metadata, curate=True, concept=False):
@@ -415,7 +794,7 @@ def get_citation_target_metadata(app, doi, curate=True, concept=False):
     """
     citation_in_db = False
     metadata = {}
-    with app.session_scope() as session:
+    with _session_scope(app) as session:
         metadata = _get_citation_target_metadata_session(session, doi, citation_in_db, metadata, curate, concept) 
     return metadata
 
@@ -426,43 +805,63 @@ def get_citation_target_entry_date(app, doi):
     """
     citation_in_db = False
     entry_date = None
-    with app.session_scope() as session:
-        citation_target = session.query(CitationTarget).filter_by(content=doi).first()
+    with _session_scope(app) as session:
+        citation_target = session.query(CitationTarget.created).filter(CitationTarget.content == doi).first()
         citation_target_in_db = citation_target is not None
         if citation_target_in_db:
             entry_date = citation_target.created
     return entry_date
 
-def get_citations_by_bibcode(app, bibcode):
+def get_citations_by_bibcode(app, bibcode, with_canonical=False):
     """
     Transform bibcode into content and get all the citations by content.
     It will ignore DELETED and DISCARDED citations and citations targets.
+    If with_canonical is True, (citing, canonical_citing) tuples are returned.
     """
     citations = []
     if bibcode is not None:
-        with app.session_scope() as session:
+        with _session_scope(app) as session:
             #bibcode = "2015zndo.....14475J"
-            citation_target = session.query(CitationTarget).filter(CitationTarget.bibcode == bibcode).filter_by(status="REGISTERED").first()
+            citation_target = session.query(CitationTarget.content).filter(CitationTarget.bibcode == bibcode).filter(CitationTarget.status == "REGISTERED").first()
             if citation_target:
                 dummy_citation_change = CitationChange(content=citation_target.content)
-                citations = get_citations(app, dummy_citation_change)
+                citations = get_citations(app, dummy_citation_change, with_canonical=with_canonical)
     return citations
 
-def get_citations(app, citation_change):
+def get_citations(app, citation_change, with_canonical=False):
     """
     Return all the citations (bibcodes) to a given content.
     It will ignore DELETED and DISCARDED citations.
+    If with_canonical is True, (citing, canonical_citing) tuples are returned.
     """
-    with app.session_scope() as session:
-        citation_bibcodes = [r.citing for r in session.query(Citation).filter_by(content=citation_change.content, status="REGISTERED").all()]
+    with _session_scope(app) as session:
+        query = session.query(Citation.citing, Citation.canonical_citing).filter_by(content=citation_change.content, status="REGISTERED").order_by(Citation.id)
+        if with_canonical:
+            citation_bibcodes = [(citing, canonical_citing) for citing, canonical_citing in query]
+        else:
+            citation_bibcodes = [citing for citing, canonical_citing in query]
     return citation_bibcodes
 
+def update_canonical_citing(app, canonical_bibcodes):
+    """
+    Store the canonical form of citing bibcodes (dictionary that maps citing
+    to canonical bibcodes) in all their citations
+    """
+    if len(canonical_bibcodes) == 0:
+        return
+    table = Citation.__table__
+    with _session_scope(app) as session:
+        stmt = table.update().where(table.c.citing == bindparam('b_citing')).where(table.c.canonical_citing.is_distinct_from(bindparam('b_canonical')))
+        stmt = stmt.values(canonical_citing=bindparam('b_canonical'), updated=get_date())
+        session.execute(stmt, [{'b_citing': citing, 'b_canonical': canonical} for citing, canonical in canonical_bibcodes.items()])
+        _commit(session)
+
 def get_citation_target_readers(app, bibcode, alt_bibcodes):
     """
     Return all the Reader hashes for a given content.
     It will ignore DELETED and DISCARDED hashes.
     """
-    with app.session_scope() as session:
+    with _session_scope(app) as session:
         reader_hashes = [r.reader for r in session.query(Reader).filter_by(bibcode=bibcode, status="REGISTERED").all()]
         for alt_bibcode in alt_bibcodes:
             reader_hashes = reader_hashes + [r.reader for r in session.query(Reader).filter_by(bibcode=alt_bibcode, status="REGISTERED").all()]
@@ -491,22 +890,325 @@ def generate_modified_metadata(parsed_metadata, curated_entry):
         curated_entry.pop(key)
     return modified_metadata
 
+def _citation_already_exists_session(session, citing, content):
+    """
+    Actual calls to database session for citation_already_exists
+    """
+    citation = session.query(Citation).filter_by(citing=citing, content=content).first()
+    return citation is not None
+
 def citation_already_exists(app, citation_change):
     """
     Is this citation already stored in the DB?
     """
     citation_in_db = False
-    with app.session_scope() as session:
-        citation = session.query(Citation).filter_by(citing=citation_change.citing, content=citation_change.content).first()
-        citation_in_db = citation is not None
+    with _session_scope(app) as session:
+        citation_in_db = _citation_already_exists_session(session, citation_change.citing, citation_change.content)
     return citation_in_db
 
+def get_existing_citations(app, citing_content_pairs):
+    """
+    Return the set of (citing, content) pairs that are already stored in the DB,
+    checking all of them with a single query.
+    """
+    existing_citations = set()
+    citing_content_pairs = list(set(citing_content_pairs))
+    if len(citing_content_pairs) == 0:
+        return existing_citations
+    with _session_scope(app) as session:
+        rows = session.query(Citation.citing, Citation.content).filter(tuple_(Citation.citing, Citation.content).in_(citing_content_pairs)).all()
+        existing_citations = set((citing, content) for citing, content in rows)
+    return existing_citations
+
+def get_stored_canonical_bibcodes(app, bibcodes, max_age):
+    """
+    Return a dictionary with the canonical form of the bibcodes that were
+    resolved and stored less than max_age seconds ago
+    """
+    canonical_bibcodes = {}
+    bibcodes = list(set(bibcodes))
+    if len(bibcodes) == 0:
+        return canonical_bibcodes
+    oldest_valid_date = get_date() - datetime.timedelta(seconds=max_age)
+    with _session_scope(app) as session:
+        rows = session.query(CanonicalBibcode.bibcode, CanonicalBibcode.canonical).filter(CanonicalBibcode.bibcode.in_(bibcodes)).filter(CanonicalBibcode.updated >= oldest_valid_date).all()
+        canonical_bibcodes = dict((bibcode, canonical) for bibcode, canonical in rows)
+    return canonical_bibcodes
+
+def store_canonical_bibcodes(app, canonical_bibcodes, chunk_size=1000):
+    """
+    Insert or refresh the canonical form of a dictionary of bibcodes, writing
+    at most chunk_size rows per statement
+    """
+    if len(canonical_bibcodes) == 0:
+        return
+    now = get_date()
+    values = [{'bibcode': bibcode, 'canonical': canonical, 'created': now, 'updated': now} for bibcode, canonical in canonical_bibcodes.items()]
+    with _session_scope(app) as session:
+        for i in range(0, len(values), chunk_size):
+            stmt = insert(CanonicalBibcode.__table__).values(values[i:i+chunk_size])
+            stmt = stmt.on_conflict_do_update(index_elements=['bibcode'], set_={'canonical': stmt.excluded.canonical, 'updated': stmt.excluded.updated})
+            session.execute(stmt)
+        _commit(session)
+
+def get_concept_doi_versions(app, concept_doi, max_age):
+    """
+    Return the versions of a concept DOI if they were stored less than
+    max_age seconds ago, None otherwise (DOIs are case insensitive)
+    """
+    oldest_valid_date = get_date() - datetime.timedelta(seconds=max_age)
+    with _session_scope(app) as session:
+        row = session.query(ConceptDoiVersions.versions).filter(ConceptDoiVersions.content == concept_doi.lower()).filter(ConceptDoiVersions.updated >= oldest_valid_date).first()
+    return row.versions if row is not None else None
+
+def store_concept_doi_versions(app, concept_doi, versions):
+    """
+    Insert or refresh the versions of a concept DOI
+    """
+    now = get_date()
+    with _session_scope(app) as session:
+        stmt = insert(ConceptDoiVersions.__table__).values(content=concept_doi.lower(), versions=versions, created=now, updated=now)
+        stmt = stmt.on_conflict_do_update(index_elements=['content'], set_={'versions': stmt.excluded.versions, 'updated': stmt.excluded.updated})
+        session.execute(stmt)
+        _commit(session)
+
+def get_doi_metadata_cache(app, dois):
+    """
+    Return a dictionary with the validators (source, etag, last_modified and
+    content_hash) of the last metadata fetch for each DOI
+    """
+    cached = {}
+    dois = list(set(dois))
+    if len(dois) == 0:
+        return cached
+    with _session_scope(app) as session:
+        rows = session.query(DoiMetadataCache).filter(DoiMetadataCache.content.in_(dois)).all()
+        for row in rows:
+            cached[row.content] = {
+                'source': row.source,
+                'etag': row.etag,
+                'last_modified': row.last_modified,
+                'content_hash': row.content_hash,
+            }
+    return cached
+
+def store_doi_metadata_cache(app, content, validators):
+    """
+    Insert or refresh the validators of the last metadata fetch for a DOI
+    """
+    now = get_date()
+    values = {'content': content, 'created': now, 'updated': now}
+    for key in ('source', 'etag', 'last_modified', 'content_hash'):
+        values[key] = validators.get(key, None)
+    with _session_scope(app) as session:
+        stmt = insert(DoiMetadataCache.__table__).values(values)
+        stmt = stmt.on_conflict_do_update(index_elements=['content'], set_=dict((key, stmt.excluded[key]) for key in ('source', 'etag', 'last_modified', 'content_hash', 'updated')))
+        session.execute(stmt)
+        _commit(session)
+
+def create_maintenance_job(app, name, params, statuses, chunk_size):
+    """
+    Register a maintenance job that splits the citation targets with the
+    given statuses in chunks of consecutive contents and return its id.
+    Chunks are contiguous ranges (after_content, last_content] and the last
+    one is open-ended so that targets created meanwhile are not left out.
+    """
+    with _session_scope(app) as session:
+        job = MaintenanceJob(name=name, params=params, n_chunks=0, status='PENDING')
+        session.add(job)
+        session.flush()
+        after_content = None
+        chunks = []
+        while True:
+            # Keyset pagination over the primary key
+            query = session.query(CitationTarget.content).filter(CitationTarget.status.in_(statuses))
+            if after_content is not None:
+                query = query.filter(CitationTarget.content > after_content)
+            contents = [content for content, in query.order_by(CitationTarget.content).limit(chunk_size)]
+            if len(contents) == 0:
+                break
+            chunks.append(MaintenanceJobChunk(job_id=job.id, after_content=after_content, last_content=contents[-1], n_records=len(contents), status='PENDING'))
+            after_content = contents[-1]
+        if len(chunks) > 0:
+            chunks[-1].last_content = None
+        else:
+            job.status = 'DONE'
+        session.add_all(chunks)
+        job.n_chunks = len(chunks)
+        _commit(session)
+        job_id = job.id
+    return job_id
+
+def get_maintenance_job(app, job_id):
+    """
+    Return a dict with the maintenance job or None if it does not exist
+    """
+    job = None
+    with _session_scope(app) as session:
+        job_db = session.query(MaintenanceJob).filter_by(id=job_id).first()
+        if job_db:
+            n_pending_chunks = session.query(MaintenanceJobChunk).filter_by(job_id=job_id, status='PENDING').count()
+            job = {
+                'id': job_db.id,
+                'name': job_db.name,
+                'params': job_db.params if job_db.params is not None else {},
+                'n_chunks': job_db.n_chunks,
+                'n_pending_chunks': n_pending_chunks,
+                'status': job_db.status,
+            }
+    return job
+
+def get_pending_maintenance_chunks(app, job_id):
+    """
+    Return the ids of the chunks of a maintenance job that are not done yet
+    """
+    with _session_scope(app) as session:
+        chunk_ids = [chunk_id for chunk_id, in session.query(MaintenanceJobChunk.id).filter_by(job_id=job_id, status='PENDING').order_by(MaintenanceJobChunk.id)]
+    return chunk_ids
+
+def get_maintenance_job_chunk(app, chunk_id):
+    """
+    Return a dict with the chunk (range of contents) or None if it does not exist
+    """
+    chunk = None
+    with _session_scope(app) as session:
+        chunk_db = session.query(MaintenanceJobChunk).filter_by(id=chunk_id).first()
+        if chunk_db:
+            chunk = {
+                'id': chunk_db.id,
+                'job_id': chunk_db.job_id,
+                'after_content': chunk_db.after_content,
+                'last_content': chunk_db.last_content,
+                'n_records': chunk_db.n_records,
+                'status': chunk_db.status,
+            }
+    return chunk
+
+def mark_maintenance_chunk_as_done(app, chunk_id):
+    """
+    Mark a chunk as done (and its job if it was the last pending chunk) and
+    return the number of chunks of the job that are still pending
+    """
+    with _session_scope(app) as session:
+        chunk = session.query(MaintenanceJobChunk).filter_by(id=chunk_id).first()
+        # Lock the job to serialize chunks finishing at the same time
+        job = session.query(MaintenanceJob).filter_by(id=chunk.job_id).with_for_update().first()
+        chunk.status = 'DONE'
+        session.flush()
+        n_pending_chunks = session.query(MaintenanceJobChunk).filter_by(job_id=job.id, status='PENDING').count()
+        if n_pending_chunks == 0:
+            job.status = 'DONE'
+        _commit(session)
+    return n_pending_chunks
+
+def mark_citation_target_as_dirty(app, content, status):
+    """
+    Register that the record of a citation target has to be forwarded to
+    master, marks of the same target are coalesced in a single row until it
+    is flushed. Return True if the target was not already marked (i.e., a
+    flush has to be scheduled).
+    """
+    table = DirtyCitationTarget.__table__
+    with _session_scope(app) as session:
+        now = get_date()
+        stmt = insert(table).values(content=content, status=status, n_marks=1, created=now, updated=now)
+        stmt = stmt.on_conflict_do_update(index_elements=['content'], set_={'status': stmt.excluded.status, 'n_marks': table.c.n_marks + 1, 'updated': stmt.excluded.updated})
+        n_marks = session.execute(stmt.returning(table.c.n_marks)).scalar()
+        _commit(session)
+    return n_marks == 1
+
+def pop_dirty_citation_targets(app, contents=None):
+    """
+    Remove and return the dirty citation targets (all of them or only the
+    given contents) as a list of dicts sorted by content. Rows being flushed
+    by a concurrent transaction are skipped.
+    """
+    table = DirtyCitationTarget.__table__
+    with _session_scope(app) as session:
+        query = select([table.c.content])
+        if contents is not None:
+            query = query.where(table.c.content.in_(contents))
+        query = query.with_for_update(skip_locked=True)
+        stmt = table.delete().where(table.c.content.in_(query)).returning(table.c.content, table.c.status, table.c.n_marks)
+        dirty_targets = [{'content': content, 'status': status, 'n_marks': n_marks} for content, status, n_marks in session.execute(stmt)]
+        _commit(session)
+    dirty_targets.sort(key=lambda dirty_target: dirty_target['content'])
+    return dirty_targets
+
+def get_dirty_citation_target_contents(app, contents=None):
+    """
+    Return the contents of the dirty citation targets (all of them or only
+    the given contents) without locking them, which includes the rows that
+    pop_dirty_citation_targets skipped because they were locked
+    """
+    table = DirtyCitationTarget.__table__
+    with _session_scope(app) as session:
+        query = select([table.c.content])
+        if contents is not None:
+            query = query.where(table.c.content.in_(contents))
+        dirty_contents = [content for content, in session.execute(query.order_by(table.c.content))]
+    return dirty_contents
+
+def defer_citation(app, citing, content, citation_change):
+    """
+    Store a new citation change (as a dict) whose citing bibcode could not be
+    resolved, so that it is processed once the bibcode exists. If the same
+    citation was already deferred, the most recent change is kept.
+    """
+    table = DeferredCitation.__table__
+    with _session_scope(app) as session:
+        now = get_date()
+        stmt = insert(table).values(citing=citing, content=content, citation_change=citation_change, attempts=0, created=now, updated=now)
+        stmt = stmt.on_conflict_do_update(index_elements=['citing', 'content'], set_={'citation_change': stmt.excluded.citation_change, 'updated': stmt.excluded.updated})
+        session.execute(stmt)
+        _commit(session)
+
+def get_deferred_citations(app):
+    """
+    Return all the deferred citations as a list of dicts, rows are locked until
+    the end of the current transaction and rows locked by a concurrent
+    transaction are skipped
+    """
+    table = DeferredCitation.__table__
+    with _session_scope(app) as session:
+        query = select([table.c.citing, table.c.content, table.c.citation_change, table.c.attempts]).order_by(table.c.created).with_for_update(skip_locked=True)
+        deferred_citations = [dict(row) for row in session.execute(query)]
+    return deferred_citations
+
+def delete_deferred_citations(app, citing_content_pairs):
+    """
+    Remove deferred citations given a list of (citing, content) tuples
+    """
+    if len(citing_content_pairs) == 0:
+        return 0
+    table = DeferredCitation.__table__
+    with _session_scope(app) as session:
+        n_deleted = session.execute(table.delete().where(tuple_(table.c.citing, table.c.content).in_(citing_content_pairs))).rowcount
+        _commit(session)
+    return n_deleted
+
+def mark_deferred_citations_as_checked(app, citing_content_pairs, max_attempts):
+    """
+    Count a new check for deferred citations whose citing bibcode is still
+    not resolved. Citations checked max_attempts times are discarded, the
+    number of discarded citations is returned.
+    """
+    if len(citing_content_pairs) == 0:
+        return 0
+    table = DeferredCitation.__table__
+    with _session_scope(app) as session:
+        pairs = tuple_(table.c.citing, table.c.content).in_(citing_content_pairs)
+        session.execute(table.update().where(pairs).values(attempts=table.c.attempts + 1, updated=get_date()))
+        n_discarded = session.execute(table.delete().where(pairs).where(table.c.attempts >= max_attempts)).rowcount
+        _commit(session)
+    return n_discarded
+
 def update_citation(app, citation_change):
     """
     Update cited information
     """
     updated = False
-    with app.session_scope() as session:
+    with _session_scope(app) as session:
         citation = session.query(Citation).with_for_update().filter_by(citing=citation_change.citing, content=citation_change.content).first()
         change_timestamp = citation_change.timestamp.ToDatetime().replace(tzinfo=tzutc()) # Consider it as UTC to be able to compare it
         if citation.timestamp < change_timestamp:
@@ -516,7 +1218,7 @@ def update_citation(app, citation_change):
             citation.resolved = citation_change.resolved
             citation.timestamp = change_timestamp
             session.add(citation)
-            session.commit()
+            _commit(session)
             updated = True
             logger.info("Updated citation (citing '%s', content '%s' and timestamp '%s')", citation_change.citing, citation_change.content, citation_change.timestamp.ToJsonString())
         else:
@@ -529,7 +1231,7 @@ def mark_citation_as_deleted(app, citation_change):
     """
     marked_as_deleted = False
     previous_status = None
-    with app.session_scope() as session:
+    with _session_scope(app) as session:
         citation = session.query(Citation).with_for_update().filter_by(citing=citation_change.citing, content=citation_change.content).first()
         previous_status = citation.status
         change_timestamp = citation_change.timestamp.ToDatetime().replace(tzinfo=tzutc()) # Consider it as UTC to be able to compare it
@@ -537,7 +1239,7 @@ def mark_citation_as_deleted(app, citation_change):
             citation.status = "DELETED"
             citation.timestamp = change_timestamp
             session.add(citation)
-            session.commit()
+            _commit(session)
             marked_as_deleted = True
             logger.info("Marked citation as deleted (citing '%s', content '%s' and timestamp '%s')", citation_change.citing, citation_change.content, citation_change.timestamp.ToJsonString())
         else:
@@ -550,7 +1252,7 @@ def mark_reader_as_deleted(app, reader_change):
     """
     marked_as_deleted = False
     previous_status = None
-    with app.session_scope() as session:
+    with _session_scope(app) as session:
         reader = session.query(Reader).with_for_update().filter_by(bibcode=reader_change['bibcode'], reader=reader_change['reader']).first()
         previous_status = reader.status
         change_timestamp = reader_change['timestamp']#.ToDatetime().replace(tzinfo=tzutc()) # Consider it as UTC to be able to compare it
@@ -558,7 +1260,7 @@ def mark_reader_as_deleted(app, reader_change):
             reader.status = "DELETED"
             reader.timestamp = reader_change['timestamp']
             session.add(reader)
-            session.commit()
+            _commit(session)
             marked_as_deleted = True
             logger.info("Marked reader as deleted (citing '%s', content '%s')", reader_change['bibcode'], reader_change['reader'])#, reader_change.timestamp.ToJsonString())
         else:
@@ -571,12 +1273,12 @@ def mark_all_discarded_citations_as_registered(app, content):
     """
     marked_as_registered = False
     previous_status = None
-    with app.session_scope() as session:
+    with _session_scope(app) as session:
         citations = session.query(Citation).with_for_update().filter_by(status='DISCARDED', content=content).all()
         for citation in citations:
             citation.status = 'REGISTERED'
             session.add(citation)
-        session.commit()
+        _commit(session)
 
 def populate_bibcode_column(main_session):
     """
@@ -53,6 +53,7 @@ class DeltaComputation():
         self.input_refids_filename = None
         self.group_changes_in_chunks_of=group_changes_in_chunks_of
         self.offset = 0
+        self.last_id = 0
         self.n_changes = 0
         self.force = force
         self.last_modification_date = None
@@ -65,6 +66,7 @@ class DeltaComputation():
         :param input_refids_filename: Path to the file to be imported.
         """
         self.offset = 0
+        self.last_id = 0
         self.input_refids_filename = input_refids_filename
         self._setup_schemas()
         if self.force or self.joint_table_name not in Inspector.from_engine(self.engine).get_table_names(schema=self.schema_name):
@@ -108,13 +110,23 @@ class DeltaComputation():
         return self
 
     def __next__(self): # Python 3: def __next__(self)
-        """Iterates over the results, grouping changes in chunks"""
+        """
+        Iterates over the results, grouping changes in chunks.
+
+        Changes are retrieved in primary key order using keyset pagination
+        (i.e., only rows with an id greater than the last one returned), thus
+        every iteration reads only its own chunk instead of re-scanning the
+        table up to an offset.
+        """
         if self.offset >= self.n_changes or self.n_changes == 0:
             raise StopIteration
         else:
             citation_changes = adsmsg.CitationChanges()
+            last_id = self.last_id
             # Get citation changes from DB
-            for instance in self._citation_changes_query().offset(self.offset).limit(self.group_changes_in_chunks_of).yield_per(100):
+            sqlalchemy_query = self._citation_changes_query().filter(CitationChanges.id > self.last_id).order_by(CitationChanges.id)
+            for instance in sqlalchemy_query.limit(self.group_changes_in_chunks_of).yield_per(100):
+                last_id = instance.id
                 ## Build protobuf message
                 citation_change = citation_changes.changes.add()
                 # Use new_ or previous_ fields depending if status is NEW/UPDATED or DELETED
@@ -135,7 +147,10 @@ class DeltaComputation():
                 citation_change.status = getattr(adsmsg.Status, instance.status.lower())
             self.session.commit()
 
-            self.offset += self.group_changes_in_chunks_of
+            if len(citation_changes.changes) == 0:
+                raise StopIteration
+            self.last_id = last_id
+            self.offset += len(citation_changes.changes)
             return citation_changes
 
     def _setup_schemas(self):
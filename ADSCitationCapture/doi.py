@@ -1,9 +1,10 @@
 import os
 from dateutil.parser import parse
-import requests
+from ADSCitationCapture import http_session
 import re
 import json
 import base64
+import hashlib
 from pyingest.parsers.datacite import DataCiteParser
 # ============================= INITIALIZATION ==================================== #
 # - Use app logger:
@@ -23,14 +24,15 @@ upper_case_az_character_re = re.compile("[A-Z]")
 
 
 # =============================== FUNCTIONS ======================================= #
-def _fetch_metadata(url, headers={}, timeout=30):
+def _fetch_metadata_response(url, headers={}, timeout=30):
     """
-    Fetches DOI metadata
+    Fetches DOI metadata and returns the HTTP response
     """
     record_found = False
     try_later = False
+    r = None
     try:
-        r = requests.get(url, headers=headers, timeout=timeout)
+        r = http_session.get(url, headers=headers, timeout=timeout)
     except:
         logger.exception("HTTP request failed: %s", url)
         try_later = True
@@ -47,11 +49,7 @@ def _fetch_metadata(url, headers={}, timeout=30):
             logger.error("HTTP request with error code '%s' for: %s", r.status_code, url)
         else:
             record_found = True
-
-    content = None
-    if not try_later and record_found:
-        content = r.text
-    return try_later, record_found, content
+    return try_later, record_found, r
 
 def _decode_datacite_content(alt_content):
     """
@@ -74,10 +72,29 @@ def _decode_datacite_content(alt_content):
                 pass
     return decoded_alt_content
 
-def fetch_metadata(base_doi_url, base_datacite_url, doi):
+def _conditional_headers(headers, url, cached):
+    """
+    Add validators from a previous fetch of the same URL so that the server
+    can answer '304 Not Modified'
+    """
+    headers = dict(headers)
+    if cached and cached.get('source') == url:
+        if cached.get('etag'):
+            headers["If-None-Match"] = cached['etag']
+        if cached.get('last_modified'):
+            headers["If-Modified-Since"] = cached['last_modified']
+    return headers
+
+def _fetch_datacite_metadata(base_doi_url, base_datacite_url, doi, cached=None):
     """
     Fetches DOI metadata in datacite format from doi.org or, alternatively,
-    api.datacite.org if the former fails
+    api.datacite.org if the former fails. If validators from a previous fetch
+    are provided (cached), the request is conditional.
+
+    It returns a tuple (not_modified, content, source, response) where
+    not_modified is True if the server answered '304 Not Modified', content
+    is None if the record was not found, and source and response correspond
+    to the endpoint that provided the content.
     """
     headers = {}
     ## https://support.datacite.org/docs/datacite-content-resolver
@@ -86,26 +103,69 @@ def fetch_metadata(base_doi_url, base_datacite_url, doi):
     #headers["Accept"] = "application/vnd.crossref.unixref+xml;q=1" # This format does not contain software type tag
     headers["Accept"] = "application/vnd.datacite.datacite+xml;q=1"
     doi_endpoint = base_doi_url + doi
-    try_later, record_found, content = _fetch_metadata(doi_endpoint, headers=headers, timeout=30)
+    try_later, record_found, r = _fetch_metadata_response(doi_endpoint, headers=_conditional_headers(headers, doi_endpoint, cached), timeout=30)
+    if not try_later and record_found and r.status_code == 304:
+        return True, None, doi_endpoint, r
+    source = doi_endpoint
+    content = r.text if not try_later and record_found else None
 
     if try_later or not record_found or "<version/>" in content: # TODO: Temporary doi.org/crossref bug where version is not provided
         # Alternative source for metadata
         alt_doi_endpoint = base_datacite_url + doi
         alt_headers = {}
-        alt_try_later, alt_record_found, alt_content = _fetch_metadata(alt_doi_endpoint, headers=alt_headers, timeout=30)
+        alt_try_later, alt_record_found, alt_r = _fetch_metadata_response(alt_doi_endpoint, headers=_conditional_headers(alt_headers, alt_doi_endpoint, cached), timeout=30)
         if not alt_try_later and alt_record_found:
-            decoded_alt_content = _decode_datacite_content(alt_content)
+            if alt_r.status_code == 304:
+                return True, None, alt_doi_endpoint, alt_r
+            decoded_alt_content = _decode_datacite_content(alt_r.text)
             if decoded_alt_content:
                 try_later = False
                 record_found = True
                 content = decoded_alt_content
+                source = alt_doi_endpoint
+                r = alt_r
 
     if try_later:
         # Exceptions make the task to fail, and the framework will re-try automatically later on
         logger.error("HTTP request to DOI service failed: %s", doi_endpoint)
         raise Exception("HTTP request to DOI service failed: {}".format(doi_endpoint))
 
-    return content if record_found else None
+    return False, content if record_found else None, source, r
+
+def fetch_metadata(base_doi_url, base_datacite_url, doi):
+    """
+    Fetches DOI metadata in datacite format from doi.org or, alternatively,
+    api.datacite.org if the former fails
+    """
+    not_modified, content, source, r = _fetch_datacite_metadata(base_doi_url, base_datacite_url, doi)
+    return content
+
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def fetch_metadata_if_modified(base_doi_url, base_datacite_url, doi, cached=None):
+    """
+    Same as fetch_metadata but revalidating a previous fetch (cached is a
+    dictionary with 'source', 'etag', 'last_modified' and 'content_hash').
+
+    It returns a tuple (modified, content, validators) where modified is False
+    if the server answered '304 Not Modified' or the content hash did not
+    change, and validators are the values to be cached for the next fetch.
+    """
+    not_modified, content, source, r = _fetch_datacite_metadata(base_doi_url, base_datacite_url, doi, cached=cached)
+    if not_modified:
+        return False, None, cached
+    if content is None:
+        return True, None, None
+
+    validators = {
+        'source': source,
+        'etag': r.headers.get('ETag', None),
+        'last_modified': r.headers.get('Last-Modified', None),
+        'content_hash': content_hash(content),
+    }
+    modified = cached is None or cached.get('content_hash') != validators['content_hash']
+    return modified, content, validators
 
 def extract_orcids_from_affs(affiliations):
     orcids = []
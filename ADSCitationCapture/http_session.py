@@ -0,0 +1,118 @@
+import os
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# ============================= INITIALIZATION ==================================== #
+# - Use app logger:
+#import logging
+#logger = logging.getLogger('ads-citation-capture')
+# - Or individual logger for this file:
+from adsputils import setup_logging, load_config
+proj_home = os.path.realpath(os.path.join(os.path.dirname(__file__), '../'))
+config = load_config(proj_home=proj_home)
+logger = setup_logging(__name__, proj_home=proj_home,
+                        level=config.get('LOGGING_LEVEL', 'INFO'),
+                        attach_stdout=config.get('LOG_STDOUT', False))
+
+# Sessions are keyed by process id and host, hence connections are never
+# shared between celery worker processes (forked after import)
+_sessions = {}
+_semaphores = {}
+_sessions_lock = threading.Lock()
+
+
+# =============================== FUNCTIONS ======================================= #
+def _build_session(host):
+    """
+    Build a session with a connection pool and retry/backoff policy for a host
+    """
+    pool_maxsize = config.get('HTTP_POOL_MAXSIZE_PER_HOST', {}).get(host, config.get('HTTP_POOL_MAXSIZE', 10))
+    # Only connection errors and transient server errors are retried, if the
+    # server keeps failing the last response is returned to the caller
+    retries = Retry(total=config.get('HTTP_RETRIES', 2),
+                    backoff_factor=config.get('HTTP_BACKOFF_FACTOR', 0.5),
+                    status_forcelist=(502, 503, 504),
+                    raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retries)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_session(url):
+    """
+    Return the shared session for the host of the URL (keep-alive connections
+    are re-used by all the requests sent to the same host from this process)
+    """
+    host = urllib.parse.urlparse(url).netloc
+    key = (os.getpid(), host)
+    session = _sessions.get(key, None)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key, None)
+            if session is None:
+                session = _build_session(host)
+                _sessions[key] = session
+    return session
+
+def _get_semaphore(url):
+    """
+    Return the semaphore that limits the number of concurrent requests sent
+    to the host of the URL from this process
+    """
+    host = urllib.parse.urlparse(url).netloc
+    key = (os.getpid(), host)
+    semaphore = _semaphores.get(key, None)
+    if semaphore is None:
+        with _sessions_lock:
+            semaphore = _semaphores.get(key, None)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(config.get('HTTP_MAX_CONCURRENCY_PER_HOST', 8))
+                _semaphores[key] = semaphore
+    return semaphore
+
+def get(url, timeout=None, **kwargs):
+    if timeout is None:
+        timeout = config.get('HTTP_TIMEOUT', 30)
+    with _get_semaphore(url):
+        return get_session(url).get(url, timeout=timeout, **kwargs)
+
+def post(url, timeout=None, **kwargs):
+    if timeout is None:
+        timeout = config.get('HTTP_TIMEOUT', 30)
+    with _get_semaphore(url):
+        return get_session(url).post(url, timeout=timeout, **kwargs)
+
+def fetch_concurrently(fetch, items, max_workers=8):
+    """
+    Generator that calls fetch(item) for every item using a bounded pool of
+    threads and yields (item, future) tuples in the same order as the items.
+    Calling future.result() returns what fetch returned or raises the same
+    exception. At most 2*max_workers fetches are in flight or waiting to be
+    consumed, hence memory usage does not grow with the number of items.
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in itertools.islice(items, 2*max_workers):
+            pending.append((item, executor.submit(fetch, item)))
+        while len(pending) > 0:
+            item, future = pending.popleft()
+            for next_item in itertools.islice(items, 1):
+                pending.append((next_item, executor.submit(fetch, next_item)))
+            yield item, future
+
+def close_sessions():
+    """
+    Close all the sessions (and their connections) of this process
+    """
+    with _sessions_lock:
+        pid = os.getpid()
+        for key in [key for key in _sessions if key[0] == pid]:
+            _sessions.pop(key).close()
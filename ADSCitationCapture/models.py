@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Boolean, DateTime, String, Text, Integer, func, UniqueConstraint, ForeignKey
+from sqlalchemy import Column, Boolean, DateTime, String, Text, Integer, func, UniqueConstraint, ForeignKey, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy import orm
 from sqlalchemy.dialects.postgresql import ENUM, JSON, JSONB
@@ -17,6 +17,8 @@ reader_change_type = ENUM('NEW', 'DELETED', name='reader_change_type')
 reader_status_type = ENUM('REGISTERED', 'DELETED', 'DISCARDED', name='reader_status_type')
 citation_status_type = ENUM('EMITTABLE','REGISTERED', 'DELETED', 'DISCARDED', name='citation_status_type')
 target_status_type = ENUM('EMITTABLE','REGISTERED', 'DELETED', 'DISCARDED', name='target_status_type')
+maintenance_status_type = ENUM('PENDING', 'DONE', name='maintenance_status_type')
+event_status_type = ENUM('PENDING', 'EMITTED', 'FAILED', name='event_status_type')
 
         
 class RawCitation(Base):
@@ -35,7 +37,11 @@ class ReaderData(Base):
 
 class Reader(Base):
     __tablename__ = 'readers'
-    __table_args__ = ({"schema": "public"})
+    __table_args__ = (
+        Index('ix_readers_bibcode_status', 'bibcode', 'status'),
+        Index('ix_readers_bibcode_reader', 'bibcode', 'reader'),
+        {"schema": "public"}
+    )
     id = Column(Integer, primary_key=True)
     bibcode = Column(String())
     reader = Column(Text())
@@ -79,12 +85,14 @@ class Citation(Base):
     __tablename__ = 'citation'
     __table_args__ = (
         UniqueConstraint('citing', 'content', name='citing_content_unique_constraint'),
+        Index('ix_citation_content_status', 'content', 'status'),
         {"schema": "public"}
     )
     __versioned__ = {}  # Must be added to all models that are to be versioned
     id = Column(Integer, primary_key=True)
     content = Column(Text(), ForeignKey('public.citation_target.content'))
     citing = Column(Text())                         # Bibcode of the article that is citing a target
+    canonical_citing = Column(Text())               # Canonical form of the citing bibcode as registered in Solr
     cited = Column(Text())                          # Probably not necessary to keep
     resolved = Column(Boolean())                    # Probably not necessary to keep
     timestamp = Column(UTCDateTime)
@@ -95,7 +103,10 @@ class Citation(Base):
 
 class CitationTarget(Base):
     __tablename__ = 'citation_target'
-    __table_args__ = ({"schema": "public"})
+    __table_args__ = (
+        Index('ix_citation_target_bibcode', 'bibcode'),
+        {"schema": "public"}
+    )
     __versioned__ = {}  # Must be added to all models that are to be versioned
     content = Column(Text(), primary_key=True)      # DOI/URL/PID value: we assume it is unique independently what content type is
     content_type = Column(citation_content_type)
@@ -109,13 +120,90 @@ class CitationTarget(Base):
     updated = Column(UTCDateTime, onupdate=get_date)
     citations = relationship("Citation", primaryjoin="CitationTarget.content==Citation.content")
 
+# GIN index for lookups by alternate bibcode (JSONB operators '?|' and '@>')
+Index('ix_citation_target_alternate_bibcode', CitationTarget.__table__.c.parsed_cited_metadata['alternate_bibcode'], postgresql_using='gin')
+
 class Event(Base):
     __tablename__ = 'event'
-    __table_args__ = ({"schema": "public"})
+    __table_args__ = (Index('ix_event_pending', 'id', postgresql_where=text("status = 'PENDING'")),
+                      {"schema": "public"})
     id = Column(Integer, primary_key=True)
     data = Column(JSONB)
+    status = Column(event_status_type)              # PENDING events are waiting in the outbox to be emitted
+    dump_prefix = Column(Text())                    # Sub-directory where the emitted event is dumped
+    attempts = Column(Integer, default=0)           # Failed attempts to emit the event
+    next_attempt = Column(UTCDateTime)              # Do not retry emitting the event before this date
     created = Column(UTCDateTime, default=get_date)
     updated = Column(UTCDateTime, onupdate=get_date)
 
+class CanonicalBibcode(Base):
+    __tablename__ = 'canonical_bibcode'
+    __table_args__ = ({"schema": "public"})
+    bibcode = Column(Text(), primary_key=True)      # Bibcode as received (e.g., citing bibcode)
+    canonical = Column(Text())                      # Canonical form as registered in Solr
+    created = Column(UTCDateTime, default=get_date)
+    updated = Column(UTCDateTime, default=get_date, onupdate=get_date)
+
+class DoiMetadataCache(Base):
+    __tablename__ = 'doi_metadata_cache'
+    __table_args__ = ({"schema": "public"})
+    content = Column(Text(), primary_key=True)      # DOI
+    source = Column(Text())                         # URL from where the metadata was fetched
+    etag = Column(Text())
+    last_modified = Column(Text())                  # HTTP date as received
+    content_hash = Column(String(64))               # SHA-256 of the fetched raw metadata
+    created = Column(UTCDateTime, default=get_date)
+    updated = Column(UTCDateTime, default=get_date, onupdate=get_date)
+
+class ConceptDoiVersions(Base):
+    __tablename__ = 'concept_doi_versions'
+    __table_args__ = ({"schema": "public"})
+    content = Column(Text(), primary_key=True)      # Concept DOI
+    versions = Column(JSONB)                        # Versions as parsed from the concept DOI metadata
+    created = Column(UTCDateTime, default=get_date)
+    updated = Column(UTCDateTime, default=get_date, onupdate=get_date)
+
+class MaintenanceJob(Base):
+    __tablename__ = 'maintenance_job'
+    __table_args__ = ({"schema": "public"})
+    id = Column(Integer, primary_key=True)
+    name = Column(Text())                           # Maintenance operation (e.g., metadata, canonical, resend)
+    params = Column(JSONB)                          # Operation parameters (e.g., reparse, broker)
+    n_chunks = Column(Integer)
+    status = Column(maintenance_status_type)
+    created = Column(UTCDateTime, default=get_date)
+    updated = Column(UTCDateTime, onupdate=get_date)
+
+class MaintenanceJobChunk(Base):
+    __tablename__ = 'maintenance_job_chunk'
+    __table_args__ = ({"schema": "public"})
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey('public.maintenance_job.id'))
+    after_content = Column(Text())                  # Range of citation targets (after_content, last_content] processed by the chunk
+    last_content = Column(Text())
+    n_records = Column(Integer)
+    status = Column(maintenance_status_type)
+    created = Column(UTCDateTime, default=get_date)
+    updated = Column(UTCDateTime, onupdate=get_date)
+
+class DirtyCitationTarget(Base):
+    __tablename__ = 'dirty_citation_target'
+    __table_args__ = ({"schema": "public"})
+    content = Column(Text(), primary_key=True)      # Citation target whose record has to be forwarded to master
+    status = Column(citation_change_type)           # Status of the last citation change (NEW, UPDATED or DELETED)
+    n_marks = Column(Integer)                       # Number of outputs coalesced into a single one
+    created = Column(UTCDateTime, default=get_date)
+    updated = Column(UTCDateTime, default=get_date, onupdate=get_date)
+
+class DeferredCitation(Base):
+    __tablename__ = 'deferred_citation'
+    __table_args__ = ({"schema": "public"})
+    citing = Column(Text(), primary_key=True)       # Citing bibcode that could not be resolved to a canonical one
+    content = Column(Text(), primary_key=True)
+    citation_change = Column(JSONB)                 # New citation change to be processed once the citing bibcode exists
+    attempts = Column(Integer, default=0)           # Number of times the citing bibcode was checked again
+    created = Column(UTCDateTime, default=get_date)
+    updated = Column(UTCDateTime, default=get_date, onupdate=get_date)
+
 # Must be called after defining all the models
 orm.configure_mappers()
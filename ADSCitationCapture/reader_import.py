@@ -1,10 +1,11 @@
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 import postgres_copy
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.schema import CreateSchema
 from sqlalchemy.engine.reflection import Inspector
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, case, text
 from ADSCitationCapture.models import ReaderData, ReaderChanges
 from adsputils import setup_logging
 import adsmsg
@@ -16,7 +17,7 @@ class ReaderImport():
     exists) and identifies citation changes. The class is iterable.
     """
 
-    def __init__(self, sqlachemy_url, group_changes_in_chunks_of=1, sqlalchemy_echo=False, schema_prefix="citation_capture_", force=False):
+    def __init__(self, sqlachemy_url, group_changes_in_chunks_of=1, sqlalchemy_echo=False, schema_prefix="citation_capture_", force=False, max_group_size=1000):
         """
         Initializes the class and prepares DB connection.
 
@@ -27,6 +28,8 @@ class ReaderImport():
         :param schema_prefix: Data is stored in schemas that correspond to a
             prefix + file last access date.
         :param force: If tables already exists in DB, drop them and re-ingest.
+        :param max_group_size: Maximum number of reader changes for the same
+            bibcode grouped when iterating (larger groups are split).
         """
         self.engine = create_engine(sqlachemy_url, echo=sqlalchemy_echo)
         self.connection = self.engine.connect()
@@ -51,8 +54,8 @@ class ReaderImport():
         self.previous_schema_name = None
         self.input_reader_filename = None
         self.group_changes_in_chunks_of=group_changes_in_chunks_of
-        self.offset = 0
-        self.ref_bibcode = ""
+        self.max_group_size = max_group_size
+        self.groups = None
         self.n_changes = 0
         self.force = force
         self.last_modification_date = None
@@ -70,7 +73,7 @@ class ReaderImport():
 
         :param input_reader_filename: Path to the file to be imported.
         """
-        self.offset = 0
+        self.groups = None
         self.input_reader_filename = input_reader_filename
         self._setup_schemas()
         if self.force or self.joint_table_name not in Inspector.from_engine(self.engine).get_table_names(schema=self.schema_name):
@@ -93,12 +96,84 @@ class ReaderImport():
         self.n_changes = self._compute_n_changes()
         self.logger.info("Table '%s.%s' contains '%s' citation changes", self.schema_name, self.joint_table_name, self.n_changes)
 
+    def apply(self):
+        """
+        Applies the reader changes identified by compute() to the public
+        readers table with a few set-based statements in a single transaction
+        (instead of one transaction per change). Changes are matched to
+        REGISTERED citation targets by bibcode or alternate bibcode:
+
+        - NEW: reader stored as REGISTERED if it matches a citation target,
+          or as DISCARDED otherwise.
+        - DELETED: matching reader marked as DELETED if it matches a citation
+          target and the change is newer, or stored as DISCARDED otherwise.
+
+        Returns the sorted list of bibcodes of the matching citation targets,
+        whose nonbib records have to be sent to master.
+        """
+        start_time = time.time()
+        if self.joint_table_name not in Inspector.from_engine(self.engine).get_table_names(schema=self.schema_name):
+            return []
+        timestamp = self.last_modification_date.replace(tzinfo=timezone.utc)
+        preparer = self.engine.dialect.identifier_preparer
+        changes_table = "{0}.{1}".format(preparer.quote_schema(self.schema_name), preparer.quote(self.joint_table_name))
+        with self.connection.begin():
+            resolve_changes_sql = \
+                "CREATE TEMP TABLE reader_changes_resolved ON COMMIT DROP AS \
+                    SELECT changes.bibcode, changes.reader, changes.status, \
+                        COALESCE( \
+                            (SELECT t.content FROM public.citation_target t \
+                                WHERE t.bibcode = changes.bibcode AND t.status = 'REGISTERED' ORDER BY t.content LIMIT 1), \
+                            (SELECT t.content FROM public.citation_target t \
+                                WHERE (t.parsed_cited_metadata -> 'alternate_bibcode') ? changes.bibcode AND t.status = 'REGISTERED' ORDER BY t.content LIMIT 1) \
+                        ) AS content \
+                    FROM ( \
+                        SELECT \
+                            CASE WHEN status = 'DELETED' THEN previous_bibcode ELSE new_bibcode END AS bibcode, \
+                            CASE WHEN status = 'DELETED' THEN previous_reader ELSE new_reader END AS reader, \
+                            CAST(status AS text) AS status \
+                        FROM {0} \
+                    ) AS changes;".format(changes_table)
+            self._execute_statement(resolve_changes_sql)
+
+            # Re-applying the same changes does not duplicate readers (same bibcode, reader and timestamp)
+            insert_readers_sql = \
+                "INSERT INTO public.readers (bibcode, reader, timestamp, status, created) \
+                    SELECT c.bibcode, c.reader, :timestamp, \
+                        CAST(CASE WHEN t.bibcode IS NOT NULL OR t.parsed_cited_metadata IS NOT NULL THEN 'REGISTERED' ELSE 'DISCARDED' END AS reader_status_type), \
+                        now() \
+                    FROM reader_changes_resolved c LEFT JOIN public.citation_target t ON t.content = c.content \
+                    WHERE (c.status = 'NEW' OR c.content IS NULL) \
+                        AND NOT EXISTS ( \
+                            SELECT 1 FROM public.readers r \
+                            WHERE r.bibcode = c.bibcode AND r.reader = c.reader AND r.timestamp = :timestamp \
+                        );"
+            n_inserted = self._execute_statement(insert_readers_sql, timestamp=timestamp).rowcount
+
+            delete_readers_sql = \
+                "UPDATE public.readers r \
+                    SET status = 'DELETED', timestamp = :timestamp, updated = now() \
+                    FROM reader_changes_resolved c \
+                    WHERE c.status = 'DELETED' AND c.content IS NOT NULL \
+                        AND r.bibcode = c.bibcode AND r.reader = c.reader AND r.timestamp < :timestamp;"
+            n_deleted = self._execute_statement(delete_readers_sql, timestamp=timestamp).rowcount
+
+            bibcodes_sql = "SELECT DISTINCT bibcode FROM reader_changes_resolved WHERE content IS NOT NULL ORDER BY bibcode;"
+            bibcodes = [row[0] for row in self._execute_statement(bibcodes_sql)]
+        self.logger.info("Applied reader changes from '%s.%s' in %.2f seconds: %i readers stored and %i marked as deleted for %i citation targets", self.schema_name, self.joint_table_name, time.time() - start_time, n_inserted, n_deleted, len(bibcodes))
+        return bibcodes
+
     def _execute_sql(self, sql_template, *args):
         """Build sql from template and execute"""
         sql_command = sql_template.format(*args)
         self.logger.debug("Executing SQL: %s", sql_command)
         return self.connection.execute(sql_command)
 
+    def _execute_statement(self, sql, **params):
+        """Execute sql with bound parameters"""
+        self.logger.debug("Executing SQL: %s (parameters: %s)", sql, params)
+        return self.connection.execute(text(sql), **params)
+
     def _reader_changes_query(self):
         if self.joint_table_name in Inspector.from_engine(self.engine).get_table_names(schema=self.schema_name):
             ReaderChanges.__table__.schema = self.schema_name
@@ -106,36 +181,37 @@ class ReaderImport():
         return sqlalchemy_query
 
     def __iter__(self):
+        self.groups = self._reader_change_groups()
         return self
 
     def __next__(self): # Python 3: def __next__(self)
-        """Iterates over the results, grouping changes in chunks"""
-        if self.offset >= self.n_changes or self.n_changes == 0:
-            raise StopIteration
-        else:
-            reader_changes = []
-            # Get citation changes from DB
-            temp_offset = 0
-            #set the reference bibcode if it is not set already
-            if self.ref_bibcode == "": 
-                instance = self._citation_changes_query().offset(self.offset).yield_per(1)[0]
-                prefix = "previous_" if instance.status == "DELETED" else "new_"
-                self.ref_bibcode = getattr(instance, prefix+"bibcode")
-            
-            for instance in self._citation_changes_query().offset(self.offset).yield_per(100):
-                # Use new_ or previous_ fields depending if status is NEW/UPDATED or DELETED
-                prefix = "previous_" if instance.status == "DELETED" else "new_"
-                #Append reader change if is for the reference bibcode.
-                if self.ref_bibcode ==  getattr(instance, prefix+"bibcode"):
-                    reader_changes.append({'bibcode': getattr(instance, prefix+"bibcode"), 'reader': getattr(instance, prefix+"reader"), 'timestamp': self.last_modification_date, 'status': getattr(instance, "status")})
-                    temp_offset += 1
-                else:
-                    self.ref_bibcode = getattr(instance, prefix+"bibcode")
-                    self.session.commit()
-                    break
-            
-            self.offset += temp_offset
-            return reader_changes
+        """Iterates over the results, grouping changes by bibcode"""
+        if self.groups is None:
+            self.groups = self._reader_change_groups()
+        return next(self.groups)
+
+    def _reader_change_groups(self):
+        """
+        Streams the reader changes once, sorted by bibcode (server-side
+        cursor), and yields the changes of each bibcode in groups of at most
+        max_group_size changes
+        """
+        if self.n_changes == 0:
+            return
+        # Use new_ or previous_ fields depending if status is NEW/UPDATED or DELETED
+        bibcode = case([(ReaderChanges.status == "DELETED", ReaderChanges.previous_bibcode)], else_=ReaderChanges.new_bibcode)
+        query = self._reader_changes_query().order_by(bibcode, ReaderChanges.id).yield_per(1000)
+        reader_changes = []
+        for instance in query:
+            prefix = "previous_" if instance.status == "DELETED" else "new_"
+            reader_change = {'bibcode': getattr(instance, prefix+"bibcode"), 'reader': getattr(instance, prefix+"reader"), 'timestamp': self.last_modification_date, 'status': getattr(instance, "status")}
+            if len(reader_changes) > 0 and (reader_changes[-1]['bibcode'] != reader_change['bibcode'] or len(reader_changes) >= self.max_group_size):
+                yield reader_changes
+                reader_changes = []
+            reader_changes.append(reader_change)
+        if len(reader_changes) > 0:
+            yield reader_changes
+        self.session.commit()
 
     def _setup_schemas(self):
         """
@@ -1,6 +1,9 @@
 import os
+import functools
+import threading
 from kombu import Queue
-from google.protobuf.json_format import MessageToDict
+from celery.signals import worker_process_shutdown, task_postrun
+from google.protobuf.json_format import MessageToDict, ParseDict
 from datetime import datetime
 import ADSCitationCapture.app as app_module
 import ADSCitationCapture.webhook as webhook
@@ -9,8 +12,10 @@ import ADSCitationCapture.url as url
 import ADSCitationCapture.db as db
 import ADSCitationCapture.forward as forward
 import ADSCitationCapture.api as api
+import ADSCitationCapture.http_session as http_session
 import adsmsg
 import json
+from collections import OrderedDict
 
 # ============================= INITIALIZATION ==================================== #
 
@@ -29,23 +34,78 @@ app.conf.CELERY_QUEUES = (
     Queue('maintenance_resend', app.exchange, routing_key='maintenance_resend'),
     Queue('maintenance_reevaluate', app.exchange, routing_key='maintenance_reevaluate'),
     Queue('maintenance_associated_works', app.exchange, routing_key='maintenance_associated_works'),
+    Queue('maintenance_jobs', app.exchange, routing_key='maintenance_jobs'),
     Queue('output-results', app.exchange, routing_key='output-results'),
 )
 
 #limit github API queries to keep below rate limit
 github_api_limit = app.conf.get('GITHUB_API_LIMIT', '80/m')
 
+@worker_process_shutdown.connect
+def _flush_forwarded_records(**kwargs):
+    """
+    Do not lose the nonbib records that are still buffered when a worker process exits
+    """
+    app.flush_forwarded_records()
+
+@task_postrun.connect
+def _flush_forwarded_records_on_task_end(**kwargs):
+    """
+    Buffered nonbib records do not outlive the task that produced them, hence
+    they are not lost if the worker process is killed later on
+    """
+    app.flush_forwarded_records()
+
 # ============================= TASKS ============================================= #
 
+def _unit_of_work(task_function):
+    """
+    Run all the database reads/writes of a task in a single session and
+    transaction (see db.task_session_scope)
+    """
+    @functools.wraps(task_function)
+    def wrapper(*args, **kwargs):
+        with db.task_session_scope(app):
+            return task_function(*args, **kwargs)
+    return wrapper
+
+_event_flush = threading.local()
+
+def _single_event_flush(function):
+    """
+    Schedule a single task_flush_events once the function returns for all the
+    events it queued, even if they were committed by different units of work
+    (e.g., maintenance loops that do not run in one transaction)
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if getattr(_event_flush, 'pending', None) is not None:
+            # Nested call, the outer one schedules the flush
+            return function(*args, **kwargs)
+        _event_flush.pending = False
+        try:
+            return function(*args, **kwargs)
+        finally:
+            pending = _event_flush.pending
+            _event_flush.pending = None
+            if pending:
+                db.call_once_after_commit(task_flush_events.apply_async, countdown=app.conf.get('EVENT_OUTBOX_FLUSH_DELAY', 10))
+    return wrapper
+
 @app.task(queue='process-new-citation')
-def task_process_new_citation(citation_change, force=False):
+@_unit_of_work
+def task_process_new_citation(citation_change, force=False, canonical_citing_bibcode=None):
     """
     Process new citation:
     - Retrieve metadata from doi.org
+
+    The canonical citing bibcode is resolved unless it is given (e.g., deferred citations)
     """
-    canonical_citing_bibcode = api.get_canonical_bibcode(app, citation_change.citing)
     if canonical_citing_bibcode is None:
-        logger.error("The citing bibcode '%s' is not in the system yet, it will be skipped in this ingestion", citation_change.citing)
+        canonical_citing_bibcode = api.get_canonical_bibcode(app, citation_change.citing)
+    if canonical_citing_bibcode is None:
+        logger.error("The citing bibcode '%s' is not in the system yet, the citation to '%s' is deferred until it is", citation_change.citing, citation_change.content)
+        db.defer_citation(app, citation_change.citing, citation_change.content, MessageToDict(citation_change._data, preserving_proto_field_name=True))
         return
     content_type = None
     is_link_alive = False
@@ -58,6 +118,19 @@ def task_process_new_citation(citation_change, force=False):
     parsed_metadata = metadata.get('parsed', {})
     associated_version_bibcodes = metadata.get('associated', None)
 
+    if not citation_target_in_db and citation_change.content_type == adsmsg.CitationChangeContentType.doi \
+        and citation_change.content not in ["", None]:
+        # Only one worker fetches the metadata of a new DOI, the others wait
+        # until it is stored (end of its unit of work) and re-use it
+        waited = not db.lock_citation_target(app, citation_change.content)
+        metadata = db.get_citation_target_metadata(app, citation_change.content)
+        citation_target_in_db = bool(metadata)
+        if citation_target_in_db:
+            logger.info("Citation target '%s' was stored by another worker (waited for it: %s), its metadata will not be fetched again", citation_change.content, waited)
+            raw_metadata = metadata.get('raw', None)
+            parsed_metadata = metadata.get('parsed', {})
+            associated_version_bibcodes = metadata.get('associated', None)
+
     if citation_target_in_db:
         status = metadata.get('status', 'DISCARDED') # "REGISTERED" if it is a software record
 
@@ -94,7 +167,7 @@ def task_process_new_citation(citation_change, force=False):
         license_info = {'license_name': "", 'license_url': ""}
         #If link is alive, attempt to get license info from github. Else return empty license.
         if url.is_github(citation_change.content):
-            task_process_github_urls.delay(citation_change, metadata)
+            db.call_after_commit(task_process_github_urls.delay, citation_change, metadata)
         else:
             status = "DISCARDED"
         parsed_metadata = {'link_alive': is_link_alive, 'doctype': 'unknown', 'license_name': license_info.get('license_name', ""), 'license_url': license_info.get('license_url', "") }
@@ -103,6 +176,10 @@ def task_process_new_citation(citation_change, force=False):
         logger.error("Citation change should have doi, pid or url informed: {}", citation_change)
         status = None
 
+    if status == "REGISTERED" and citation_change.content_type == adsmsg.CitationChangeContentType.doi:
+        # Resolve the canonical citations (Solr) before the writes
+        _get_canonical_citations(parsed_metadata.get('bibcode'))
+
     #Generates entry for Zenodo citations and notifies web broker
     if status not in [None, "EMITTABLE"]:
         if not citation_target_in_db:
@@ -121,8 +198,8 @@ def task_process_new_citation(citation_change, force=False):
                     event_data = webhook.identical_bibcodes_event_data(citation_change.citing, canonical_citing_bibcode)
                     if event_data:
                         dump_prefix = citation_change.timestamp.ToDatetime().strftime("%Y%m%d_%H%M%S")
-                        logger.debug("Calling 'task_emit_event' for '%s' IsIdenticalTo '%s'", citation_change.citing, canonical_citing_bibcode)
-                        task_emit_event.delay(event_data, dump_prefix)
+                        logger.debug("Queueing event for '%s' IsIdenticalTo '%s'", citation_change.citing, canonical_citing_bibcode)
+                        _queue_event(event_data, dump_prefix)
 
                 citation_target_bibcode = parsed_metadata.get('bibcode')
 
@@ -130,12 +207,11 @@ def task_process_new_citation(citation_change, force=False):
                 event_data = webhook.identical_bibcode_and_doi_event_data(citation_target_bibcode, citation_change.content)
                 if event_data:
                     dump_prefix = citation_change.timestamp.ToDatetime().strftime("%Y%m%d_%H%M%S")
-                    logger.debug("Calling 'task_emit_event' for '%s' IsIdenticalTo '%s'", citation_target_bibcode, citation_change.content)
-                    task_emit_event.delay(event_data, dump_prefix)
+                    logger.debug("Queueing event for '%s' IsIdenticalTo '%s'", citation_target_bibcode, citation_change.content)
+                    _queue_event(event_data, dump_prefix)
 
-                # Get citations from the database and transform the stored bibcodes into their canonical ones as registered in Solr.
-                original_citations = db.get_citations_by_bibcode(app, citation_target_bibcode)
-                citations = api.get_canonical_bibcodes(app, original_citations)
+                # Get citations from the database with the canonical bibcodes resolved above
+                citations = _get_canonical_citations(citation_target_bibcode, resolve=False)
                 #Get readers from db if available.
                 readers = db.get_citation_target_readers(app, citation_target_bibcode, parsed_metadata.get('alternate_bibcode', []))
 
@@ -144,14 +220,45 @@ def task_process_new_citation(citation_change, force=False):
                     citations.append(canonical_citing_bibcode)
 
                 logger.debug("Calling 'task_output_results' with '%s'", citation_change)
-                task_output_results.delay(citation_change, parsed_metadata, citations, associated_version_bibcodes, readers=readers)
+                _output_citation_target(citation_change, parsed_metadata, citations, db_versions=associated_version_bibcodes, readers=readers)
             logger.debug("Calling '_emit_citation_change' with '%s'", citation_change)
 
             _emit_citation_change(citation_change, parsed_metadata)
         # Store the citation at the very end, so that if an exception is raised before
         # this task can be re-run in the future without key collisions in the database
-        stored = db.store_citation(app, citation_change, content_type, raw_metadata, parsed_metadata, status)
+        stored = db.store_citation(app, citation_change, content_type, raw_metadata, parsed_metadata, status, canonical_citing=canonical_citing_bibcode)
     
+@app.task(queue='process-new-citation')
+def task_process_deferred_citations():
+    """
+    Check again in a single bulk request the citing bibcodes of the deferred
+    citations and process the citations whose bibcode now exists (citations
+    that are checked too many times are discarded)
+    """
+    with db.task_session_scope(app):
+        deferred_citations = db.get_deferred_citations(app)
+        if len(deferred_citations) == 0:
+            return
+        citing_bibcodes = list(OrderedDict.fromkeys(deferred_citation['citing'] for deferred_citation in deferred_citations))
+        # Bypass the unresolved bibcodes cache, this is the periodic re-check
+        canonical_bibcodes = api.resolve_canonical_bibcodes(app, citing_bibcodes, use_cache=False)
+        resolved = [deferred_citation for deferred_citation in deferred_citations if deferred_citation['citing'] in canonical_bibcodes]
+        unresolved = [deferred_citation for deferred_citation in deferred_citations if deferred_citation['citing'] not in canonical_bibcodes]
+        resolved_pairs = [(deferred_citation['citing'], deferred_citation['content']) for deferred_citation in resolved]
+        # The citation may have been stored meanwhile (e.g., the same change was received again)
+        existing_citations = db.get_existing_citations(app, resolved_pairs)
+        db.delete_deferred_citations(app, resolved_pairs)
+        n_discarded = db.mark_deferred_citations_as_checked(app, [(deferred_citation['citing'], deferred_citation['content']) for deferred_citation in unresolved], app.conf.get('DEFERRED_CITATIONS_MAX_ATTEMPTS', 30))
+        for deferred_citation in resolved:
+            if (deferred_citation['citing'], deferred_citation['content']) in existing_citations:
+                logger.debug("Ignoring deferred citation from '%s' to '%s' because it is already stored", deferred_citation['citing'], deferred_citation['content'])
+                continue
+            citation_change = adsmsg.CitationChange()
+            ParseDict(deferred_citation['citation_change'], citation_change._data)
+            logger.debug("Calling 'task_process_new_citation' with deferred '%s'", citation_change)
+            db.call_after_commit(task_process_new_citation.delay, citation_change, canonical_citing_bibcode=canonical_bibcodes[deferred_citation['citing']])
+    logger.info("Checked %i deferred citations (%i citing bibcodes): %i resolved (%i already stored), %i still deferred and %i discarded", len(deferred_citations), len(citing_bibcodes), len(resolved), len(existing_citations), len(unresolved) - n_discarded, n_discarded)
+
 @app.task(queue='process-github-urls', rate_limit=github_api_limit)
 def task_process_github_urls(citation_change, metadata):
     """
@@ -195,42 +302,72 @@ def task_process_github_urls(citation_change, metadata):
         stored = db.store_citation(app, citation_change, content_type, raw_metadata, parsed_metadata, status)
 
 @app.task(queue='process-updated-citation')
+@_unit_of_work
 def task_process_updated_citation(citation_change, force=False):
     """
     Update citation record
     Emit/forward the update only if it is REGISTERED
     """
-    updated = db.update_citation(app, citation_change)
     metadata = db.get_citation_target_metadata(app, citation_change.content)
     parsed_metadata = metadata.get('parsed', {})
     citation_target_bibcode = parsed_metadata.get('bibcode', None)
     status = metadata.get('status', 'DISCARDED')
     readers = db.get_citation_target_readers(app, citation_target_bibcode, parsed_metadata.get('alternate_bibcode', []))
+    associated_works = None
+    if status == 'REGISTERED' and citation_change.content_type == adsmsg.CitationChangeContentType.doi:
+        # Remote requests (doi.org and Solr) are done before the citation row
+        # is locked by update_citation, which is held until the end of the task
+        associated_works = _collect_associated_works(citation_change, parsed_metadata)
+        _get_canonical_citations(citation_target_bibcode)
+    updated = db.update_citation(app, citation_change)
     # Emit/forward the update only if status is "REGISTERED"
     if updated and status == 'REGISTERED':
         if citation_change.content_type == adsmsg.CitationChangeContentType.doi:
-            associated_works = _collect_associated_works(citation_change, parsed_metadata)
-            # Get citations from the database and transform the stored bibcodes into their canonical ones as registered in Solr.
+            # Get citations from the database with the canonical bibcodes resolved above
             no_self_ref_versions = {key:val for key, val in associated_works.items() if val != citation_target_bibcode} if associated_works else None
-            original_citations = db.get_citations_by_bibcode(app, citation_target_bibcode)
-            citations = api.get_canonical_bibcodes(app, original_citations)
+            citations = _get_canonical_citations(citation_target_bibcode, resolve=False)
             logger.debug("Calling 'task_output_results' with '%s'", citation_change)
-            task_output_results.delay(citation_change, parsed_metadata, citations, db_versions=no_self_ref_versions, readers=readers)
+            _output_citation_target(citation_change, parsed_metadata, citations, db_versions=no_self_ref_versions, readers=readers)
         logger.debug("Calling '_emit_citation_change' with '%s'", citation_change)
         _emit_citation_change(citation_change, parsed_metadata)
 
+def _fetch_all_versions_doi_cached(parsed_metadata, content):
+    """
+    Same as doi.fetch_all_versions_doi but the versions of the concept DOI
+    are stored in the database, hence the concept DOI metadata is fetched
+    once for all its versions (until CONCEPT_DOI_VERSIONS_TTL expires).
+    Versions listed by a concept DOI record refresh the stored ones, and so
+    does a version DOI (content) that is not in the stored list yet (i.e., a
+    new release).
+    """
+    version_of = parsed_metadata.get('version_of', None)
+    if version_of in (None, "", []):
+        all_versions_doi = doi.fetch_all_versions_doi(app.conf['DOI_URL'], app.conf['DATACITE_URL'], parsed_metadata)
+        if all_versions_doi['versions'] not in (None, []):
+            db.store_concept_doi_versions(app, all_versions_doi['concept_doi'], all_versions_doi['versions'])
+        return all_versions_doi
+    concept_doi = version_of[0]
+    versions = db.get_concept_doi_versions(app, concept_doi, app.conf.get('CONCEPT_DOI_VERSIONS_TTL', 24*60*60))
+    if versions is not None and content.lower() in [version.lower() for version in versions]:
+        logger.debug("Using stored versions of concept DOI '%s'", concept_doi)
+        return {'concept_doi': concept_doi, 'versions': versions}
+    all_versions_doi = doi.fetch_all_versions_doi(app.conf['DOI_URL'], app.conf['DATACITE_URL'], parsed_metadata)
+    if all_versions_doi['versions'] is not None:
+        db.store_concept_doi_versions(app, concept_doi, all_versions_doi['versions'])
+    return all_versions_doi
+
 def _collect_associated_works(citation_change, parsed_metadata):
     """
     Fetches metadata for concept doi and searches database for associated versions for the given record.
     """
     versions_in_db = None
     try:
-        all_versions_doi = doi.fetch_all_versions_doi(app.conf['DOI_URL'], app.conf['DATACITE_URL'], parsed_metadata)
+        all_versions_doi = _fetch_all_versions_doi_cached(parsed_metadata, citation_change.content)
     except:
-        logger.error("Unable to recover related versions for {}",citation_change)
+        logger.exception("Unable to recover related versions for %s", citation_change.content)
         all_versions_doi = None
     #fetch additional versions from db if they exist.
-    if all_versions_doi['versions'] not in (None,[]):
+    if all_versions_doi is not None and all_versions_doi['versions'] not in (None,[]):
         logger.info("Found {} versions for {}".format(len(all_versions_doi['versions']), citation_change.content))
         versions_in_db = db.get_associated_works_by_doi(app, all_versions_doi)
         #Only add bibcodes if there are versions in db, otherwise leave as None.
@@ -256,9 +393,10 @@ def _update_associated_citation_targets(citation_change, parsed_metadata, versio
                                     )
             #update associated works for all versions in db
             logger.info('Calling task process_updated_associated_works')
-            task_process_updated_associated_works.delay(associated_citation_change, associated_version_bibcodes)    
+            db.call_after_commit(task_process_updated_associated_works.delay, associated_citation_change, associated_version_bibcodes)    
 
 @app.task(queue='process-updated-citation')
+@_unit_of_work
 def task_process_updated_associated_works(citation_change, associated_versions, force=False):
     """
     Update associated works in citation record
@@ -279,32 +417,35 @@ def task_process_updated_associated_works(citation_change, associated_versions,
         if status == 'REGISTERED' and updated:
             if citation_change.content_type == adsmsg.CitationChangeContentType.doi:
                 # Get citations from the database and transform the stored bibcodes into their canonical ones as registered in Solr.
-                original_citations = db.get_citations_by_bibcode(app, citation_target_bibcode)
-                citations = api.get_canonical_bibcodes(app, original_citations)
+                citations = _get_canonical_citations(citation_target_bibcode)
                 logger.debug("Calling 'task_output_results' with '%s'", citation_change)
-                task_output_results.delay(citation_change, parsed_metadata, citations, db_versions=no_self_ref_versions)
+                _output_citation_target(citation_change, parsed_metadata, citations, db_versions=no_self_ref_versions)
                 logger.info("Updating associated works for %s", citation_change.content)
                 db.update_citation_target_metadata(app, citation_change.content, raw_metadata, parsed_metadata, curated_metadata=curated_metadata, associated=no_self_ref_versions, bibcode=citation_target_bibcode)
         
 @app.task(queue='process-deleted-citation')
+@_unit_of_work
 def task_process_deleted_citation(citation_change, force=False):
     """
     Mark a citation as deleted
     """
-    marked_as_deleted, previous_status = db.mark_citation_as_deleted(app, citation_change)
     metadata = db.get_citation_target_metadata(app, citation_change.content)
     parsed_metadata = metadata.get('parsed', {})
     citation_target_bibcode = parsed_metadata.get('bibcode', None)
+    if citation_change.content_type == adsmsg.CitationChangeContentType.doi:
+        # Remote requests (Solr) are done before the citation row is locked by
+        # mark_citation_as_deleted, which is held until the end of the task
+        _get_canonical_citations(citation_target_bibcode)
+    marked_as_deleted, previous_status = db.mark_citation_as_deleted(app, citation_change)
     # Emit/forward the update only if the previous status was "REGISTERED"
     if marked_as_deleted and previous_status == 'REGISTERED':
         if citation_change.content_type == adsmsg.CitationChangeContentType.doi:
-            # Get citations from the database and transform the stored bibcodes into their canonical ones as registered in Solr.
-            original_citations = db.get_citations_by_bibcode(app, citation_target_bibcode)
-            citations = api.get_canonical_bibcodes(app, original_citations)
+            # Get citations from the database with the canonical bibcodes resolved above (the deleted one is not included anymore)
+            citations = _get_canonical_citations(citation_target_bibcode, resolve=False)
             readers = db.get_citation_target_readers(app, citation_target_bibcode, parsed_metadata.get('alternate_bibcode', []))
             associated_works = db.get_citation_targets_by_doi(app, [citation_change.content])[0].get('associated_works', {"":""})
             logger.debug("Calling 'task_output_results' with '%s'", citation_change)
-            task_output_results.delay(citation_change, parsed_metadata, citations, db_versions=associated_works, readers=readers)
+            _output_citation_target(citation_change, parsed_metadata, citations, db_versions=associated_works, readers=readers)
         logger.debug("Calling '_emit_citation_change' with '%s'", citation_change)
         _emit_citation_change(citation_change, parsed_metadata)
 
@@ -339,10 +480,12 @@ def task_process_citation_changes(citation_changes, force=False):
     """
     logger.debug('Checking content: %s', citation_changes)
 
-    for citation_change in citation_changes.changes:
-        citation_change = _protobuf_to_adsmsg_citation_change(citation_change)
-        # Check: Is this citation already stored in the DB?
-        citation_in_db = db.citation_already_exists(app, citation_change)
+    citation_changes = [_protobuf_to_adsmsg_citation_change(citation_change) for citation_change in citation_changes.changes]
+    # Check: Which of these citations are already stored in the DB?
+    existing_citations = db.get_existing_citations(app, [(citation_change.citing, citation_change.content) for citation_change in citation_changes])
+
+    for citation_change in citation_changes:
+        citation_in_db = (citation_change.citing, citation_change.content) in existing_citations
 
         if citation_change.status == adsmsg.Status.new:
             if citation_in_db:
@@ -403,9 +546,20 @@ def task_process_reader_updates(reader_changes, **kwargs):
             status = "DISCARDED"
             db.store_reader_data(app, change, status)
 
-    registered_records = db.get_citation_targets_by_bibcode(app, [reader_changes[0]['bibcode']])
+    _output_reader_updates(reader_changes[0]['bibcode'])
+
+@app.task(queue='process-citation-changes')
+def task_output_reader_updates(bibcode):
+    """
+    Send the nonbib record of a citation target to master after its readers
+    were updated (e.g., by ReaderImport.apply)
+    """
+    _output_reader_updates(bibcode)
+
+def _output_reader_updates(bibcode):
+    registered_records = db.get_citation_targets_by_bibcode(app, [bibcode])
     if not registered_records:
-        registered_records = db.get_citation_targets_by_alt_bibcode(app, [change['bibcode']])
+        registered_records = db.get_citation_targets_by_alt_bibcode(app, [bibcode])
         
     if registered_records:
         registered_record = registered_records[0]
@@ -423,12 +577,12 @@ def task_process_reader_updates(reader_changes, **kwargs):
         logger.debug("Calling 'task_output_results' with '%s'", custom_citation_change)    
         task_output_results.delay(custom_citation_change, parsed_metadata, citations, readers=readers, only_nonbib=True, db_versions=associated_works)
     else:
-        logger.warning("Bibcode: {} is not a target in the database. Cannot forward nonbib record to master.".format(reader_changes[0]['bibcode']))
+        logger.warning("Bibcode: {} is not a target in the database. Cannot forward nonbib record to master.".format(bibcode))
 
 @app.task(queue='process-citation_changes')
 def task_write_nonbib_files(results):
     logger.info("Writing nonbib files to disk")
-    db.write_citation_target_data(app, only_status='REGISTERED')
+    db.write_citation_target_data(app, only_status='REGISTERED', incremental=app.conf.get('NONBIB_EXPORT_INCREMENTAL', False))
 
 def _emit_citation_change(citation_change, parsed_metadata):
     """
@@ -442,15 +596,110 @@ def _emit_citation_change(citation_change, parsed_metadata):
         event_data = webhook.citation_change_to_event_data(citation_change, parsed_metadata)
         if event_data:
             dump_prefix = citation_change.timestamp.ToDatetime().strftime("%Y%m%d_%H%M%S")
-            logger.debug("Calling 'task_emit_event' for '%s'", citation_change)
-            task_emit_event.delay(event_data, dump_prefix)
+            logger.debug("Queueing event for '%s'", citation_change)
+            _queue_event(event_data, dump_prefix)
 
     elif is_emittable and is_link_alive:
         event_data = webhook.citation_change_to_event_data(citation_change, parsed_metadata)
         if event_data:
             dump_prefix = citation_change.timestamp.ToDatetime().strftime("%Y%m%d_%H%M%S")
-            logger.debug("Calling 'task_emit_event' for EMITTABLE citation '%s'", citation_change)
-            task_emit_event.delay(event_data, dump_prefix)
+            logger.debug("Queueing event for EMITTABLE citation '%s'", citation_change)
+            _queue_event(event_data, dump_prefix)
+
+def _queue_event(event_data, dump_prefix):
+    """
+    Store the event in the outbox within the current unit of work, hence it
+    is only emitted if the citation change is committed, and schedule a
+    single flush per unit of work (or per _single_event_flush call) that
+    emits the pending events in batches (task_flush_events). If
+    EVENT_OUTBOX_BATCH_SIZE is 0, the event is emitted on its own by
+    task_emit_event.
+    """
+    if not app.conf.get('EVENT_OUTBOX_BATCH_SIZE', 0):
+        db.call_after_commit(task_emit_event.delay, event_data, dump_prefix)
+        return
+    db.store_event(app, event_data, status='PENDING', dump_prefix=dump_prefix)
+    if getattr(_event_flush, 'pending', None) is not None:
+        _event_flush.pending = True
+    else:
+        db.call_once_after_commit(task_flush_events.apply_async, countdown=app.conf.get('EVENT_OUTBOX_FLUSH_DELAY', 10))
+
+def _event_dump_prefix(prefix, event_data, dump_prefix):
+    """
+    Sub-directory where an event is dumped (same layout for events emitted
+    on their own and in batches)
+    """
+    relationship = event_data.get("RelationshipType", {}).get("SubType", None)
+    prefix = os.path.join(prefix, relationship)
+    if isinstance(dump_prefix, str):
+        prefix = os.path.join(prefix, dump_prefix)
+    return prefix
+
+def _emit_events(events):
+    """
+    Emit a batch of outbox events, it raises an exception if it fails
+    """
+    if not app.conf['TESTING_MODE']:
+        webhook.emit_events(app.conf['ADS_WEBHOOK_URL'], app.conf['ADS_WEBHOOK_AUTH_TOKEN'], [event['data'] for event in events])
+
+@app.task(queue='process-emit-event')
+def task_flush_events():
+    """
+    Emit the pending events of the outbox with one HTTP POST per batch of
+    EVENT_OUTBOX_BATCH_SIZE events, dump them and mark them as emitted.
+    Failed events are retried with exponential backoff until they reach
+    EVENT_OUTBOX_MAX_ATTEMPTS. A batch that fails again is emitted event by
+    event, so that one bad event does not block the others.
+    """
+    batch_size = max(app.conf.get('EVENT_OUTBOX_BATCH_SIZE', 0), 1)
+    max_attempts = app.conf.get('EVENT_OUTBOX_MAX_ATTEMPTS', 10)
+    prefix = "emulated" if app.conf['TESTING_MODE'] else "emitted"
+    n_emitted = 0
+    failed_ids = set()
+    while True:
+        with db.task_session_scope(app):
+            # Events that failed during this flush wait for their retry
+            events = db.get_pending_events(app, batch_size, exclude_ids=failed_ids)
+            if len(events) == 0:
+                break
+            try:
+                _emit_events(events)
+            except:
+                logger.exception("Problem emitting %i events", len(events))
+                emitted_events, failed_events = [], events
+                if len(events) > 1 and any(event['attempts'] > 0 for event in events):
+                    emitted_events, failed_events = [], []
+                    for event in events:
+                        try:
+                            _emit_events([event])
+                        except:
+                            logger.exception("Problem emitting event %i (attempt %i)", event['id'], event['attempts'] + 1)
+                            failed_events.append(event)
+                        else:
+                            emitted_events.append(event)
+            else:
+                emitted_events, failed_events = events, []
+            if len(failed_events) > 0:
+                attempts = max(event['attempts'] for event in failed_events) + 1
+                retry_delay = min(app.conf.get('EVENT_OUTBOX_RETRY_BACKOFF', 60) * 2**(attempts-1), app.conf.get('EVENT_OUTBOX_RETRY_MAX_DELAY', 3600))
+                logger.error("Failed to emit %i events (attempt %i), retrying in %i seconds", len(failed_events), attempts, retry_delay)
+                db.mark_events_as_failed(app, [event['id'] for event in failed_events], retry_delay, max_attempts)
+                if attempts < max_attempts:
+                    db.call_once_after_commit(task_flush_events.apply_async, countdown=retry_delay)
+                failed_ids.update(event['id'] for event in failed_events)
+            # One file per batch, relationship and dump prefix (date of the citation changes)
+            dumps = {}
+            for event in emitted_events:
+                dumps.setdefault(_event_dump_prefix(prefix, event['data'], event['dump_prefix']), []).append(event['data'])
+            for event_prefix in sorted(dumps):
+                webhook.dump_events(dumps[event_prefix], prefix=event_prefix)
+            db.mark_events_as_emitted(app, [event['id'] for event in emitted_events])
+            n_emitted += len(emitted_events)
+        # Stop if the webhook did not accept any event (e.g., it is down)
+        if len(events) < batch_size or len(emitted_events) == 0:
+            break
+    logger.info("Flushed event outbox: %i events emitted", n_emitted)
+    return n_emitted
 
 @app.task(queue='process-emit-event')
 def task_emit_event(event_data, dump_prefix):
@@ -463,13 +712,11 @@ def task_emit_event(event_data, dump_prefix):
     target_id = event_data.get("Target", {}).get("Identifier", {}).get("ID", None)
 
     if not app.conf['TESTING_MODE']:
-        prefix = os.path.join("emitted", relationship)
+        prefix = _event_dump_prefix("emitted", event_data, dump_prefix)
         emitted = webhook.emit_event(app.conf['ADS_WEBHOOK_URL'], app.conf['ADS_WEBHOOK_AUTH_TOKEN'], event_data)
     else:
-        prefix = os.path.join("emulated", relationship)
+        prefix = _event_dump_prefix("emulated", event_data, dump_prefix)
         emitted = True
-    if isinstance(dump_prefix, str):
-        prefix = os.path.join(prefix, dump_prefix)
     webhook.dump_event(event_data, prefix=prefix)
     stored = db.store_event(app, event_data)
 
@@ -483,27 +730,45 @@ def task_emit_event(event_data, dump_prefix):
 def _remove_duplicated_dict_in_list(l):
     return [x for x in l if x['content'] in set([r['content'] for r in l])]
 
-@app.task(queue='maintenance_canonical')
-def task_maintenance_canonical(dois, bibcodes):
+def _get_canonical_citations(bibcode, refresh=False, resolve=True):
     """
-    Maintenance operation:
-    - Get all the registered citation targets (or only a subset of them if DOIs and/or bibcodes are specified)
-    - For each, get their citations bibcodes and transform them to their canonical form
-    - Send to master an update with the new list of citations canonical bibcodes
+    Return the canonical bibcodes (as registered in Solr) of the citations to
+    a citation target. Canonical bibcodes are stored with the citations, hence
+    only the citations without one are resolved via the API (or all of them
+    if refresh is True, bypassing the cache) and the result is stored.
+    If resolve is False, only the stored canonical bibcodes are used (no API
+    requests, e.g., once the API was already called before locking rows).
     """
-    n_requested = len(dois) + len(bibcodes)
-    if n_requested == 0:
-        registered_records = db.get_citation_targets(app, only_status='REGISTERED')
+    citations = db.get_citations_by_bibcode(app, bibcode, with_canonical=True)
+    if not resolve:
+        return list(OrderedDict.fromkeys(canonical_citing for citing, canonical_citing in citations if canonical_citing is not None))
+    if refresh:
+        unresolved = [citing for citing, canonical_citing in citations]
     else:
-        registered_records = db.get_citation_targets_by_bibcode(app, bibcodes, only_status='REGISTERED')
-        registered_records += db.get_citation_targets_by_doi(app, dois, only_status='REGISTERED')
-        registered_records = _remove_duplicated_dict_in_list(registered_records)
+        unresolved = [citing for citing, canonical_citing in citations if canonical_citing is None]
+    resolved = api.resolve_canonical_bibcodes(app, unresolved, use_cache=not refresh) if unresolved else {}
+    if refresh:
+        # Citing bibcodes that do not resolve anymore are cleared
+        resolved = dict((citing, resolved.get(citing)) for citing in unresolved)
+    stored = dict(citations)
+    db.update_canonical_citing(app, dict((citing, canonical_citing) for citing, canonical_citing in resolved.items() if stored.get(citing) != canonical_citing))
+    if refresh:
+        canonical_bibcodes = [resolved.get(citing) for citing, canonical_citing in citations]
+    else:
+        canonical_bibcodes = [resolved.get(citing, canonical_citing) for citing, canonical_citing in citations]
+    # Bibcodes that do not exist (anymore) are not included
+    return list(OrderedDict.fromkeys(canonical_bibcode for canonical_bibcode in canonical_bibcodes if canonical_bibcode is not None))
 
+def _maintenance_canonical(registered_records):
+    """
+    Send to master the current list of citations canonical bibcodes for each
+    of the registered records
+    """
     for registered_record in registered_records:
         try:
             # Get citations from the database and transform the stored bibcodes into their canonical ones as registered in Solr.
-            original_citations = db.get_citations_by_bibcode(app, registered_record['bibcode'])
-            existing_citation_bibcodes = api.get_canonical_bibcodes(app, original_citations)
+            # - Bypass the stored canonical bibcodes and the cache since the goal is to detect changes in canonical bibcodes (e.g., merges)
+            existing_citation_bibcodes = _get_canonical_citations(registered_record['bibcode'], refresh=True)
 
         except:
             logger.exception("Failed API request to retreive existing citations for bibcode '{}'".format(registered_record['bibcode']))
@@ -519,15 +784,14 @@ def task_maintenance_canonical(dois, bibcodes):
         if parsed_metadata:
             logger.debug("Calling 'task_output_results' with '%s'", custom_citation_change)
             task_output_results.delay(custom_citation_change, parsed_metadata, existing_citation_bibcodes, db_versions=registered_record.get('associated_works', {"":""}), readers=readers)
-   
-@app.task(queue='maintenance_metadata')
-def task_maintenance_metadata(dois, bibcodes, reparse=False):
+
+@app.task(queue='maintenance_canonical')
+def task_maintenance_canonical(dois, bibcodes):
     """
     Maintenance operation:
     - Get all the registered citation targets (or only a subset of them if DOIs and/or bibcodes are specified)
-    - For each, retreive metadata and if it is different to what we have in our database:
-        - Get the citations bibcodes and transform them to their canonical form
-        - Send to master an update with the new metadata and the current list of citations canonical bibcodes
+    - For each, get their citations bibcodes and transform them to their canonical form
+    - Send to master an update with the new list of citations canonical bibcodes
     """
     n_requested = len(dois) + len(bibcodes)
     if n_requested == 0:
@@ -537,9 +801,28 @@ def task_maintenance_metadata(dois, bibcodes, reparse=False):
         registered_records += db.get_citation_targets_by_doi(app, dois, only_status='REGISTERED')
         registered_records = _remove_duplicated_dict_in_list(registered_records)
 
-    for registered_record in registered_records:
+    _maintenance_canonical(registered_records)
+
+@_single_event_flush
+def _maintenance_metadata(registered_records, reparse=False):
+    """
+    Retrieve the metadata of each of the registered records and if it is
+    different to what we have in our database, send an update to master
+    """
+    # Validators (ETag, Last-Modified and content hash) from previous fetches
+    cached_fetches = {} if reparse else db.get_doi_metadata_cache(app, [registered_record['content'] for registered_record in registered_records])
+    n_skipped = 0
+    n_updated = 0
+    if not reparse:
+        # Fetch DOI metadata concurrently while records are processed in order
+        fetch = lambda registered_record: doi.fetch_metadata_if_modified(app.conf['DOI_URL'], app.conf['DATACITE_URL'], registered_record['content'], cached=cached_fetches.get(registered_record['content'], None))
+        fetched_records = http_session.fetch_concurrently(fetch, registered_records, max_workers=app.conf.get('MAINTENANCE_FETCH_WORKERS', 8))
+    else:
+        fetched_records = ((registered_record, None) for registered_record in registered_records)
+    for registered_record, fetched in fetched_records:
         updated = False
         bibcode_replaced = {}
+        validators = None
         # Fetch DOI metadata (if HTTP request fails, an exception is raised
         # and the task will be re-queued (see app.py and adsputils))
 
@@ -547,7 +830,12 @@ def task_maintenance_metadata(dois, bibcodes, reparse=False):
 
         logger.debug("Curated metadata for {} is {}".format(registered_record['content'], registered_record['curated_metadata']))   
         if not reparse: 
-            raw_metadata = doi.fetch_metadata(app.conf['DOI_URL'], app.conf['DATACITE_URL'], registered_record['content'])
+            modified, raw_metadata, validators = fetched.result()
+            if not modified:
+                # Same metadata as in the last fetch, which was already processed
+                logger.debug("Metadata for '%s' has not changed since the last fetch", registered_record['content'])
+                n_skipped += 1
+                continue
         else:
             raw_metadata = db.get_citation_target_metadata(app, registered_record['content']).get("raw")
         if raw_metadata:
@@ -563,6 +851,8 @@ def task_maintenance_metadata(dois, bibcodes, reparse=False):
                 # and they are not a version of something else
                 concept_doi = len(parsed_metadata.get('version_of', [])) == 0 and len(parsed_metadata.get('versions', [])) >= 1
                 if concept_doi: 
+                    # Refresh the versions stored for the records of each version
+                    db.store_concept_doi_versions(app, registered_record['content'], parsed_metadata['versions'])
                     concept_metadata=db.get_citation_target_metadata(app, registered_record['content'], curate=True, concept=concept_doi)['parsed']
                 different_bibcodes = registered_record['bibcode'] != parsed_metadata['bibcode']
                 if different_bibcodes and concept_doi:
@@ -585,8 +875,8 @@ def task_maintenance_metadata(dois, bibcodes, reparse=False):
                     event_data = webhook.identical_bibcodes_event_data(registered_record['bibcode'], parsed_metadata['bibcode'])
                     if event_data:
                         dump_prefix = datetime.now().strftime("%Y%m%d") # "%Y%m%d_%H%M%S"
-                        logger.debug("Calling 'task_emit_event' for '%s' IsIdenticalTo '%s'", registered_record['bibcode'], parsed_metadata['bibcode'])
-                        task_emit_event.delay(event_data, dump_prefix)
+                        logger.debug("Queueing event for '%s' IsIdenticalTo '%s'", registered_record['bibcode'], parsed_metadata['bibcode'])
+                        _queue_event(event_data, dump_prefix)
                     # If there is no curated metadata modify record and note replaced bibcode
                     if not curated_metadata:
                         logger.warning("Parsing the new metadata for citation target '%s' produced a different bibcode: '%s'. The former will be moved to the 'alternate_bibcode' list, and the new one will be used as the main one.", registered_record['bibcode'], parsed_metadata.get('bibcode', None))
@@ -659,13 +949,39 @@ def task_maintenance_metadata(dois, bibcodes, reparse=False):
                                                            )
             if citation_change.content_type == adsmsg.CitationChangeContentType.doi:
                 # Get citations from the database and transform the stored bibcodes into their canonical ones as registered in Solr.
-                original_citations = db.get_citations_by_bibcode(app, registered_record['bibcode'])
-                citations = api.get_canonical_bibcodes(app, original_citations)
+                citations = _get_canonical_citations(registered_record['bibcode'])
                 readers = db.get_citation_target_readers(app, registered_record['bibcode'], parsed_metadata.get('alternate_bibcode', []))
                 logger.debug("Calling 'task_output_results' with '%s'", citation_change)
                 task_output_results.delay(citation_change, modified_metadata, citations, bibcode_replaced=bibcode_replaced, db_versions=registered_record.get('associated_works', {"":""}), readers=readers)     
+            n_updated += 1
+
+        if validators:
+            # Only remember the fetch once it has been fully processed
+            db.store_doi_metadata_cache(app, registered_record['content'], validators)
+
+    logger.info("Metadata maintenance processed %i records: %i skipped (unchanged since last fetch) and %i updated", len(registered_records), n_skipped, n_updated)
 
 @app.task(queue='maintenance_metadata')
+def task_maintenance_metadata(dois, bibcodes, reparse=False):
+    """
+    Maintenance operation:
+    - Get all the registered citation targets (or only a subset of them if DOIs and/or bibcodes are specified)
+    - For each, retreive metadata and if it is different to what we have in our database:
+        - Get the citations bibcodes and transform them to their canonical form
+        - Send to master an update with the new metadata and the current list of citations canonical bibcodes
+    """
+    n_requested = len(dois) + len(bibcodes)
+    if n_requested == 0:
+        registered_records = db.get_citation_targets(app, only_status='REGISTERED')
+    else:
+        registered_records = db.get_citation_targets_by_bibcode(app, bibcodes, only_status='REGISTERED')
+        registered_records += db.get_citation_targets_by_doi(app, dois, only_status='REGISTERED')
+        registered_records = _remove_duplicated_dict_in_list(registered_records)
+
+    _maintenance_metadata(registered_records, reparse=reparse)
+
+@app.task(queue='maintenance_metadata')
+@_single_event_flush
 def task_maintenance_curation(dois, bibcodes, curated_entries, reset=False):
     """
     Maintenance operation:
@@ -809,8 +1125,8 @@ def task_maintenance_curation(dois, bibcodes, curated_entries, reset=False):
                     event_data = webhook.identical_bibcodes_event_data(registered_record['bibcode'], modified_metadata['bibcode'])
                     if event_data:
                         dump_prefix = datetime.now().strftime("%Y%m%d") # "%Y%m%d_%H%M%S"
-                        logger.debug("Calling 'task_emit_event' for '%s' IsIdenticalTo '%s'", registered_record['bibcode'], modified_metadata['bibcode'])
-                        task_emit_event.delay(event_data, dump_prefix)
+                        logger.debug("Queueing event for '%s' IsIdenticalTo '%s'", registered_record['bibcode'], modified_metadata['bibcode'])
+                        _queue_event(event_data, dump_prefix)
                     
                 updated = db.update_citation_target_metadata(app, registered_record['content'], raw_metadata, parsed_metadata, curated_metadata=curated_entry, bibcode=modified_metadata.get('bibcode'), associated=registered_record.get('associated_works', {"":""}))
                 if updated:
@@ -821,8 +1137,7 @@ def task_maintenance_curation(dois, bibcodes, curated_entries, reset=False):
                                                                 )
                     if citation_change.content_type == adsmsg.CitationChangeContentType.doi:
                         # Get citations from the database and transform the stored bibcodes into their canonical ones as registered in Solr.
-                        original_citations = db.get_citations_by_bibcode(app, registered_record['bibcode'])
-                        citations = api.get_canonical_bibcodes(app, original_citations)
+                        citations = _get_canonical_citations(registered_record['bibcode'])
                         readers = db.get_citation_target_readers(app, registered_record['bibcode'], parsed_metadata.get('alternate_bibcode', []))
                         logger.debug("Calling 'task_output_results' with '%s'", citation_change)
                         task_output_results.delay(citation_change, modified_metadata, citations, bibcode_replaced=bibcode_replaced, db_versions=registered_record.get('associated_works', {"":""}), readers=readers)    
@@ -905,32 +1220,12 @@ def task_maintenance_repopulate_bibcode_columns():
     with app.session_scope() as session:
         db.populate_bibcode_column(session)
 
-@app.task(queue='maintenance_resend')
-def task_maintenance_resend(dois, bibcodes, broker, only_nonbib=False):
+@_single_event_flush
+def _maintenance_resend(registered_records, emittable_records, broker, only_nonbib=False):
     """
-    Maintenance operation:
-    - Get all the registered citation targets (or only a subset of them if DOIs and/or bibcodes are specified)
-    - For each:
-        - Re-send to master (or broker) an update with the current metadata and the current list of citations canonical bibcodes
+    Re-send to master (or broker) the registered records and, if sending to
+    the broker, the citations to the emittable records
     """
-    n_requested = len(dois) + len(bibcodes)
-    if n_requested == 0:
-        registered_records = db.get_citation_targets(app, only_status='REGISTERED')
-        if broker:
-            emittable_records = db.get_citation_targets(app, only_status='EMITTABLE')
-        else:
-            emittable_records=[]
-    else:
-        registered_records = db.get_citation_targets_by_bibcode(app, bibcodes, only_status='REGISTERED')
-        registered_records += db.get_citation_targets_by_doi(app, dois, only_status='REGISTERED')
-        registered_records = _remove_duplicated_dict_in_list(registered_records)
-
-        if broker:
-            emittable_records = db.get_citation_targets_by_bibcode(app, bibcodes, only_status='EMITTABLE')
-            emittable_records = _remove_duplicated_dict_in_list(emittable_records)
-        else:
-            emittable_records = []
-
     for registered_record in registered_records:
         citations = db.get_citations_by_bibcode(app, registered_record['bibcode'])
         custom_citation_change = adsmsg.CitationChange(content=registered_record['content'],
@@ -952,8 +1247,8 @@ def task_maintenance_resend(dois, bibcodes, broker, only_nonbib=False):
                 event_data = webhook.identical_bibcode_and_doi_event_data(registered_record['bibcode'], registered_record['content'])
                 if event_data:
                     dump_prefix = custom_citation_change.timestamp.ToDatetime().strftime("%Y%m%d_%H%M%S_resent")
-                    logger.debug("Calling 'task_emit_event' for '%s' IsIdenticalTo '%s'", registered_record['bibcode'], registered_record['content'])
-                    task_emit_event.delay(event_data, dump_prefix)
+                    logger.debug("Queueing event for '%s' IsIdenticalTo '%s'", registered_record['bibcode'], registered_record['content'])
+                    _queue_event(event_data, dump_prefix)
                 # And for each citing bibcode to the target DOI
                 for citing_bibcode in citations:
                     emit_citation_change = adsmsg.CitationChange(citing=citing_bibcode,
@@ -966,8 +1261,8 @@ def task_maintenance_resend(dois, bibcodes, broker, only_nonbib=False):
                     event_data = webhook.citation_change_to_event_data(emit_citation_change, parsed_metadata)
                     if event_data:
                         dump_prefix = emit_citation_change.timestamp.ToDatetime().strftime("%Y%m%d_%H%M%S_resent")
-                        logger.debug("Calling 'task_emit_event' for '%s'", emit_citation_change)
-                        task_emit_event.delay(event_data, dump_prefix)
+                        logger.debug("Queueing event for '%s'", emit_citation_change)
+                        _queue_event(event_data, dump_prefix)
     if broker:
         for emittable_record in emittable_records:
             citations = db.get_citations_by_bibcode(app, emittable_record['bibcode'])
@@ -990,8 +1285,36 @@ def task_maintenance_resend(dois, bibcodes, broker, only_nonbib=False):
                     event_data = webhook.citation_change_to_event_data(emit_citation_change, parsed_metadata)
                     if event_data:
                         dump_prefix = emit_citation_change.timestamp.ToDatetime().strftime("%Y%m%d_%H%M%S_resent")
-                        logger.debug("Calling 'task_emit_event' for '%s'", emit_citation_change)
-                        task_emit_event.delay(event_data, dump_prefix)
+                        logger.debug("Queueing event for '%s'", emit_citation_change)
+                        _queue_event(event_data, dump_prefix)
+
+@app.task(queue='maintenance_resend')
+def task_maintenance_resend(dois, bibcodes, broker, only_nonbib=False):
+    """
+    Maintenance operation:
+    - Get all the registered citation targets (or only a subset of them if DOIs and/or bibcodes are specified)
+    - For each:
+        - Re-send to master (or broker) an update with the current metadata and the current list of citations canonical bibcodes
+    """
+    n_requested = len(dois) + len(bibcodes)
+    if n_requested == 0:
+        registered_records = db.get_citation_targets(app, only_status='REGISTERED')
+        if broker:
+            emittable_records = db.get_citation_targets(app, only_status='EMITTABLE')
+        else:
+            emittable_records=[]
+    else:
+        registered_records = db.get_citation_targets_by_bibcode(app, bibcodes, only_status='REGISTERED')
+        registered_records += db.get_citation_targets_by_doi(app, dois, only_status='REGISTERED')
+        registered_records = _remove_duplicated_dict_in_list(registered_records)
+
+        if broker:
+            emittable_records = db.get_citation_targets_by_bibcode(app, bibcodes, only_status='EMITTABLE')
+            emittable_records = _remove_duplicated_dict_in_list(emittable_records)
+        else:
+            emittable_records = []
+
+    _maintenance_resend(registered_records, emittable_records, broker, only_nonbib=only_nonbib)
 
 @app.task(queue='maintenance_reevaluate')
 def task_maintenance_reevaluate(dois, bibcodes):
@@ -1010,13 +1333,15 @@ def task_maintenance_reevaluate(dois, bibcodes):
         discarded_records += db.get_citation_targets_by_doi(app, dois, only_status='DISCARDED')
         discarded_records = _remove_duplicated_dict_in_list(discarded_records)
 
-    for previously_discarded_record in discarded_records:
+    # Fetch DOI metadata concurrently while records are processed in order
+    fetch = lambda discarded_record: doi.fetch_metadata(app.conf['DOI_URL'], app.conf['DATACITE_URL'], discarded_record['content']) if discarded_record['content_type'] == 'DOI' else None
+    for previously_discarded_record, fetched in http_session.fetch_concurrently(fetch, discarded_records, max_workers=app.conf.get('MAINTENANCE_FETCH_WORKERS', 8)):
         updated = False
         bibcode_replaced = {}
         # Fetch DOI metadata (if HTTP request fails, an exception is raised
         # and the task will be re-queued (see app.py and adsputils))
         if previously_discarded_record['content_type'] == 'DOI':
-            raw_metadata = doi.fetch_metadata(app.conf['DOI_URL'], app.conf['DATACITE_URL'], previously_discarded_record['content'])
+            raw_metadata = fetched.result()
             if raw_metadata:
                 parsed_metadata = doi.parse_metadata(raw_metadata)
                 is_software = parsed_metadata.get('doctype', '').lower() == "software"
@@ -1037,8 +1362,7 @@ def task_maintenance_reevaluate(dois, bibcodes):
                                                             )
                 if citation_change.content_type == adsmsg.CitationChangeContentType.doi:
                     # Get citations from the database and transform the stored bibcodes into their canonical ones as registered in Solr.
-                    original_citations = db.get_citations_by_bibcode(app, parsed_metadata['bibcode'])
-                    citations = api.get_canonical_bibcodes(app, original_citations)
+                    citations = _get_canonical_citations(parsed_metadata['bibcode'])
                     readers = db.get_citation_target_readers(app, parsed_metadata['bibcode'], parsed_metadata.get('alternate_bibcode', []))
                     logger.debug("Calling 'task_output_results' with '%s'", citation_change)
                     task_output_results.delay(citation_change, parsed_metadata, citations, bibcode_replaced=bibcode_replaced, db_versions=previously_discarded_record.get('associated_works',{"":""}), readers=readers)
@@ -1051,6 +1375,23 @@ def task_maintenance_generate_nonbib_files():
     logger.info("Rewriting nonbib files to disk")
     db.write_citation_target_data(app, only_status='REGISTERED')                                                     
 
+def _fetch_all_versions_doi(registered_record):
+    """
+    Get the stored metadata of a registered record and, if it is a software
+    record, fetch the DOIs of all its versions (it runs in a worker thread)
+    """
+    all_versions_doi = None
+    metadata = db.get_citation_target_metadata(app, registered_record['content'])
+    parsed_metadata = metadata.get('parsed', {})
+    if metadata.get('raw', {}) and parsed_metadata.get('doctype', '').lower() == "software" and parsed_metadata.get('bibcode') not in (None, ""):
+        #Check for additional versions
+        try:
+            all_versions_doi = _fetch_all_versions_doi_cached(parsed_metadata, registered_record['content'])
+        except:
+            logger.error("Unable to recover related versions for {}".format(registered_record['content']))
+            all_versions_doi = None
+    return metadata, all_versions_doi
+
 @app.task(queue='maintenance_associated_works')
 def task_maintenance_reevaluate_associated_works(dois, bibcodes):
     """
@@ -1069,15 +1410,17 @@ def task_maintenance_reevaluate_associated_works(dois, bibcodes):
         registered_records += db.get_citation_targets_by_doi(app, dois, only_status='REGISTERED')
         registered_records = _remove_duplicated_dict_in_list(registered_records)
 
+    # Fetch stored metadata and versions concurrently while records are processed in order
+    fetched_records = http_session.fetch_concurrently(_fetch_all_versions_doi, registered_records, max_workers=app.conf.get('MAINTENANCE_FETCH_WORKERS', 8))
     #convert record into citation_change message
-    for registered_record in registered_records:
+    for registered_record, fetched in fetched_records:
         citations = db.get_citations_by_bibcode(app, registered_record['bibcode'])
         custom_citation_change = adsmsg.CitationChange(content=registered_record['content'],
                                                        content_type=getattr(adsmsg.CitationChangeContentType, registered_record['content_type'].lower()),
                                                        status=adsmsg.Status.updated,
                                                        timestamp=datetime.now()
                                                        )
-        metadata = db.get_citation_target_metadata(app, registered_record['content'])
+        metadata, all_versions_doi = fetched.result()
         raw_metadata = metadata.get('raw', {})
 
         #confirm citation is registered software, then check for associated works.
@@ -1090,12 +1433,6 @@ def task_maintenance_reevaluate_associated_works(dois, bibcodes):
                 logger.error("The metadata for '%s' could not be parsed correctly and it did not correctly compute a bibcode", registered_record['content'])
             else:
                 logger.debug("Checking associated records for '%s'", custom_citation_change)
-                #Check for additional versions
-                try:
-                    all_versions_doi = doi.fetch_all_versions_doi(app.conf['DOI_URL'], app.conf['DATACITE_URL'], parsed_metadata)
-                except:
-                    logger.error("Unable to recover related versions for {}", custom_citation_change)
-                    all_versions_doi = None
                 #fetch additional versions from db if they exist.
                 if all_versions_doi['versions'] not in (None,[]):
                     logger.debug("Found {} versions for {}".format(len(all_versions_doi['versions']), custom_citation_change.content))
@@ -1106,6 +1443,120 @@ def task_maintenance_reevaluate_associated_works(dois, bibcodes):
                         logger.debug("{}: associated_versions_bibcodes".format(versions_in_db))
                         task_process_updated_associated_works.delay(custom_citation_change, versions_in_db)
                     
+def _maintenance_job_statuses(name, params):
+    """
+    Status of the citation targets that are processed by a maintenance job
+    """
+    if name == 'resend' and params.get('broker', False):
+        return ['REGISTERED', 'EMITTABLE']
+    return ['REGISTERED']
+
+@app.task(queue='maintenance_jobs')
+def task_maintenance_job(name, params, job_id=None):
+    """
+    Maintenance job coordinator:
+    - Split all the citation targets in chunks (unless job_id corresponds to an already existing job)
+    - Send a 'task_maintenance_job_chunk' for each chunk that is not done yet,
+      hence they can be processed in parallel by several workers and
+      interrupted jobs can be resumed by calling this task again with their job_id
+    """
+    if job_id is None:
+        chunk_size = app.conf.get('MAINTENANCE_CHUNK_SIZE', 500)
+        job_id = db.create_maintenance_job(app, name, params, _maintenance_job_statuses(name, params), chunk_size)
+        logger.info("Created maintenance job '%s' with id %i", name, job_id)
+    pending_chunk_ids = db.get_pending_maintenance_chunks(app, job_id)
+    logger.info("Maintenance job %i: dispatching %i pending chunks", job_id, len(pending_chunk_ids))
+    for chunk_id in pending_chunk_ids:
+        task_maintenance_job_chunk.delay(chunk_id)
+    return job_id
+
+@app.task(queue='maintenance_jobs')
+def task_maintenance_job_chunk(chunk_id):
+    """
+    Process the citation targets in the range of contents of a chunk of a
+    maintenance job and mark it as done
+    """
+    chunk = db.get_maintenance_job_chunk(app, chunk_id)
+    if chunk is None or chunk['status'] == 'DONE':
+        # Already processed (e.g., the job was resumed while it was queued)
+        return
+    job = db.get_maintenance_job(app, chunk['job_id'])
+    name, params = job['name'], job['params']
+    registered_records = db.get_citation_targets(app, only_status='REGISTERED', after_content=chunk['after_content'], last_content=chunk['last_content'])
+    if name == 'canonical':
+        _maintenance_canonical(registered_records)
+    elif name == 'metadata':
+        _maintenance_metadata(registered_records, reparse=params.get('reparse', False))
+    elif name == 'resend':
+        broker = params.get('broker', False)
+        if broker:
+            emittable_records = db.get_citation_targets(app, only_status='EMITTABLE', after_content=chunk['after_content'], last_content=chunk['last_content'])
+        else:
+            emittable_records = []
+        _maintenance_resend(registered_records, emittable_records, broker, only_nonbib=params.get('only_nonbib', False))
+    else:
+        raise Exception("Unknown maintenance job: {}".format(name))
+    n_pending_chunks = db.mark_maintenance_chunk_as_done(app, chunk_id)
+    logger.info("Maintenance job %i ('%s'): chunk %i done, %i/%i chunks pending", job['id'], name, chunk_id, n_pending_chunks, job['n_chunks'])
+
+def _output_citation_target(citation_change, parsed_metadata, citations, **kwargs):
+    """
+    Forward the record of a citation target once the current unit of work is
+    committed or, if OUTPUT_RESULTS_WINDOW is set, mark the target as dirty so
+    that all the changes to the same target received during the window are
+    forwarded with a single record (see task_flush_dirty_citation_targets)
+    """
+    window = app.conf.get('OUTPUT_RESULTS_WINDOW', 0)
+    if not window:
+        db.call_after_commit(task_output_results.delay, citation_change, parsed_metadata, citations, **kwargs)
+        return
+    status = {adsmsg.Status.new: 'NEW', adsmsg.Status.deleted: 'DELETED'}.get(citation_change.status, 'UPDATED')
+    if db.mark_citation_target_as_dirty(app, citation_change.content, status):
+        logger.debug("Scheduling 'task_flush_dirty_citation_targets' for '%s' in %i seconds", citation_change.content, window)
+        db.call_after_commit(task_flush_dirty_citation_targets.apply_async, args=([citation_change.content],), countdown=window)
+
+@app.task(queue='output-results')
+def task_flush_dirty_citation_targets(contents=None):
+    """
+    Forward a single record per dirty citation target (the given ones, or all
+    of them if none is given) built from the current state of the database
+    and report how many messages were saved by coalescing the changes
+    """
+    with db.task_session_scope(app):
+        dirty_targets = db.pop_dirty_citation_targets(app, contents=contents)
+        dirty_contents = [dirty_target['content'] for dirty_target in dirty_targets]
+        registered_records = dict((registered_record['content'], registered_record) for registered_record in db.get_citation_targets_by_doi(app, dirty_contents)) if dirty_contents else {}
+        n_outputs = 0
+        for dirty_target in dirty_targets:
+            registered_record = registered_records.get(dirty_target['content'], None)
+            if registered_record is None:
+                logger.warning("Dirty citation target '%s' is not registered, its record will not be forwarded to master", dirty_target['content'])
+                continue
+            custom_citation_change = adsmsg.CitationChange(content=registered_record['content'],
+                                                           content_type=getattr(adsmsg.CitationChangeContentType, registered_record['content_type'].lower()),
+                                                           status=getattr(adsmsg.Status, dirty_target['status'].lower()),
+                                                           timestamp=datetime.now()
+                                                           )
+            parsed_metadata = db.get_citation_target_metadata(app, custom_citation_change.content).get('parsed', {})
+            citations = _get_canonical_citations(registered_record['bibcode'])
+            readers = db.get_citation_target_readers(app, registered_record['bibcode'], parsed_metadata.get('alternate_bibcode', []))
+            associated_works = registered_record.get('associated_works', None)
+            db_versions = {key: val for key, val in associated_works.items() if val != registered_record['bibcode']} if associated_works else associated_works
+            logger.debug("Calling 'task_output_results' with '%s'", custom_citation_change)
+            task_output_results.delay(custom_citation_change, parsed_metadata, citations, db_versions=db_versions, readers=readers)
+            n_outputs += 1
+        # Targets locked by a unit of work that is marking them again were
+        # skipped and, since they were already marked, that unit of work will
+        # not schedule a flush: schedule it here
+        skipped_contents = db.get_dirty_citation_target_contents(app, contents=contents)
+        if len(skipped_contents) > 0:
+            window = app.conf.get('OUTPUT_RESULTS_WINDOW', 0)
+            logger.info("Rescheduling 'task_flush_dirty_citation_targets' in %i seconds for %i locked dirty citation targets", window, len(skipped_contents))
+            db.call_after_commit(task_flush_dirty_citation_targets.apply_async, args=(skipped_contents,), countdown=window)
+    n_marks = sum(dirty_target['n_marks'] for dirty_target in dirty_targets)
+    logger.info("Flushed %i dirty citation targets: %i records forwarded for %i changes (%i messages saved)", len(dirty_targets), n_outputs, n_marks, n_marks - n_outputs)
+    return n_marks - n_outputs
+
 @app.task(queue='output-results')
 def task_output_results(citation_change, parsed_metadata, citations, db_versions={"":""}, bibcode_replaced={}, readers=[], only_nonbib=False):
     """
@@ -1146,15 +1597,15 @@ def task_output_results(citation_change, parsed_metadata, citations, db_versions
     for record, nonbib_record in messages:
         if not only_nonbib:
             logger.debug('Will forward bib record: %s', record)    
-            logger.debug("Calling 'app.forward_message' with '%s'", str(record.toJSON()))
+            logger.debug("Calling 'app.forward_record' with '%s'", str(record.toJSON()))
             if not app.conf['CELERY_ALWAYS_EAGER']:
-                app.forward_message(record)
+                app.forward_record(record)
         else:
             logger.debug("Only asked to forward nonbib record")
         logger.debug('Will forward nonbib record: %s', nonbib_record)
-        logger.debug("Calling 'app.forward_message' with '%s'", str(nonbib_record.toJSON()))
+        logger.debug("Calling 'app.forward_record' with '%s'", str(nonbib_record.toJSON()))
         if not app.conf['CELERY_ALWAYS_EAGER']:
-            app.forward_message(nonbib_record)
+            app.forward_record(nonbib_record)
 
 
 if __name__ == '__main__':
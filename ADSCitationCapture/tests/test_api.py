@@ -0,0 +1,134 @@
+import time
+import unittest
+import threading
+import httpretty
+import json
+from mock import patch
+from ADSCitationCapture import api, db
+from .test_base import TestBase
+
+
+class TestApi(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        httpretty.enable()  # enable HTTPretty so that it will monkey patch the socket module
+        self.bigquery_url = self.app.conf['ADS_API_URL']+"search/bigquery"
+        httpretty.register_uri(httpretty.POST, self.bigquery_url, body=self._bigquery_callback, content_type="application/json")
+
+    def tearDown(self):
+        TestBase.tearDown(self)
+        httpretty.disable()
+        httpretty.reset()   # clean up registered urls and request history
+
+    def _requested_bibcodes(self, request):
+        return request.body.decode('utf-8').split("\n")[1:]
+
+    def _bigquery_callback(self, request, uri, response_headers):
+        docs = [
+            {'bibcode': '2016AJ....152..123G', 'alternate_bibcode': ['2016arXiv160306474G']},
+            {'bibcode': '2005CaJES..42.1987P'},
+        ]
+        requested_bibcodes = self._requested_bibcodes(request)
+        docs = [doc for doc in docs if doc['bibcode'] in requested_bibcodes or set(doc.get('alternate_bibcode', [])).intersection(requested_bibcodes)]
+        return [200, response_headers, json.dumps({'response': {'docs': docs}})]
+
+    def test_get_canonical_bibcodes_cache(self):
+        bibcodes = ['2016arXiv160306474G', '2005CaJES..42.1987P', '2019ApJ...877L..39C']
+        canonical_bibcodes = api.get_canonical_bibcodes(self.app, bibcodes)
+        self.assertEqual(canonical_bibcodes, ['2016AJ....152..123G', '2005CaJES..42.1987P'])
+        self.assertEqual(len(httpretty.latest_requests()), 1)
+        self.assertEqual(self._requested_bibcodes(httpretty.last_request()), bibcodes)
+        self.assertEqual(api.get_canonical_bibcode_cache_stats(self.app), {'hits': 0, 'misses': 3, 'size': 2})
+
+        # The bibcode that could not be resolved is not requested again until its miss expires
+        canonical_bibcodes = api.get_canonical_bibcodes(self.app, bibcodes)
+        self.assertEqual(canonical_bibcodes, ['2016AJ....152..123G', '2005CaJES..42.1987P'])
+        self.assertEqual(len(httpretty.latest_requests()), 1)
+        self.assertEqual(api.get_canonical_bibcode_cache_stats(self.app), {'hits': 2, 'misses': 4, 'size': 2})
+        self.assertIsNone(api.get_canonical_bibcode(self.app, '2019ApJ...877L..39C'))
+        self.assertEqual(len(httpretty.latest_requests()), 1)
+
+        # Fully cached requests do not reach the API
+        self.assertEqual(api.get_canonical_bibcode(self.app, '2016arXiv160306474G'), '2016AJ....152..123G')
+        self.assertEqual(len(httpretty.latest_requests()), 1)
+
+        # The cache can be bypassed (and refreshed)
+        canonical_bibcodes = api.get_canonical_bibcodes(self.app, bibcodes, use_cache=False)
+        self.assertEqual(canonical_bibcodes, ['2016AJ....152..123G', '2005CaJES..42.1987P'])
+        self.assertEqual(len(httpretty.latest_requests()), 2)
+        self.assertEqual(self._requested_bibcodes(httpretty.last_request()), bibcodes)
+
+    def test_get_canonical_bibcodes_ignores_unmatched_records(self):
+        self.app.conf['CANONICAL_BIBCODE_CACHE_PERSIST'] = True
+        docs = [{'bibcode': '2005CaJES..42.1987P'}, {'bibcode': '2020ApJ...900...01A'}]
+        httpretty.register_uri(httpretty.POST, self.bigquery_url, body=json.dumps({'response': {'docs': docs}}), content_type="application/json")
+        canonical_bibcodes = api.resolve_canonical_bibcodes(self.app, ['2005CaJES..42.1987P'])
+        self.assertEqual(canonical_bibcodes, {'2005CaJES..42.1987P': '2005CaJES..42.1987P'})
+        # Records that were not requested are neither cached nor stored
+        self.assertEqual(api.get_canonical_bibcode_cache_stats(self.app)['size'], 1)
+        self.assertEqual(db.get_stored_canonical_bibcodes(self.app, ['2020ApJ...900...01A'], 3600), {})
+
+    def test_get_canonical_bibcodes_unresolved_cache_expires(self):
+        self.app.conf['UNRESOLVED_BIBCODE_CACHE_TTL'] = 0.2
+        self.assertIsNone(api.get_canonical_bibcode(self.app, '2019ApJ...877L..39C'))
+        self.assertIsNone(api.get_canonical_bibcode(self.app, '2019ApJ...877L..39C'))
+        self.assertEqual(len(httpretty.latest_requests()), 1)
+        time.sleep(0.3)
+        self.assertIsNone(api.get_canonical_bibcode(self.app, '2019ApJ...877L..39C'))
+        self.assertEqual(len(httpretty.latest_requests()), 2)
+
+    def test_get_canonical_bibcodes_persistent_cache(self):
+        self.app.conf['CANONICAL_BIBCODE_CACHE_PERSIST'] = True
+        bibcodes = ['2016arXiv160306474G', '2005CaJES..42.1987P']
+        api.get_canonical_bibcodes(self.app, bibcodes)
+        self.assertEqual(len(httpretty.latest_requests()), 1)
+        # A new worker process starts with an empty in-memory cache
+        api._canonical_bibcode_cache = None
+        canonical_bibcodes = api.get_canonical_bibcodes(self.app, bibcodes)
+        self.assertEqual(canonical_bibcodes, ['2016AJ....152..123G', '2005CaJES..42.1987P'])
+        self.assertEqual(len(httpretty.latest_requests()), 1)
+
+    def test_get_canonical_bibcodes_concurrent_chunks(self):
+        self.app.conf['CANONICAL_BIBCODES_MAX_CONCURRENT_CHUNKS'] = 3
+        self.app.conf['CANONICAL_BIBCODES_BACKOFF'] = 0.01
+        bibcodes = ["2020arXiv{:09d}A".format(i) for i in range(4*2000+10)]
+        state = {'in_flight': 0, 'max_in_flight': 0, 'failed': set()}
+        lock = threading.Lock()
+        def bigquery_stub(request, uri, response_headers):
+            requested_bibcodes = self._requested_bibcodes(request)
+            with lock:
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+            try:
+                # Latency, with the first chunk answering last
+                time.sleep(0.3 if requested_bibcodes[0] == bibcodes[0] else 0.1)
+                # Every chunk fails the first time
+                with lock:
+                    if requested_bibcodes[0] not in state['failed']:
+                        state['failed'].add(requested_bibcodes[0])
+                        return [500, response_headers, json.dumps({'error': 'Injected error'})]
+                docs = [{'bibcode': bibcode.replace('arXiv', 'ApJ..'), 'alternate_bibcode': [bibcode]} for bibcode in reversed(requested_bibcodes)]
+                return [200, response_headers, json.dumps({'response': {'docs': docs}})]
+            finally:
+                with lock:
+                    state['in_flight'] -= 1
+        httpretty.register_uri(httpretty.POST, self.bigquery_url, body=bigquery_stub, content_type="application/json")
+        canonical_bibcodes = api.resolve_canonical_bibcodes(self.app, bibcodes, use_cache=False)
+        self.assertEqual(canonical_bibcodes, dict((bibcode, bibcode.replace('arXiv', 'ApJ..')) for bibcode in bibcodes))
+        # 5 chunks requested twice each (injected error + retry), never more than 3 at the same time
+        self.assertEqual(len(httpretty.latest_requests()), 10)
+        self.assertEqual(len(state['failed']), 5)
+        self.assertGreater(state['max_in_flight'], 1)
+        self.assertLessEqual(state['max_in_flight'], 3)
+
+    def test_get_canonical_bibcodes_chunk_fails(self):
+        self.app.conf['CANONICAL_BIBCODES_RETRIES'] = 2
+        self.app.conf['CANONICAL_BIBCODES_BACKOFF'] = 0.01
+        with patch.object(api, '_get_canonical_bibcodes', side_effect=Exception("Injected error")) as get_canonical_bibcodes:
+            with self.assertRaises(Exception):
+                api.get_canonical_bibcodes(self.app, ['2019ApJ...877L..39C'])
+        self.assertEqual(get_canonical_bibcodes.call_count, 3)
+
+if __name__ == '__main__':
+    unittest.main()
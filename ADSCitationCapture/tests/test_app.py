@@ -0,0 +1,81 @@
+import time
+import unittest
+import adsmsg
+from mock import patch
+from ADSCitationCapture import app, tasks
+from .test_base import TestBase
+
+
+class TestOutputBatcher(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+
+    def tearDown(self):
+        TestBase.tearDown(self)
+
+    def _nonbib_records(self, n_records):
+        return [adsmsg.NonBibRecord(bibcode="2020zndo....{:07d}A".format(i), readers=["00000000000000a1"]) for i in range(n_records)]
+
+    def test_forward_record_in_batches(self):
+        self.app.conf['OUTPUT_BATCH_MAX_RECORDS'] = 3
+        self.app.conf['OUTPUT_BATCH_MAX_DELAY'] = 60
+        with patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=None) as forward_message:
+            # Bib records do not have a list message and are forwarded right away
+            record = adsmsg.DenormalizedRecord(bibcode="2020zndo....0000000A")
+            self.app.forward_record(record)
+            self.assertEqual(forward_message.call_count, 1)
+            self.assertIs(forward_message.call_args[0][0], record)
+            nonbib_records = self._nonbib_records(7)
+            for nonbib_record in nonbib_records:
+                self.app.forward_record(nonbib_record)
+            self.assertEqual(forward_message.call_count, 3)
+            self.app.flush_forwarded_records()
+            self.assertEqual(forward_message.call_count, 4)
+            messages = [call[0][0] for call in forward_message.call_args_list[1:]]
+            self.assertTrue(all(isinstance(message, adsmsg.NonBibRecordList) for message in messages))
+            self.assertEqual([len(message.nonbib_records) for message in messages], [3, 3, 1])
+            self.assertEqual([record.bibcode for message in messages for record in message.nonbib_records], [record.bibcode for record in nonbib_records])
+            # Nothing left to flush
+            self.app.flush_forwarded_records()
+            self.assertEqual(forward_message.call_count, 4)
+
+    def test_forward_record_size_and_time_thresholds(self):
+        nonbib_records = self._nonbib_records(3)
+        self.app.conf['OUTPUT_BATCH_MAX_RECORDS'] = 100
+        self.app.conf['OUTPUT_BATCH_MAX_BYTES'] = nonbib_records[0]._data.ByteSize() + 1
+        self.app.conf['OUTPUT_BATCH_MAX_DELAY'] = 60
+        with patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=None) as forward_message:
+            self.app.forward_record(nonbib_records[0])
+            self.app.forward_record(nonbib_records[1])
+            self.assertEqual(forward_message.call_count, 1)
+            self.assertEqual(len(forward_message.call_args[0][0].nonbib_records), 2)
+        self.app.flush_forwarded_records()
+        self.app._output_batcher = None
+        self.app.conf['OUTPUT_BATCH_MAX_BYTES'] = 1024*1024
+        self.app.conf['OUTPUT_BATCH_MAX_DELAY'] = 0.1
+        with patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=None) as forward_message:
+            self.app.forward_record(nonbib_records[0])
+            # There is no background flush, the delay is checked when the next record is added
+            time.sleep(0.2)
+            self.assertFalse(forward_message.called)
+            self.app.forward_record(nonbib_records[1])
+            self.assertEqual(forward_message.call_count, 1)
+            self.assertEqual(len(forward_message.call_args[0][0].nonbib_records), 2)
+
+    def test_flush_forwarded_records_on_task_end(self):
+        self.app.conf['OUTPUT_BATCH_MAX_RECORDS'] = 100
+        self.app.conf['OUTPUT_BATCH_MAX_DELAY'] = 60
+        with patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=None) as forward_message:
+            for nonbib_record in self._nonbib_records(2):
+                self.app.forward_record(nonbib_record)
+            self.assertFalse(forward_message.called)
+            # Records do not stay buffered once the task that produced them ends
+            tasks._flush_forwarded_records_on_task_end()
+            self.assertEqual(forward_message.call_count, 1)
+            self.assertEqual(len(forward_message.call_args[0][0].nonbib_records), 2)
+            tasks._flush_forwarded_records_on_task_end()
+            self.assertEqual(forward_message.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,9 @@
 import unittest
 import contextlib
 import mock
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from adsputils import load_config
-from ADSCitationCapture import app, tasks
+from ADSCitationCapture import app, tasks, api
 from ADSCitationCapture.models import Base
 
 class TestBase(unittest.TestCase):
@@ -31,6 +31,26 @@ class TestBase(unittest.TestCase):
             mock_patch.stop()
 
 
+    def _count_database_operations(self, call):
+        """
+        Return the number of connection checkouts, commits and statements
+        executed by call()
+        """
+        counts = {'checkouts': 0, 'commits': 0, 'statements': 0}
+        def count(name):
+            def listener(*args, **kwargs):
+                counts[name] += 1
+            return listener
+        listeners = ((self.app._engine.pool, 'checkout', count('checkouts')), (self.app._engine, 'commit', count('commits')), (self.app._engine, 'before_cursor_execute', count('statements')))
+        for target, name, listener in listeners:
+            event.listen(target, name, listener)
+        try:
+            call()
+        finally:
+            for target, name, listener in listeners:
+                event.remove(target, name, listener)
+        return counts
+
     def setUp(self):
         unittest.TestCase.setUp(self)
         self.proj_home = tasks.app.conf['PROJ_HOME']
@@ -42,6 +62,7 @@ class TestBase(unittest.TestCase):
             "CELERY_ALWAYS_EAGER": False,
             "CELERY_EAGER_PROPAGATES_EXCEPTIONS": False,
             "SQLALCHEMY_URL": self.sqlalchemy_url,
+            "OUTPUT_BATCH_MAX_RECORDS": 1,
         }
         self.app = app.ADSCitationCaptureCelery('test', proj_home=self.proj_home, local_config=config)
         tasks.app = self.app # monkey-patch the app object
@@ -74,6 +95,9 @@ class TestBase(unittest.TestCase):
         self.app._engine.dispose()
         self.app.close_app()
         tasks.app = self._app
+        # Do not share cached canonical bibcodes between tests
+        api._canonical_bibcode_cache = None
+        api._unresolved_bibcode_cache = None
 
     def _init_mock_data(self):
         self.mock_data = {}
@@ -0,0 +1,301 @@
+import os
+import tempfile
+import unittest
+import mock
+import adsmsg
+from sqlalchemy import event
+from sqlalchemy_continuum import version_class
+from ADSCitationCapture import db
+from ADSCitationCapture.models import Citation, CitationTarget, Reader
+from .test_base import TestBase
+
+
+class TestDatabase(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+
+    def tearDown(self):
+        TestBase.tearDown(self)
+
+    def _citation_change(self, citing, content, status=adsmsg.Status.new):
+        citation_change = adsmsg.CitationChange()
+        citation_change.citing = citing
+        citation_change.cited = '...................'
+        citation_change.content = content
+        citation_change.content_type = adsmsg.CitationChangeContentType.doi
+        citation_change.resolved = False
+        citation_change.status = status
+        return citation_change
+
+    def _store_target_and_citations(self, content, citing_bibcodes, status='REGISTERED'):
+        metadata = self.mock_data[content]
+        citation_change = self._citation_change(citing_bibcodes[0], content)
+        db.store_citation_target(self.app, citation_change, 'DOI', metadata['raw'], metadata['parsed'], status)
+        for citing in citing_bibcodes:
+            citation_change = self._citation_change(citing, content)
+            db.store_citation(self.app, citation_change, 'DOI', metadata['raw'], metadata['parsed'], status)
+
+    def test_get_existing_citations(self):
+        content = "10.5281/zenodo.11020"
+        self._store_target_and_citations(content, ['2005CaJES..42.1987P', '2016AJ....152..123G'])
+        citing_content_pairs = [
+            ('2005CaJES..42.1987P', content),
+            ('2016AJ....152..123G', content),
+            ('2016AJ....152..123G', "10.5281/zenodo.11021"),
+            ('2019ApJ...877L..39C', content),
+        ]
+        existing_citations = db.get_existing_citations(self.app, citing_content_pairs)
+        self.assertEqual(existing_citations, {('2005CaJES..42.1987P', content), ('2016AJ....152..123G', content)})
+        self.assertEqual(db.get_existing_citations(self.app, []), set())
+
+    def test_get_citation_targets_by_bibcode(self):
+        self._store_target_and_citations("10.5281/zenodo.11020", ['2005CaJES..42.1987P'])
+        self._store_target_and_citations("10.5281/zenodo.11021", ['2005CaJES..42.1987P'])
+        self._store_target_and_citations("10.5281/zenodo.4475376", ['2005CaJES..42.1987P'], status='DISCARDED')
+        bibcodes = ['2014zndo.....11021F', '2021zndo...4475376C', '0000zndo.....00000X', '2014zndo.....11020F', '2014zndo.....11021F']
+        records = db.get_citation_targets_by_bibcode(self.app, bibcodes)
+        # One record per requested bibcode with a match, in the same order
+        self.assertEqual([record['content'] for record in records], ["10.5281/zenodo.11021", "10.5281/zenodo.11020", "10.5281/zenodo.11021"])
+        records = db.get_citation_targets_by_bibcode(self.app, bibcodes, only_status=None)
+        self.assertEqual([record['bibcode'] for record in records], [bibcode for bibcode in bibcodes if bibcode != '0000zndo.....00000X'])
+        self.assertEqual(db.get_citation_targets_by_bibcode(self.app, []), [])
+
+    def test_get_citation_targets_by_alt_bibcode(self):
+        self._store_target_and_citations("10.5281/zenodo.11020", ['2005CaJES..42.1987P'])
+        self._store_target_and_citations("10.5281/zenodo.11021", ['2005CaJES..42.1987P'])
+        records = db.get_citation_targets_by_alt_bibcode(self.app, ['2014zndo.....11021F', '2014zndo.....11021G'])
+        self.assertEqual([record['content'] for record in records], ["10.5281/zenodo.11021"])
+        self.assertEqual(db.get_citation_targets_by_alt_bibcode(self.app, ['2014zndo.....11021G'], only_status='DISCARDED'), [])
+
+    def _process_new_citation(self, content, citing):
+        # Database calls done by task_process_new_citation for a new software citation
+        metadata = self.mock_data[content]
+        citation_change = self._citation_change(citing, content)
+        db.get_citation_target_metadata(self.app, content)
+        db.store_citation_target(self.app, citation_change, 'DOI', metadata['raw'], metadata['parsed'], 'REGISTERED')
+        db.get_citations_by_bibcode(self.app, metadata['parsed']['bibcode'])
+        db.get_citation_target_readers(self.app, metadata['parsed']['bibcode'], metadata['parsed'].get('alternate_bibcode', []))
+        db.store_citation(self.app, citation_change, 'DOI', metadata['raw'], metadata['parsed'], 'REGISTERED')
+
+    def test_task_session_scope(self):
+        def process_in_task_session():
+            with db.task_session_scope(self.app):
+                self._process_new_citation("10.5281/zenodo.11021", '2019ApJ...877L..39C')
+        separate_sessions = self._count_database_operations(lambda: self._process_new_citation("10.5281/zenodo.11020", '2005CaJES..42.1987P'))
+        task_session = self._count_database_operations(process_in_task_session)
+        self.assertEqual(task_session['checkouts'], 1)
+        self.assertEqual(task_session['commits'], 1)
+        self.assertLess(task_session['checkouts'], separate_sessions['checkouts'])
+        self.assertLess(task_session['commits'], separate_sessions['commits'])
+        self.assertLessEqual(task_session['statements'], separate_sessions['statements'])
+        self.assertEqual(db.get_citations(self.app, self._citation_change('2019ApJ...877L..39C', "10.5281/zenodo.11021")), ['2019ApJ...877L..39C'])
+
+    def test_task_session_scope_rollback(self):
+        callback = mock.Mock()
+        with self.assertRaises(ValueError):
+            with db.task_session_scope(self.app):
+                self._store_target_and_citations("10.5281/zenodo.11020", ['2005CaJES..42.1987P'])
+                db.call_after_commit(callback, "10.5281/zenodo.11020")
+                raise ValueError("Task failed")
+        # Nothing is stored and queued callbacks are dropped
+        self.assertEqual(db.get_citation_target_count(self.app), 0)
+        self.assertFalse(callback.called)
+        with db.task_session_scope(self.app):
+            db.call_after_commit(callback, "10.5281/zenodo.11020")
+            self.assertFalse(callback.called)
+        callback.assert_called_once_with("10.5281/zenodo.11020")
+
+    def test_task_session_scope_failed_write(self):
+        # A write that fails and is handled by its helper does not break the unit of work
+        with db.task_session_scope(self.app):
+            self._store_target_and_citations("10.5281/zenodo.11020", ['2005CaJES..42.1987P'])
+            self.assertFalse(db.store_event(self.app, {'test': 0}, status='UNKNOWN'))
+            self.assertTrue(db.store_event(self.app, {'test': 1}, status='PENDING'))
+        self.assertEqual(db.get_citation_target_count(self.app), 1)
+        self.assertEqual([event['data'] for event in db.get_pending_events(self.app, 10)], [{'test': 1}])
+
+    def test_store_bulk(self):
+        contents = ["10.5281/zenodo.11020", "10.5281/zenodo.11021"]
+        self._store_target_and_citations(contents[0], ['2005CaJES..42.1987P'])
+        citation_targets = []
+        citations = []
+        for content in contents + contents:
+            metadata = self.mock_data[content]
+            citation_change = self._citation_change('2016AJ....152..123G', content)
+            citation_targets.append((citation_change, 'DOI', metadata['raw'], metadata['parsed'], 'REGISTERED'))
+            citations.append((citation_change, 'DOI', metadata['raw'], metadata['parsed'], 'REGISTERED'))
+        # Only rows that did not exist (in the database or earlier in the input) are reported
+        self.assertEqual(db.store_citation_targets_bulk(self.app, citation_targets), [contents[1]])
+        self.assertEqual(db.store_citations_bulk(self.app, citations), [('2016AJ....152..123G', content) for content in contents])
+        self.assertEqual(db.store_citations_bulk(self.app, citations), [])
+        self.assertEqual(db.get_citation_target_count(self.app), 2)
+        self.assertEqual(db.get_citation_count(self.app), 3)
+        # Versions are recorded as sqlalchemy_continuum does for ORM inserts
+        with self.app.session_scope() as session:
+            CitationTargetVersion = version_class(CitationTarget)
+            CitationVersion = version_class(Citation)
+            self.assertEqual(session.query(CitationTargetVersion).filter_by(content=contents[1], operation_type=0).count(), 1)
+            self.assertEqual(session.query(CitationVersion).filter_by(operation_type=0).count(), 3)
+            citation_target = session.query(CitationTarget).filter_by(content=contents[1]).first()
+            self.assertEqual(citation_target.versions[0].bibcode, self.mock_data[contents[1]]['parsed']['bibcode'])
+
+    def test_store_canonical_bibcodes(self):
+        canonical_bibcodes = {'2000bnch.{:010d}A'.format(i): '2000bnch.{:010d}B'.format(i) for i in range(5)}
+        statements = []
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("INSERT INTO CANONICAL_BIBCODE"):
+                statements.append(statement)
+        event.listen(self.app._engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            db.store_canonical_bibcodes(self.app, canonical_bibcodes, chunk_size=2)
+        finally:
+            event.remove(self.app._engine, "before_cursor_execute", before_cursor_execute)
+        # Bounded batches: 5 rows in statements of at most 2 rows
+        self.assertEqual(len(statements), 3)
+        self.assertEqual(db.get_stored_canonical_bibcodes(self.app, list(canonical_bibcodes), 3600), canonical_bibcodes)
+        # Existing bibcodes are refreshed
+        db.store_canonical_bibcodes(self.app, {'2000bnch.0000000000A': '2000bnch.0000000000C'}, chunk_size=2)
+        self.assertEqual(db.get_stored_canonical_bibcodes(self.app, ['2000bnch.0000000000A'], 3600), {'2000bnch.0000000000A': '2000bnch.0000000000C'})
+
+    def test_maintenance_job(self):
+        contents = ["10.5281/zenodo.11020", "10.5281/zenodo.11021", "10.5281/zenodo.4475376"]
+        for content in contents:
+            self._store_target_and_citations(content, ['2005CaJES..42.1987P'])
+        job_id = db.create_maintenance_job(self.app, 'canonical', {}, ['REGISTERED'], 2)
+        job = db.get_maintenance_job(self.app, job_id)
+        self.assertEqual(job['n_chunks'], 2)
+        self.assertEqual(job['n_pending_chunks'], 2)
+        self.assertEqual(job['status'], 'PENDING')
+        chunk_ids = db.get_pending_maintenance_chunks(self.app, job_id)
+        # Chunks cover all the targets without overlapping
+        processed_contents = []
+        for chunk_id in chunk_ids:
+            chunk = db.get_maintenance_job_chunk(self.app, chunk_id)
+            records = db.get_citation_targets(self.app, only_status='REGISTERED', after_content=chunk['after_content'], last_content=chunk['last_content'])
+            processed_contents += [record['content'] for record in records]
+        self.assertEqual(sorted(processed_contents), sorted(contents))
+        # Resuming only considers chunks that are not done
+        self.assertEqual(db.mark_maintenance_chunk_as_done(self.app, chunk_ids[0]), 1)
+        self.assertEqual(db.get_pending_maintenance_chunks(self.app, job_id), chunk_ids[1:])
+        self.assertEqual(db.mark_maintenance_chunk_as_done(self.app, chunk_ids[1]), 0)
+        self.assertEqual(db.get_maintenance_job(self.app, job_id)['status'], 'DONE')
+
+    def test_write_citation_target_data(self):
+        self._store_target_and_citations("10.5281/zenodo.11021", ['2019ApJ...877L..39C', '2005CaJES..42.1987P'])
+        self._store_target_and_citations("10.5281/zenodo.11020", ['2016AJ....152..123G'])
+        self._store_target_and_citations("10.5281/zenodo.4475376", ['2016AJ....152..123G'], status='DISCARDED')
+        bibcode_11020 = self.mock_data["10.5281/zenodo.11020"]['parsed']['bibcode']
+        bibcode_11021 = self.mock_data["10.5281/zenodo.11021"]['parsed']['bibcode']
+        authors_11020 = self.mock_data["10.5281/zenodo.11020"]['parsed']['normalized_authors']
+        authors_11021 = self.mock_data["10.5281/zenodo.11021"]['parsed']['normalized_authors']
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_names = dict((key, os.path.join(tmp_dir, key)) for key in db.file_names)
+            with mock.patch.dict(db.file_names, file_names):
+                db.write_citation_target_data(self.app, only_status='REGISTERED')
+            written = {}
+            for key in file_names:
+                self.assertFalse(os.path.exists(file_names[key]+".tmp"))
+                with open(file_names[key]) as f:
+                    written[key] = f.read()
+        self.assertEqual(written['bibcode'], "\n".join([bibcode_11020, bibcode_11021]))
+        self.assertEqual(written['citations'], "".join([
+            bibcode_11020+"\t2016AJ....152..123G\n",
+            bibcode_11021+"\t2005CaJES..42.1987P\n",
+            bibcode_11021+"\t2019ApJ...877L..39C\n",
+        ]))
+        self.assertEqual(written['references'], "".join([
+            "2016AJ....152..123G\t"+bibcode_11020+"\n",
+            "2005CaJES..42.1987P\t"+bibcode_11021+"\n",
+            "2019ApJ...877L..39C\t"+bibcode_11021+"\n",
+        ]))
+        self.assertEqual(written['authors'], "".join([
+            bibcode_11020+"\t"+"\t".join(authors_11020)+"\n",
+            bibcode_11021+"\t"+"\t".join(authors_11021)+"\n",
+        ]))
+
+    def _write_nonbib_files(self, output_dir, incremental=False):
+        file_names = dict((key, os.path.join(output_dir, key)) for key in db.file_names)
+        with mock.patch.dict(db.file_names, file_names), \
+                mock.patch.object(db, 'nonbib_watermark_file_name', os.path.join(output_dir, 'watermark')):
+            db.write_citation_target_data(self.app, only_status='REGISTERED', incremental=incremental)
+        written = {}
+        for key in file_names:
+            with open(file_names[key], 'rb') as f:
+                written[key] = f.read()
+        return written
+
+    def test_write_citation_target_data_incremental(self):
+        self._store_target_and_citations("10.5281/zenodo.11021", ['2019ApJ...877L..39C'])
+        self._store_target_and_citations("10.5281/zenodo.11020", ['2016AJ....152..123G'])
+        with tempfile.TemporaryDirectory() as incremental_dir, tempfile.TemporaryDirectory() as full_dir:
+            self._write_nonbib_files(incremental_dir, incremental=True) # No watermark, full export
+            # New citation, new target and a target that changes its bibcode
+            self._store_target_and_citations("10.5281/zenodo.11021", ['2005CaJES..42.1987P'])
+            self._store_target_and_citations("10.5281/zenodo.4475376", ['2016AJ....152..123G'])
+            metadata = self.mock_data["10.5281/zenodo.11020"]
+            parsed_metadata = dict(metadata['parsed'], bibcode='2014zndo.....11020Z')
+            db.update_citation_target_metadata(self.app, "10.5281/zenodo.11020", metadata['raw'], parsed_metadata, status='REGISTERED', bibcode=parsed_metadata['bibcode'])
+            with mock.patch.object(db, '_write_key_citation_target_data', wraps=db._write_key_citation_target_data) as write_target_data:
+                incremental = self._write_nonbib_files(incremental_dir, incremental=True)
+            self.assertIsNotNone(write_target_data.call_args[1]['bibcodes'])
+            full = self._write_nonbib_files(full_dir)
+        self.assertEqual(incremental, full)
+        self.assertIn(b'2014zndo.....11020Z', full['bibcode'])
+        self.assertNotIn(self.mock_data["10.5281/zenodo.11020"]['parsed']['bibcode'].encode(), full['bibcode'])
+
+    def _seed_large_tables(self, n_records=1000):
+        targets = [{'content': "10.5281/seed.{}".format(i), 'content_type': 'DOI', 'bibcode': "2000seed.{:010d}S".format(i),
+                    'parsed_cited_metadata': {'bibcode': "2000seed.{:010d}S".format(i), 'alternate_bibcode': ["2000seed.{:010d}A".format(i)]},
+                    'status': 'REGISTERED'} for i in range(n_records)]
+        citations = [{'content': "10.5281/seed.{}".format(i), 'citing': "2001seed.{:010d}C".format(i), 'status': 'REGISTERED'} for i in range(n_records)]
+        readers = [{'bibcode': "2000seed.{:010d}S".format(i), 'reader': "{:016x}".format(i), 'status': 'REGISTERED'} for i in range(n_records)]
+        with self.app._engine.begin() as connection:
+            connection.execute(CitationTarget.__table__.insert(), targets)
+            connection.execute(Citation.__table__.insert(), citations)
+            connection.execute(Reader.__table__.insert(), readers)
+        for table in (CitationTarget.__table__, Citation.__table__, Reader.__table__):
+            self.app._engine.execute("ANALYZE {}".format(table.fullname))
+
+    def _query_plans(self, call):
+        """
+        Return the query plans of the SELECT statements executed by call()
+        """
+        statements = []
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT"):
+                statements.append((statement, parameters))
+        event.listen(self.app._engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            call()
+        finally:
+            event.remove(self.app._engine, "before_cursor_execute", before_cursor_execute)
+        plans = []
+        with self.app._engine.connect() as connection:
+            # Sequential scans are only chosen if there is no index that can be used
+            connection.execute("SET enable_seqscan = off")
+            for statement, parameters in statements:
+                plan = connection.execute("EXPLAIN "+statement, parameters).fetchall()
+                plans.append("\n".join(row[0] for row in plan))
+        return plans
+
+    def test_query_plans_use_indexes(self):
+        self._seed_large_tables()
+        bibcode = "2000seed.0000000042S"
+        calls = [
+            lambda: db.get_citation_targets_by_bibcode(self.app, [bibcode]),
+            lambda: db.get_citation_targets_by_alt_bibcode(self.app, ["2000seed.0000000042A"]),
+            lambda: db.get_citations_by_bibcode(self.app, bibcode),
+            lambda: db.get_citation_target_readers(self.app, bibcode, ["2000seed.0000000042A"]),
+            lambda: db.get_existing_citations(self.app, [("2001seed.0000000042C", "10.5281/seed.42")]),
+        ]
+        for call in calls:
+            plans = self._query_plans(call)
+            self.assertTrue(len(plans) > 0)
+            for plan in plans:
+                for table in ("citation_target", "citation", "readers"):
+                    self.assertNotIn("Seq Scan on {} ".format(table), plan+" ")
+
+
+if __name__ == '__main__':
+    unittest.main()
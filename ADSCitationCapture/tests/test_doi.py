@@ -101,6 +101,39 @@ class TestWorkers(TestBase):
         httpretty.disable()
         httpretty.reset()
 
+    def test_fetch_metadata_if_modified(self):
+        doi_id = "10.5281/zenodo.11020" # software
+        expected_response_content = self.mock_data[doi_id]['raw']
+        etag = '"a1b2c3"'
+        def conditional_response(request, uri, response_headers):
+            if request.headers.get('If-None-Match') == etag:
+                return [304, response_headers, ""]
+            response_headers['ETag'] = etag
+            return [200, response_headers, expected_response_content]
+        httpretty.enable()  # enable HTTPretty so that it will monkey patch the socket module
+        httpretty.register_uri(httpretty.GET, self.app.conf['DOI_URL']+doi_id, body=conditional_response)
+        # First fetch
+        modified, raw_metadata, validators = doi.fetch_metadata_if_modified(self.app.conf['DOI_URL'], self.app.conf['DATACITE_URL'], doi_id)
+        self.assertTrue(modified)
+        self.assertEqual(raw_metadata, expected_response_content)
+        self.assertEqual(validators['source'], self.app.conf['DOI_URL']+doi_id)
+        self.assertEqual(validators['etag'], etag)
+        self.assertEqual(validators['content_hash'], doi.content_hash(expected_response_content))
+        # Revalidation answered with '304 Not Modified'
+        modified, raw_metadata, new_validators = doi.fetch_metadata_if_modified(self.app.conf['DOI_URL'], self.app.conf['DATACITE_URL'], doi_id, cached=validators)
+        self.assertFalse(modified)
+        self.assertIsNone(raw_metadata)
+        self.assertEqual(new_validators, validators)
+        # Server ignores validators but the content did not change
+        modified, raw_metadata, new_validators = doi.fetch_metadata_if_modified(self.app.conf['DOI_URL'], self.app.conf['DATACITE_URL'], doi_id, cached=dict(validators, etag=None))
+        self.assertFalse(modified)
+        self.assertEqual(raw_metadata, expected_response_content)
+        # Content changed
+        modified, raw_metadata, new_validators = doi.fetch_metadata_if_modified(self.app.conf['DOI_URL'], self.app.conf['DATACITE_URL'], doi_id, cached=dict(validators, etag=None, content_hash="0"))
+        self.assertTrue(modified)
+        httpretty.disable()
+        httpretty.reset()
+
 
 
 if __name__ == '__main__':
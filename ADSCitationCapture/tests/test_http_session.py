@@ -0,0 +1,48 @@
+import unittest
+import httpretty
+import mock
+from ADSCitationCapture import http_session
+from .test_base import TestBase
+
+
+class TestHttpSession(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+
+    def tearDown(self):
+        TestBase.tearDown(self)
+        http_session.close_sessions()
+
+    def test_sessions_are_shared_per_host(self):
+        session = http_session.get_session("https://doi.org/10.5281/zenodo.11020")
+        self.assertIs(session, http_session.get_session("https://doi.org/10.5281/zenodo.11021"))
+        self.assertIsNot(session, http_session.get_session("https://api.datacite.org/works/10.5281/zenodo.11020"))
+
+    def test_retry_transient_errors(self):
+        url = "https://api.datacite.org/works/10.5281/zenodo.11020"
+        httpretty.enable()  # enable HTTPretty so that it will monkey patch the socket module
+        httpretty.register_uri(httpretty.GET, url, responses=[
+            httpretty.Response(body="", status=503),
+            httpretty.Response(body="{}", status=200),
+        ])
+        with mock.patch.dict(http_session.config, {'HTTP_BACKOFF_FACTOR': 0}):
+            r = http_session.get(url)
+        self.assertTrue(r.ok)
+        self.assertEqual(len(httpretty.latest_requests()), 2)
+        httpretty.disable()
+        httpretty.reset()   # clean up registered urls and request history
+
+    def test_fetch_concurrently(self):
+        def fetch(item):
+            if item == 3:
+                raise ValueError("Failed fetch")
+            return item * 10
+        fetched = list(http_session.fetch_concurrently(fetch, range(50), max_workers=4))
+        self.assertEqual([item for item, future in fetched], list(range(50)))
+        self.assertEqual([future.result() for item, future in fetched if item != 3], [item * 10 for item in range(50) if item != 3])
+        self.assertRaises(ValueError, fetched[3][1].result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+import adsmsg
+from sqlalchemy.engine.reflection import Inspector
+from ADSCitationCapture import db
+from ADSCitationCapture.reader_import import ReaderImport
+from .test_base import TestBase
+
+
+class TestReaderImport(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        self.schema_prefix = "test_citation_capture_readers_"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        for schema_name in Inspector.from_engine(self.app._engine).get_schema_names():
+            if schema_name.startswith(self.schema_prefix):
+                self.app._engine.execute("drop schema {0} cascade;".format(schema_name))
+        self.tmp_dir.cleanup()
+        TestBase.tearDown(self)
+
+    def _write_readers_file(self, name, rows, mtime):
+        filename = os.path.join(self.tmp_dir.name, name)
+        with open(filename, "w") as f:
+            f.write("".join("{}\t{}\n".format(bibcode, reader) for bibcode, reader in rows))
+        os.utime(filename, (mtime, mtime))
+        return filename
+
+    def _import(self, filename):
+        readers = ReaderImport(self.sqlalchemy_url, schema_prefix=self.schema_prefix)
+        readers.compute(filename)
+        bibcodes = readers.apply()
+        readers.connection.close()
+        return bibcodes
+
+    def test_apply(self):
+        content = "10.5281/zenodo.11021"
+        metadata = self.mock_data[content]
+        citation_change = adsmsg.CitationChange(citing='2019ApJ...877L..39C', content=content, content_type=adsmsg.CitationChangeContentType.doi)
+        db.store_citation_target(self.app, citation_change, 'DOI', metadata['raw'], metadata['parsed'], 'REGISTERED')
+        bibcode = metadata['parsed']['bibcode']
+        alt_bibcode = metadata['parsed']['alternate_bibcode'][0]
+        unknown_bibcode = "2020zndo.....00000X"
+        rows = [(bibcode, "00000000000000a1"), (alt_bibcode, "00000000000000a2"), (unknown_bibcode, "00000000000000a3")]
+        bibcodes = self._import(self._write_readers_file("readers_1.txt", rows, 1600000000))
+        self.assertEqual(bibcodes, sorted([bibcode, alt_bibcode]))
+        self.assertEqual(sorted(db.get_citation_target_readers(self.app, bibcode, [alt_bibcode])), ["00000000000000a1", "00000000000000a2"])
+        # Readers removed from the next file are marked as deleted
+        bibcodes = self._import(self._write_readers_file("readers_2.txt", rows[1:], 1600000100))
+        self.assertEqual(bibcodes, [bibcode])
+        self.assertEqual(db.get_citation_target_readers(self.app, bibcode, [alt_bibcode]), ["00000000000000a2"])
+
+    def test_iterate_groups_by_bibcode(self):
+        # Unordered input, the changes of each bibcode are not contiguous
+        rows = [("2020zndo.....0000B", "00000000000000b1"), ("2020zndo.....0000A", "00000000000000a1"),
+                ("2020zndo.....0000B", "00000000000000b2"), ("2020zndo.....0000C", "00000000000000c1"),
+                ("2020zndo.....0000A", "00000000000000a2"), ("2020zndo.....0000B", "00000000000000b3")]
+        filename = self._write_readers_file("readers_1.txt", rows, 1600000000)
+        for max_group_size, expected_sizes in ((1000, [2, 3, 1]), (2, [2, 2, 1, 1])):
+            readers = ReaderImport(self.sqlalchemy_url, schema_prefix=self.schema_prefix, max_group_size=max_group_size)
+            readers.compute(filename)
+            groups = list(readers)
+            readers.connection.close()
+            self.assertEqual([len(group) for group in groups], expected_sizes)
+            for group in groups:
+                self.assertEqual(len(set(change['bibcode'] for change in group)), 1)
+                self.assertTrue(all(change['status'] == "NEW" for change in group))
+            changes = [(change['bibcode'], change['reader']) for group in groups for change in group]
+            self.assertEqual(sorted(changes), sorted(rows))
+            self.assertEqual([change[0] for change in changes], sorted(change[0] for change in changes))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -87,10 +87,9 @@ class TestWorkers(TestBase):
                     '\n\x132019arXiv190105855L\x12\x13..................."\x1410.5281/zenodo.118130\x01:\x04\x08\x80\xa3\x05',
                 ]
             # Process first file
-            i = 0
             with TestBase.mock_multiple_targets({
                     'task_process_citation_changes': patch.object(tasks.task_process_citation_changes, 'delay', wraps=tasks.task_process_citation_changes.delay), \
-                    'citation_already_exists': patch.object(db, 'citation_already_exists', wraps=db.citation_already_exists), \
+                    'get_existing_citations': patch.object(db, 'get_existing_citations', wraps=db.get_existing_citations), \
                     'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', wraps=db.get_citation_target_metadata), \
                     'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', wraps=db.get_citations_by_bibcode), \
                     'store_citation_target': patch.object(db, 'store_citation_target', wraps=db.store_citation_target), \
@@ -107,6 +106,7 @@ class TestWorkers(TestBase):
                     'get_citation_targets': patch.object(db, 'get_citation_targets', wraps=db.get_citation_targets), \
                     'get_canonical_bibcode': patch.object(api, 'get_canonical_bibcode', return_value="2015MNRAS.453..483K"), \
                     'get_canonical_bibcodes': patch.object(api, 'get_canonical_bibcodes', return_value=[]), \
+                    'resolve_canonical_bibcodes': patch.object(api, 'resolve_canonical_bibcodes', return_value={}), \
                     'request_existing_citations': patch.object(api, 'request_existing_citations', return_value=[]), \
                     'fetch_metadata': patch.object(doi, 'fetch_metadata', wraps=self._fetch_metadata), \
                     'parse_metadata': patch.object(doi, 'parse_metadata', wraps=doi.parse_metadata), \
@@ -121,13 +121,13 @@ class TestWorkers(TestBase):
                     'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
 
                 self.process(first_refids_filename, sqlalchemy_url=self.sqlalchemy_url, schema_prefix=self.schema_prefix)
-                self.assertTrue(mocked['citation_already_exists'].called)
+                self.assertTrue(mocked['get_existing_citations'].called)
                 self.assertTrue(mocked['get_citation_target_metadata'].called)
                 self.assertTrue(mocked['fetch_metadata'].called)
                 self.assertTrue(mocked['parse_metadata'].called)
                 self.assertTrue(mocked['url_is_alive'].called)
                 self.assertTrue(mocked['get_canonical_bibcode'].called)
-                self.assertTrue(mocked['get_canonical_bibcodes'].called)
+                self.assertFalse(mocked['get_canonical_bibcodes'].called)
                 self.assertTrue(mocked['get_citations_by_bibcode'].called)
                 self.assertTrue(mocked['store_citation_target'].called)
                 self.assertTrue(mocked['store_citation'].called)
@@ -151,18 +151,17 @@ class TestWorkers(TestBase):
                 self.assertTrue(mocked['webhook_dump_event'].called)
                 self.assertTrue(mocked['webhook_emit_event'].called)
                 
+                processed_citation_changes = []
                 for args in mocked['task_process_citation_changes'].call_args_list:
                     citation_changes = args[0][0]
                     for citation_change in citation_changes.changes:
-                        print(citation_change.SerializeToString())
-                        self.assertEqual(citation_change.SerializeToString().decode('latin_1'), expected_citation_change_from_first_file[i])
-                        i += 1
+                        processed_citation_changes.append(citation_change.SerializeToString().decode('latin_1'))
+                self.assertEqual(sorted(processed_citation_changes), sorted(expected_citation_change_from_first_file))
 
             # Process second file
-            i = 0
             with TestBase.mock_multiple_targets({
                     'task_process_citation_changes': patch.object(tasks.task_process_citation_changes, 'delay', wraps=tasks.task_process_citation_changes.delay), \
-                    'citation_already_exists': patch.object(db, 'citation_already_exists', wraps=db.citation_already_exists), \
+                    'get_existing_citations': patch.object(db, 'get_existing_citations', wraps=db.get_existing_citations), \
                     'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', wraps=db.get_citation_target_metadata), \
                     'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', wraps=db.get_citations_by_bibcode), \
                     'store_citation_target': patch.object(db, 'store_citation_target', wraps=db.store_citation_target), \
@@ -179,6 +178,7 @@ class TestWorkers(TestBase):
                     'get_citation_targets': patch.object(db, 'get_citation_targets', wraps=db.get_citation_targets), \
                     'get_canonical_bibcode': patch.object(api, 'get_canonical_bibcode', return_value="2015MNRAS.453..483K"), \
                     'get_canonical_bibcodes': patch.object(api, 'get_canonical_bibcodes', return_value=[]), \
+                    'resolve_canonical_bibcodes': patch.object(api, 'resolve_canonical_bibcodes', return_value={}), \
                     'request_existing_citations': patch.object(api, 'request_existing_citations', return_value=[]), \
                     'fetch_metadata': patch.object(doi, 'fetch_metadata', wraps=self._fetch_metadata), \
                     'parse_metadata': patch.object(doi, 'parse_metadata', wraps=doi.parse_metadata), \
@@ -193,13 +193,13 @@ class TestWorkers(TestBase):
                     'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
 
                 self.process(second_refids_filename, sqlalchemy_url=self.sqlalchemy_url, schema_prefix=self.schema_prefix)
-                self.assertTrue(mocked['citation_already_exists'].called)
+                self.assertTrue(mocked['get_existing_citations'].called)
                 self.assertTrue(mocked['get_citation_target_metadata'].called)
                 self.assertTrue(mocked['fetch_metadata'].called)
                 self.assertTrue(mocked['parse_metadata'].called)
                 self.assertTrue(mocked['url_is_alive'].called)
                 self.assertTrue(mocked['get_canonical_bibcode'].called)
-                self.assertTrue(mocked['get_canonical_bibcodes'].called)
+                self.assertFalse(mocked['get_canonical_bibcodes'].called)
                 self.assertTrue(mocked['get_citations_by_bibcode'].called)
                 self.assertTrue(mocked['store_citation_target'].called)
                 self.assertTrue(mocked['store_citation'].called)
@@ -223,12 +223,32 @@ class TestWorkers(TestBase):
                 self.assertTrue(mocked['webhook_dump_event'].called)
                 self.assertTrue(mocked['webhook_emit_event'].called)
 
+                processed_citation_changes = []
                 for args in mocked['task_process_citation_changes'].call_args_list:
                     citation_changes = args[0][0]
                     for citation_change in citation_changes.changes:
-                        #print(citation_change.SerializeToString())
-                        self.assertEqual(citation_change.SerializeToString().decode('latin_1'), expected_citation_change_from_second_file[i])
-                        i += 1
+                        processed_citation_changes.append(citation_change.SerializeToString().decode('latin_1'))
+                self.assertEqual(sorted(processed_citation_changes), sorted(expected_citation_change_from_second_file))
+
+    def test_delta_computation_iteration(self):
+        refids_filename = os.path.join(self.app.conf['PROJ_HOME'], "ADSCitationCapture/tests/data/sample-refids1.dat")
+        os.utime(refids_filename, (0, 0)) # set the access and modified times to 19700101_000000
+        # Iterate one change at a time
+        delta = delta_computation.DeltaComputation(self.sqlalchemy_url, group_changes_in_chunks_of=1, schema_prefix=self.schema_prefix)
+        delta.compute(refids_filename)
+        one_by_one = [c.SerializeToString() for changes in delta for c in changes.changes]
+        delta.connection.close()
+        # Re-use the same delta table but iterate in chunks that do not divide the number of changes
+        delta = delta_computation.DeltaComputation(self.sqlalchemy_url, group_changes_in_chunks_of=5, schema_prefix=self.schema_prefix)
+        delta.compute(refids_filename)
+        chunks = [changes for changes in delta]
+        in_chunks = [c.SerializeToString() for changes in chunks for c in changes.changes]
+        delta.connection.close()
+        self.assertEqual(delta.n_changes, 12)
+        self.assertEqual([len(changes.changes) for changes in chunks], [5, 5, 2])
+        # Same changes, in the same order and without duplicates
+        self.assertEqual(one_by_one, in_chunks)
+        self.assertEqual(len(set(in_chunks)), delta.n_changes)
 
 if __name__ == '__main__':
     unittest.main()
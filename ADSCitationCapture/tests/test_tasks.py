@@ -1,6 +1,8 @@
 import sys
 import os
 import json
+import time
+import threading
 import adsmsg
 from datetime import datetime
 from ADSCitationCapture import webhook
@@ -10,6 +12,7 @@ from ADSCitationCapture import db
 from ADSCitationCapture import api
 from .test_base import TestBase
 import unittest
+import httpretty
 from ADSCitationCapture import app, tasks
 from mock import patch
 
@@ -36,7 +39,7 @@ class TestWorkers(TestBase):
         citation_changes = self._common_citation_changes_doi(adsmsg.Status.new)
         doi_id = "10.5281/zenodo.11020" # software
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=False), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value=set()), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value={}), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -66,13 +69,13 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertTrue(mocked['get_citation_target_metadata'].called)
             self.assertTrue(mocked['fetch_metadata'].called)
             self.assertTrue(mocked['parse_metadata'].called)
             self.assertFalse(mocked['url_is_alive'].called)
             self.assertTrue(mocked['get_canonical_bibcode'].called)
-            self.assertTrue(mocked['get_canonical_bibcodes'].called)
+            self.assertFalse(mocked['get_canonical_bibcodes'].called)
             self.assertTrue(mocked['get_citations_by_bibcode'].called)
             self.assertTrue(mocked['store_citation_target'].called)
             self.assertTrue(mocked['store_citation'].called)
@@ -101,7 +104,7 @@ class TestWorkers(TestBase):
         citation_changes = self._common_citation_changes_doi(adsmsg.Status.updated)
         doi_id = "10.5281/zenodo.11020" # software
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=True), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value={(citation_changes.changes[0].citing, citation_changes.changes[0].content)}), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value=self.mock_data[doi_id]), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -131,13 +134,13 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertTrue(mocked['get_citation_target_metadata'].called)
             self.assertFalse(mocked['fetch_metadata'].called)
             self.assertFalse(mocked['parse_metadata'].called)
             self.assertFalse(mocked['url_is_alive'].called)
             self.assertFalse(mocked['get_canonical_bibcode'].called)
-            self.assertTrue(mocked['get_canonical_bibcodes'].called)
+            self.assertFalse(mocked['get_canonical_bibcodes'].called)
             self.assertTrue(mocked['get_citations_by_bibcode'].called)
             self.assertFalse(mocked['store_citation_target'].called)
             self.assertFalse(mocked['store_citation'].called)
@@ -165,7 +168,7 @@ class TestWorkers(TestBase):
         citation_changes = self._common_citation_changes_doi(adsmsg.Status.new)
         doi_id = "10.5281/zenodo.4475376" # software
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=False), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value=set()), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value={}), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -197,13 +200,13 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertTrue(mocked['get_citation_target_metadata'].called)
             self.assertTrue(mocked['fetch_metadata'].called)
             self.assertTrue(mocked['parse_metadata'].called)
             self.assertFalse(mocked['url_is_alive'].called)
             self.assertTrue(mocked['get_canonical_bibcode'].called)
-            self.assertTrue(mocked['get_canonical_bibcodes'].called)
+            self.assertFalse(mocked['get_canonical_bibcodes'].called)
             self.assertTrue(mocked['get_citations_by_bibcode'].called)
             self.assertTrue(mocked['store_citation_target'].called)
             self.assertTrue(mocked['store_citation'].called)
@@ -233,7 +236,7 @@ class TestWorkers(TestBase):
         citation_changes = self._common_citation_changes_doi(adsmsg.Status.deleted)
         doi_id = "10.5281/zenodo.11020" # software
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=True), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value={(citation_changes.changes[0].citing, citation_changes.changes[0].content)}), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value=self.mock_data[doi_id]), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -263,13 +266,13 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertTrue(mocked['get_citation_target_metadata'].called)
             self.assertFalse(mocked['fetch_metadata'].called)
             self.assertFalse(mocked['parse_metadata'].called)
             self.assertFalse(mocked['url_is_alive'].called)
             self.assertFalse(mocked['get_canonical_bibcode'].called)
-            self.assertTrue(mocked['get_canonical_bibcodes'].called)
+            self.assertFalse(mocked['get_canonical_bibcodes'].called)
             self.assertTrue(mocked['get_citations_by_bibcode'].called)
             self.assertFalse(mocked['store_citation_target'].called)
             self.assertFalse(mocked['store_citation'].called)
@@ -297,7 +300,7 @@ class TestWorkers(TestBase):
         citation_changes = self._common_citation_changes_doi(adsmsg.Status.new)
         doi_id = "10.5281/zenodo.11020" # software
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=False), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value=set()), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value=self.mock_data[doi_id]), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -327,13 +330,13 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertTrue(mocked['get_citation_target_metadata'].called)
             self.assertFalse(mocked['fetch_metadata'].called)
             self.assertFalse(mocked['parse_metadata'].called)
             self.assertFalse(mocked['url_is_alive'].called)
             self.assertTrue(mocked['get_canonical_bibcode'].called)
-            self.assertTrue(mocked['get_canonical_bibcodes'].called)
+            self.assertFalse(mocked['get_canonical_bibcodes'].called)
             self.assertTrue(mocked['get_citations_by_bibcode'].called)
             self.assertFalse(mocked['store_citation_target'].called)
             self.assertTrue(mocked['store_citation'].called)
@@ -361,7 +364,7 @@ class TestWorkers(TestBase):
         citation_changes = self._common_citation_changes_doi(adsmsg.Status.updated)
         doi_id = "10.5281/zenodo.11020" # software
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=False), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value=set()), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value=self.mock_data[doi_id]), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -391,7 +394,7 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertFalse(mocked['get_citation_target_metadata'].called)
             self.assertFalse(mocked['fetch_metadata'].called)
             self.assertFalse(mocked['parse_metadata'].called)
@@ -425,7 +428,7 @@ class TestWorkers(TestBase):
         citation_changes = self._common_citation_changes_doi(adsmsg.Status.deleted)
         doi_id = "10.5281/zenodo.11020" # software
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=False), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value=set()), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value=self.mock_data[doi_id]), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -455,7 +458,7 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertFalse(mocked['get_citation_target_metadata'].called)
             self.assertFalse(mocked['fetch_metadata'].called)
             self.assertFalse(mocked['parse_metadata'].called)
@@ -489,7 +492,7 @@ class TestWorkers(TestBase):
         citation_changes = self._common_citation_changes_doi(adsmsg.Status.new)
         doi_id = "10.5281/zenodo.11020" # software
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=True), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value={(citation_changes.changes[0].citing, citation_changes.changes[0].content)}), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value=self.mock_data[doi_id]), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -519,7 +522,7 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertFalse(mocked['get_citation_target_metadata'].called)
             self.assertFalse(mocked['fetch_metadata'].called)
             self.assertFalse(mocked['parse_metadata'].called)
@@ -553,7 +556,7 @@ class TestWorkers(TestBase):
         citation_changes = self._common_citation_changes_doi(adsmsg.Status.updated)
         doi_id = "10.5281/zenodo.11020" # software
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=False), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value=set()), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value=self.mock_data[doi_id]), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -583,7 +586,7 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertFalse(mocked['get_citation_target_metadata'].called)
             self.assertFalse(mocked['fetch_metadata'].called)
             self.assertFalse(mocked['parse_metadata'].called)
@@ -617,7 +620,7 @@ class TestWorkers(TestBase):
         citation_changes = self._common_citation_changes_doi(adsmsg.Status.deleted)
         doi_id = "10.5281/zenodo.11020" # software
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=False), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value=set()), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value=self.mock_data[doi_id]), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -647,7 +650,7 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertFalse(mocked['get_citation_target_metadata'].called)
             self.assertFalse(mocked['fetch_metadata'].called)
             self.assertFalse(mocked['parse_metadata'].called)
@@ -687,7 +690,7 @@ class TestWorkers(TestBase):
         citation_change.resolved = False
         citation_change.status = adsmsg.Status.new
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=False), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value=set()), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value={}), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -717,7 +720,7 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertTrue(mocked['get_citation_target_metadata'].called)
             self.assertFalse(mocked['fetch_metadata'].called)
             self.assertFalse(mocked['parse_metadata'].called)
@@ -757,7 +760,7 @@ class TestWorkers(TestBase):
         citation_change.resolved = False
         citation_change.status = adsmsg.Status.new
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=False), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value=set()), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value={}), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -787,7 +790,7 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertTrue(mocked['get_citation_target_metadata'].called)
             self.assertFalse(mocked['fetch_metadata'].called)
             self.assertFalse(mocked['parse_metadata'].called)
@@ -827,7 +830,7 @@ class TestWorkers(TestBase):
         citation_change.resolved = False
         citation_change.status = adsmsg.Status.new
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=False), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value=set()), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value={}), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -857,7 +860,7 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertTrue(mocked['get_citation_target_metadata'].called)
             self.assertFalse(mocked['fetch_metadata'].called)
             self.assertFalse(mocked['parse_metadata'].called)
@@ -897,7 +900,7 @@ class TestWorkers(TestBase):
         citation_change.resolved = False
         citation_change.status = adsmsg.Status.new
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=False), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value=set()), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value={}), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -927,7 +930,7 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertTrue(mocked['get_citation_target_metadata'].called)
             self.assertFalse(mocked['fetch_metadata'].called)
             self.assertFalse(mocked['parse_metadata'].called)
@@ -960,7 +963,7 @@ class TestWorkers(TestBase):
     def test_process_new_citation_changes_doi_unparsable_http_response(self):
         citation_changes = self._common_citation_changes_doi(adsmsg.Status.new)
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=False), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value=set()), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value={}), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -990,7 +993,7 @@ class TestWorkers(TestBase):
                 'webhook_emit_event': patch.object(webhook, 'emit_event', return_value=True), \
                 'forward_message': patch.object(app.ADSCitationCaptureCelery, 'forward_message', return_value=True)}) as mocked:
             tasks.task_process_citation_changes(citation_changes)
-            self.assertTrue(mocked['citation_already_exists'].called)
+            self.assertTrue(mocked['get_existing_citations'].called)
             self.assertTrue(mocked['get_citation_target_metadata'].called)
             self.assertTrue(mocked['fetch_metadata'].called)
             self.assertTrue(mocked['parse_metadata'].called)
@@ -1023,7 +1026,7 @@ class TestWorkers(TestBase):
     def test_process_new_citation_changes_doi_http_error(self):
         citation_changes = self._common_citation_changes_doi(adsmsg.Status.new)
         with TestBase.mock_multiple_targets({
-                'citation_already_exists': patch.object(db, 'citation_already_exists', return_value=False), \
+                'get_existing_citations': patch.object(db, 'get_existing_citations', return_value=set()), \
                 'get_citation_target_metadata': patch.object(db, 'get_citation_target_metadata', return_value={}), \
                 'get_citations_by_bibcode': patch.object(db, 'get_citations_by_bibcode', return_value=[]), \
                 'store_citation_target': patch.object(db, 'store_citation_target', return_value=True), \
@@ -1183,7 +1186,7 @@ class TestWorkers(TestBase):
         self.assertFalse(mocked['fetch_metadata'].called)
         self.assertFalse(mocked['parse_metadata'].called)
         self.assertFalse(mocked['url_is_alive'].called)
-        self.assertTrue(mocked['get_canonical_bibcodes'].called)
+        self.assertFalse(mocked['get_canonical_bibcodes'].called)
         self.assertTrue(mocked['get_citations_by_bibcode'].called)
         self.assertFalse(mocked['mark_citation_as_deleted'].called)
         self.assertFalse(mocked['get_citations'].called)
@@ -1278,6 +1281,355 @@ class TestWorkers(TestBase):
             tasks.task_output_results(citation_change, parsed_metadata, citations, bibcode_replaced = bibcode_replaced)
             self.assertTrue(forward_message.called)
             self.assertEqual(forward_message.call_count, 4)
-            
+
+    def test_output_results_coalesced_per_target(self):
+        content = "10.5281/zenodo.11020"
+        metadata = self.mock_data[content]
+        citation_change = adsmsg.CitationChange(citing='2019ApJ...877L..39C', content=content, content_type=adsmsg.CitationChangeContentType.doi)
+        db.store_citation_target(self.app, citation_change, 'DOI', metadata['raw'], metadata['parsed'], 'REGISTERED')
+        self.app.conf['OUTPUT_RESULTS_WINDOW'] = 60
+        with patch.object(tasks.task_flush_dirty_citation_targets, 'apply_async', return_value=None) as flush, \
+                patch.object(tasks.task_output_results, 'delay', return_value=None) as output_results, \
+                patch.object(api, 'resolve_canonical_bibcodes', return_value={}):
+            for status in (adsmsg.Status.new, adsmsg.Status.updated, adsmsg.Status.deleted):
+                citation_change.status = status
+                with db.task_session_scope(self.app):
+                    tasks._output_citation_target(citation_change, metadata['parsed'], [], db_versions=None)
+            # A single flush is scheduled per target and window, and nothing is forwarded yet
+            self.assertEqual(flush.call_count, 1)
+            self.assertEqual(flush.call_args[1]['args'], ([content],))
+            self.assertEqual(flush.call_args[1]['countdown'], 60)
+            self.assertFalse(output_results.called)
+            saved_messages = tasks.task_flush_dirty_citation_targets([content])
+            self.assertEqual(saved_messages, 2)
+            self.assertEqual(output_results.call_count, 1)
+            self.assertEqual(output_results.call_args[0][0].content, content)
+            self.assertEqual(output_results.call_args[0][0].status, adsmsg.Status.deleted)
+            # Nothing left to flush
+            self.assertEqual(tasks.task_flush_dirty_citation_targets(), 0)
+            self.assertEqual(output_results.call_count, 1)
+
+    def test_flush_reschedules_locked_dirty_targets(self):
+        content = "10.5281/zenodo.11020"
+        self.app.conf['OUTPUT_RESULTS_WINDOW'] = 60
+        db.mark_citation_target_as_dirty(self.app, content, 'NEW')
+        # The target is locked by a unit of work that is marking it again, hence the flush skips it
+        with patch.object(db, 'pop_dirty_citation_targets', return_value=[]), \
+                patch.object(tasks.task_flush_dirty_citation_targets, 'apply_async', return_value=None) as flush:
+            self.assertEqual(tasks.task_flush_dirty_citation_targets([content]), 0)
+            self.assertEqual(flush.call_count, 1)
+            self.assertEqual(flush.call_args[1]['args'], ([content],))
+            self.assertEqual(flush.call_args[1]['countdown'], 60)
+        # Nothing is rescheduled once the target is flushed
+        with patch.object(tasks.task_output_results, 'delay', return_value=None), \
+                patch.object(tasks.task_flush_dirty_citation_targets, 'apply_async', return_value=None) as flush:
+            tasks.task_flush_dirty_citation_targets([content])
+            self.assertFalse(flush.called)
+        self.assertEqual(db.get_dirty_citation_target_contents(self.app), [])
+
+    def test_canonical_citations_stored(self):
+        content = "10.5281/zenodo.11020"
+        metadata = self.mock_data[content]
+        citing = ['2019ApJ...877L..39C', '2019arXiv190701234C', '2020ApJ...900...01A']
+        citation_change = adsmsg.CitationChange(content=content, content_type=adsmsg.CitationChangeContentType.doi)
+        db.store_citation_target(self.app, citation_change, 'DOI', metadata['raw'], metadata['parsed'], 'REGISTERED')
+        citation_change.citing = citing[0]
+        db.store_citation(self.app, citation_change, 'DOI', metadata['raw'], metadata['parsed'], 'REGISTERED', canonical_citing=citing[0])
+        for bibcode in citing[1:]:
+            citation_change.citing = bibcode
+            db.store_citation(self.app, citation_change, 'DOI', metadata['raw'], metadata['parsed'], 'REGISTERED')
+        bibcode = metadata['parsed']['bibcode']
+        # Only the citations without a canonical bibcode are resolved (arXiv preprint merged with its publication)
+        with patch.object(api, 'resolve_canonical_bibcodes', return_value={citing[1]: citing[0], citing[2]: citing[2]}) as resolve_canonical_bibcodes:
+            self.assertEqual(tasks._get_canonical_citations(bibcode), [citing[0], citing[2]])
+            self.assertEqual(resolve_canonical_bibcodes.call_args[0][1], citing[1:])
+        self.assertEqual(db.get_citations_by_bibcode(self.app, bibcode, with_canonical=True), [(citing[0], citing[0]), (citing[1], citing[0]), (citing[2], citing[2])])
+        # Stored canonical bibcodes are reused without API requests
+        with patch.object(api, 'resolve_canonical_bibcodes', return_value={}) as resolve_canonical_bibcodes:
+            self.assertEqual(tasks._get_canonical_citations(bibcode), [citing[0], citing[2]])
+            self.assertFalse(resolve_canonical_bibcodes.called)
+        # Refreshing bypasses the stored values and drops bibcodes that no longer exist
+        with patch.object(api, 'resolve_canonical_bibcodes', return_value={citing[0]: citing[0], citing[1]: citing[0]}) as resolve_canonical_bibcodes:
+            self.assertEqual(tasks._get_canonical_citations(bibcode, refresh=True), [citing[0]])
+            self.assertEqual(resolve_canonical_bibcodes.call_args[0][1], citing)
+            self.assertEqual(resolve_canonical_bibcodes.call_args[1], {'use_cache': False})
+        # The stored canonical bibcode of a citation that no longer exists is cleared, hence it is not reused
+        self.assertEqual(db.get_citations_by_bibcode(self.app, bibcode, with_canonical=True), [(citing[0], citing[0]), (citing[1], citing[0]), (citing[2], None)])
+        with patch.object(api, 'resolve_canonical_bibcodes', return_value={}) as resolve_canonical_bibcodes:
+            self.assertEqual(tasks._get_canonical_citations(bibcode), [citing[0]])
+            self.assertEqual(resolve_canonical_bibcodes.call_args[0][1], [citing[2]])
+
+    def test_flush_event_outbox(self):
+        self.app.conf['EVENT_OUTBOX_BATCH_SIZE'] = 2
+        self.app.conf['EVENT_OUTBOX_RETRY_BACKOFF'] = 0
+        self.app.conf['TESTING_MODE'] = False
+        events_data = [webhook.identical_bibcode_and_doi_event_data("2020zndo....{:07d}A".format(i), "10.5281/zenodo.{}".format(i)) for i in range(3)]
+        httpretty.enable()
+        httpretty.register_uri(httpretty.POST, self.app.conf['ADS_WEBHOOK_URL'], responses=[
+            httpretty.Response(body="", status=500),
+            httpretty.Response(body="", status=200),
+            httpretty.Response(body="", status=200),
+        ])
+        with patch.object(tasks.task_flush_events, 'apply_async', return_value=None) as flush, \
+                patch.object(webhook, 'dump_events', return_value=True) as dump_events:
+            # Events are only stored in the outbox by the unit of work
+            with db.task_session_scope(self.app):
+                for event_data in events_data:
+                    tasks._queue_event(event_data, "20201018_000000")
+                self.assertFalse(flush.called)
+            # A single flush is scheduled per unit of work
+            self.assertEqual(flush.call_count, 1)
+            self.assertEqual(len(httpretty.latest_requests()), 0)
+            # The first batch fails and it is retried later
+            self.assertEqual(tasks.task_flush_events(), 0)
+            self.assertEqual(flush.call_count, 2)
+            self.assertFalse(dump_events.called)
+            self.assertEqual(tasks.task_flush_events(), 3)
+            self.assertEqual(dump_events.call_count, 2)
+        requests = httpretty.latest_requests()
+        self.assertEqual([len(json.loads(request.body)) for request in requests], [2, 2, 1])
+        self.assertEqual([event_data for request in requests[1:] for event_data in json.loads(request.body)], events_data)
+        httpretty.disable()
+        httpretty.reset()
+        # Nothing left to emit
+        self.assertEqual(db.get_pending_events(self.app, 10), [])
+
+    def test_flush_event_outbox_isolates_failing_event(self):
+        self.app.conf['EVENT_OUTBOX_BATCH_SIZE'] = 2
+        self.app.conf['EVENT_OUTBOX_RETRY_BACKOFF'] = 0
+        self.app.conf['TESTING_MODE'] = False
+        events_data = [webhook.identical_bibcode_and_doi_event_data("2020zndo....{:07d}A".format(i), "10.5281/zenodo.{}".format(i)) for i in range(3)]
+        httpretty.enable()
+        httpretty.register_uri(httpretty.POST, self.app.conf['ADS_WEBHOOK_URL'], responses=[
+            httpretty.Response(body="", status=500), # First batch
+            httpretty.Response(body="", status=500), # First batch retried
+            httpretty.Response(body="", status=200), # First event on its own
+            httpretty.Response(body="", status=500), # Second event on its own
+            httpretty.Response(body="", status=200), # Second batch
+        ])
+        with patch.object(tasks.task_flush_events, 'apply_async', return_value=None), \
+                patch.object(webhook, 'dump_events', return_value=True) as dump_events:
+            with db.task_session_scope(self.app):
+                for event_data in events_data:
+                    tasks._queue_event(event_data, "20201018_000000")
+            self.assertEqual(tasks.task_flush_events(), 0)
+            # The failing event does not block the events queued after it
+            self.assertEqual(tasks.task_flush_events(), 2)
+            self.assertEqual(dump_events.call_count, 2)
+            self.assertEqual(dump_events.call_args[1]['prefix'], os.path.join("emitted", events_data[2]["RelationshipType"]["SubType"], "20201018_000000"))
+        requests = httpretty.latest_requests()
+        self.assertEqual([len(json.loads(request.body)) for request in requests], [2, 2, 1, 1, 1])
+        httpretty.disable()
+        httpretty.reset()
+        pending_events = db.get_pending_events(self.app, 10)
+        self.assertEqual([(event['data'], event['attempts']) for event in pending_events], [(events_data[1], 2)])
+
+    def test_single_event_flush(self):
+        self.app.conf['EVENT_OUTBOX_BATCH_SIZE'] = 2
+        events_data = [webhook.identical_bibcode_and_doi_event_data("2020zndo....{:07d}A".format(i), "10.5281/zenodo.{}".format(i)) for i in range(3)]
+        @tasks._single_event_flush
+        def maintenance_loop():
+            # Every event is committed on its own (no unit of work around the loop)
+            for event_data in events_data:
+                tasks._queue_event(event_data, "20201018_000000")
+            self.assertEqual(len(db.get_pending_events(self.app, 10)), 3)
+        with patch.object(tasks.task_flush_events, 'apply_async', return_value=None) as flush:
+            maintenance_loop()
+            self.assertEqual(flush.call_count, 1)
+            # Nothing queued, nothing to flush
+            tasks._single_event_flush(lambda: None)()
+            self.assertEqual(flush.call_count, 1)
+
+    def test_concept_doi_versions_cached(self):
+        concept_doi = "10.5281/zenodo.592536"
+        versions = self.mock_data["10.5281/zenodo.4475376"]["versions"]["versions"]
+        version_metadata = [{'bibcode': '2021zndo...447537{}C'.format(i), 'version_of': [concept_doi], 'versions': []} for i in range(3)]
+        fetched_versions = {'concept_doi': concept_doi, 'versions': versions}
+        with patch.object(doi, 'fetch_all_versions_doi', return_value=fetched_versions) as fetch_all_versions_doi:
+            # The concept DOI metadata is fetched only for the first version
+            for parsed_metadata, version in zip(version_metadata, versions):
+                self.assertEqual(tasks._fetch_all_versions_doi_cached(parsed_metadata, version), fetched_versions)
+            self.assertEqual(fetch_all_versions_doi.call_count, 1)
+            # Processing the concept DOI record refreshes the stored versions
+            refreshed_versions = {'concept_doi': concept_doi, 'versions': versions + ["10.5281/zenodo.4475379"]}
+            fetch_all_versions_doi.return_value = refreshed_versions
+            tasks._fetch_all_versions_doi_cached({'bibcode': '2017zndo....592536C', 'version_of': [], 'versions': refreshed_versions['versions'], 'properties': {'DOI': concept_doi}}, concept_doi)
+            self.assertEqual(fetch_all_versions_doi.call_count, 2)
+            self.assertEqual(tasks._fetch_all_versions_doi_cached(version_metadata[0], versions[0]), refreshed_versions)
+            self.assertEqual(fetch_all_versions_doi.call_count, 2)
+            # A new release that is not in the stored versions fetches them again
+            new_release = "10.5281/zenodo.4475380"
+            fetch_all_versions_doi.return_value = {'concept_doi': concept_doi, 'versions': refreshed_versions['versions'] + [new_release]}
+            self.assertEqual(tasks._fetch_all_versions_doi_cached(version_metadata[1], new_release.upper()), fetch_all_versions_doi.return_value)
+            self.assertEqual(fetch_all_versions_doi.call_count, 3)
+            self.assertEqual(tasks._fetch_all_versions_doi_cached(version_metadata[2], versions[2]), fetch_all_versions_doi.return_value)
+            self.assertEqual(fetch_all_versions_doi.call_count, 3)
+            # Expired versions are fetched again
+            self.app.conf['CONCEPT_DOI_VERSIONS_TTL'] = 0
+            tasks._fetch_all_versions_doi_cached(version_metadata[0], versions[0])
+            self.assertEqual(fetch_all_versions_doi.call_count, 4)
+        # Versions that cannot be recovered are not associated
+        citation_change = adsmsg.CitationChange(content=versions[0], content_type=adsmsg.CitationChangeContentType.doi)
+        with patch.object(tasks, '_fetch_all_versions_doi_cached', side_effect=Exception("Unavailable")), \
+                patch.object(db, 'get_associated_works_by_doi', return_value={}) as get_associated_works_by_doi:
+            self.assertIsNone(tasks._collect_associated_works(citation_change, version_metadata[0]))
+            self.assertFalse(get_associated_works_by_doi.called)
+
+    def test_deferred_citations(self):
+        content = "10.5281/zenodo.11020"
+        citation_change = adsmsg.CitationChange(citing='2019arXiv190701234C', content=content, content_type=adsmsg.CitationChangeContentType.doi, status=adsmsg.Status.new, timestamp=datetime.now())
+        with patch.object(api, 'get_canonical_bibcode', return_value=None), \
+                patch.object(doi, 'fetch_metadata', return_value=None) as fetch_metadata:
+            # The same change received in several ingestions is deferred only once
+            tasks.task_process_new_citation(citation_change)
+            tasks.task_process_new_citation(citation_change)
+            self.assertFalse(fetch_metadata.called)
+        deferred_citations = db.get_deferred_citations(self.app)
+        self.assertEqual([(d['citing'], d['content'], d['attempts']) for d in deferred_citations], [(citation_change.citing, content, 0)])
+        # Still not resolved
+        with patch.object(api, 'resolve_canonical_bibcodes', return_value={}) as resolve_canonical_bibcodes, \
+                patch.object(tasks.task_process_new_citation, 'delay', return_value=None) as process_new_citation:
+            tasks.task_process_deferred_citations()
+            self.assertEqual(resolve_canonical_bibcodes.call_args[0][1], [citation_change.citing])
+            self.assertFalse(process_new_citation.called)
+        self.assertEqual([d['attempts'] for d in db.get_deferred_citations(self.app)], [1])
+        # Resolved: the citation is processed with the canonical bibcode found in the bulk check
+        with patch.object(api, 'resolve_canonical_bibcodes', return_value={citation_change.citing: '2019ApJ...877L..39C'}), \
+                patch.object(tasks.task_process_new_citation, 'delay', return_value=None) as process_new_citation:
+            tasks.task_process_deferred_citations()
+            self.assertEqual(process_new_citation.call_count, 1)
+            self.assertEqual(process_new_citation.call_args[0][0], citation_change)
+            self.assertEqual(process_new_citation.call_args[1], {'canonical_citing_bibcode': '2019ApJ...877L..39C'})
+        self.assertEqual(db.get_deferred_citations(self.app), [])
+
+    def test_deferred_citations_already_stored(self):
+        content = "10.5281/zenodo.11020"
+        metadata = self.mock_data[content]
+        citation_change = adsmsg.CitationChange(citing='2019arXiv190701234C', content=content, content_type=adsmsg.CitationChangeContentType.doi, status=adsmsg.Status.new, timestamp=datetime.now())
+        with patch.object(api, 'get_canonical_bibcode', return_value=None):
+            tasks.task_process_new_citation(citation_change)
+        self.assertEqual(len(db.get_deferred_citations(self.app)), 1)
+        # The citation was stored meanwhile (e.g., the same change was received again once its bibcode existed)
+        db.store_citation_target(self.app, citation_change, 'DOI', metadata['raw'], metadata['parsed'], 'REGISTERED')
+        db.store_citation(self.app, citation_change, 'DOI', metadata['raw'], metadata['parsed'], 'REGISTERED')
+        with patch.object(api, 'resolve_canonical_bibcodes', return_value={citation_change.citing: '2019ApJ...877L..39C'}), \
+                patch.object(tasks.task_process_new_citation, 'delay', return_value=None) as process_new_citation:
+            tasks.task_process_deferred_citations()
+            self.assertFalse(process_new_citation.called)
+        self.assertEqual(db.get_deferred_citations(self.app), [])
+
+    def test_process_updated_citation_unit_of_work(self):
+        content = "10.5281/zenodo.11020"
+        metadata = self.mock_data[content]
+        citing = ['2019ApJ...877L..39C', '2005CaJES..42.1987P']
+        citation_change = adsmsg.CitationChange(citing=citing[0], content=content, content_type=adsmsg.CitationChangeContentType.doi, status=adsmsg.Status.new)
+        db.store_citation_target(self.app, citation_change, 'DOI', metadata['raw'], metadata['parsed'], 'REGISTERED')
+        for bibcode in citing:
+            citation_change.citing = bibcode
+            db.store_citation(self.app, citation_change, 'DOI', metadata['raw'], metadata['parsed'], 'REGISTERED')
+        calls = []
+        update_citation = db.update_citation
+        def record(name, result=None, function=None):
+            def side_effect(*args, **kwargs):
+                calls.append(name)
+                return function(*args, **kwargs) if function else result
+            return side_effect
+        with patch.object(api, 'resolve_canonical_bibcodes', side_effect=record('resolve_canonical_bibcodes', result=dict((bibcode, bibcode) for bibcode in citing))), \
+                patch.object(tasks, '_collect_associated_works', side_effect=record('collect_associated_works')), \
+                patch.object(db, 'update_citation', side_effect=record('update_citation', function=update_citation)), \
+                patch.object(tasks, '_output_citation_target', return_value=None) as output_citation_target, \
+                patch.object(tasks, '_emit_citation_change', return_value=None):
+            updated_citation_changes = [adsmsg.CitationChange(citing=bibcode, content=content, content_type=adsmsg.CitationChangeContentType.doi, status=adsmsg.Status.updated, timestamp=datetime.now()) for bibcode in citing]
+            unit_of_work = self._count_database_operations(lambda: tasks.task_process_updated_citation(updated_citation_changes[0]))
+            # Remote requests are done before the citation row is locked
+            self.assertEqual(calls, ['collect_associated_works', 'resolve_canonical_bibcodes', 'update_citation'])
+            self.assertEqual(output_citation_target.call_args[0][2], citing)
+            # Same task without the unit of work (one session and commit per db helper)
+            separate_sessions = self._count_database_operations(lambda: tasks.task_process_updated_citation.run.__wrapped__(updated_citation_changes[1]))
+            self.assertEqual(output_citation_target.call_count, 2)
+        self.assertEqual(unit_of_work['checkouts'], 1)
+        self.assertEqual(unit_of_work['commits'], 1)
+        self.assertLess(unit_of_work['checkouts'], separate_sessions['checkouts'])
+        self.assertLess(unit_of_work['commits'], separate_sessions['commits'])
+
+    def test_process_new_citations_single_flight(self):
+        content = "10.5281/zenodo.11020"
+        metadata = self.mock_data[content]
+        citing = ['2019ApJ...877L..39C', '2005CaJES..42.1987P', '2016AJ....152..123G', '2015MNRAS.453..483K']
+        def slow_fetch_metadata(*args, **kwargs):
+            time.sleep(0.5)
+            return metadata['raw']
+        errors = []
+        def process(bibcode):
+            citation_change = adsmsg.CitationChange(citing=bibcode, content=content, content_type=adsmsg.CitationChangeContentType.doi, status=adsmsg.Status.new)
+            try:
+                tasks.task_process_new_citation(citation_change)
+            except Exception as e:
+                errors.append(e)
+        with patch.object(api, 'get_canonical_bibcode', side_effect=lambda app, bibcode: bibcode), \
+                patch.object(api, 'resolve_canonical_bibcodes', return_value={}), \
+                patch.object(doi, 'fetch_metadata', side_effect=slow_fetch_metadata) as fetch_metadata, \
+                patch.object(doi, 'parse_metadata', return_value=metadata['parsed']), \
+                patch.object(tasks, '_collect_associated_works', return_value=None), \
+                patch.object(tasks, '_queue_event', return_value=None), \
+                patch.object(tasks.task_output_results, 'delay', return_value=None), \
+                patch.object(db, 'store_citation_target', wraps=db.store_citation_target) as store_citation_target:
+            workers = [threading.Thread(target=process, args=(bibcode,)) for bibcode in citing]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        self.assertEqual(errors, [])
+        # Only one worker fetched and stored the citation target, the rest re-used it
+        n_fetches_avoided = len(citing) - fetch_metadata.call_count
+        self.assertEqual(fetch_metadata.call_count, 1)
+        self.assertEqual(n_fetches_avoided, 3)
+        self.assertEqual(store_citation_target.call_count, 1)
+        self.assertEqual(sorted(db.get_citations_by_bibcode(self.app, metadata['parsed']['bibcode'])), sorted(citing))
+
+    def test_process_new_citations_single_flight_waiting_worker(self):
+        content = "10.5281/zenodo.11020"
+        metadata = self.mock_data[content]
+        citing = ['2019ApJ...877L..39C', '2005CaJES..42.1987P']
+        fetching = threading.Event()
+        def slow_fetch_metadata(*args, **kwargs):
+            # The second worker is started while the first one holds the lock and fetches
+            fetching.set()
+            time.sleep(0.5)
+            return metadata['raw']
+        lock_citation_target = db.lock_citation_target
+        acquired = []
+        def record_lock(*args, **kwargs):
+            acquired.append(lock_citation_target(*args, **kwargs))
+            return acquired[-1]
+        errors = []
+        def process(bibcode):
+            citation_change = adsmsg.CitationChange(citing=bibcode, content=content, content_type=adsmsg.CitationChangeContentType.doi, status=adsmsg.Status.new)
+            try:
+                tasks.task_process_new_citation(citation_change)
+            except Exception as e:
+                errors.append(e)
+        with patch.object(api, 'get_canonical_bibcode', side_effect=lambda app, bibcode: bibcode), \
+                patch.object(api, 'resolve_canonical_bibcodes', return_value={}), \
+                patch.object(doi, 'fetch_metadata', side_effect=slow_fetch_metadata) as fetch_metadata, \
+                patch.object(doi, 'parse_metadata', return_value=metadata['parsed']), \
+                patch.object(tasks, '_collect_associated_works', return_value=None), \
+                patch.object(tasks, '_queue_event', return_value=None), \
+                patch.object(tasks.task_output_results, 'delay', return_value=None), \
+                patch.object(db, 'lock_citation_target', side_effect=record_lock):
+            workers = [threading.Thread(target=process, args=(bibcode,)) for bibcode in citing]
+            workers[0].start()
+            self.assertTrue(fetching.wait(5))
+            workers[1].start()
+            for worker in workers:
+                worker.join()
+        self.assertEqual(errors, [])
+        # The second worker waited for the lock (blocked on its own DB connection) and re-used the stored metadata
+        self.assertEqual(acquired, [True, False])
+        n_fetches_avoided = len(citing) - fetch_metadata.call_count
+        self.assertEqual(fetch_metadata.call_count, 1)
+        self.assertEqual(n_fetches_avoided, 1)
+        self.assertEqual(sorted(db.get_citations_by_bibcode(self.app, metadata['parsed']['bibcode'])), sorted(citing))
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,5 @@
 import os
-import requests
+from ADSCitationCapture import http_session
 import urllib.request, urllib.parse, urllib.error
 import re
 from adsputils import setup_logging
@@ -29,10 +29,10 @@ url_regex = re.compile(
 def is_url(text):
     return True if url_regex.search(text) else False
 
-def is_alive(url):
+def is_alive(url, timeout=30):
     if is_url(url):
         try:
-            request = requests.get(url)
+            request = http_session.get(url, timeout=timeout)
         except:
             logger.exception("Failed URL: %s", url)
             raise
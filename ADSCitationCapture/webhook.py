@@ -1,4 +1,4 @@
-import requests
+from ADSCitationCapture import http_session
 import json
 from adsputils import setup_logging
 import adsmsg
@@ -152,7 +152,7 @@ def emit_event(ads_webhook_url, ads_webhook_auth_token, event_data, timeout=30):
         headers = {}
         headers["Content-Type"] = "application/json"
         headers["Authorization"] = "Bearer {}".format(ads_webhook_auth_token)
-        r = requests.post(ads_webhook_url, data=json.dumps(data), headers=headers, timeout=timeout)
+        r = http_session.post(ads_webhook_url, data=json.dumps(data), headers=headers, timeout=timeout)
         if not r.ok:
             logger.error("Emit event failed with status code '{}': {}".format(r.status_code, r.content))
             raise Exception("HTTP Post to '{}' failed: {}".format(ads_webhook_url, json.dumps(data)))
@@ -164,6 +164,24 @@ def emit_event(ads_webhook_url, ads_webhook_auth_token, event_data, timeout=30):
             emitted = True
     return emitted
 
+def emit_events(ads_webhook_url, ads_webhook_auth_token, events_data, timeout=30):
+    """
+    Emit several events with a single HTTP POST (the payload is a JSON array)
+    """
+    emitted = False
+    if events_data:
+        headers = {}
+        headers["Content-Type"] = "application/json"
+        headers["Authorization"] = "Bearer {}".format(ads_webhook_auth_token)
+        r = http_session.post(ads_webhook_url, data=json.dumps(events_data), headers=headers, timeout=timeout)
+        if not r.ok:
+            logger.error("Emit events failed with status code '{}': {}".format(r.status_code, r.content))
+            raise Exception("HTTP Post of {} events to '{}' failed".format(len(events_data), ads_webhook_url))
+        else:
+            logger.info("Emitted %i events", len(events_data))
+            emitted = True
+    return emitted
+
 def _mkdir_p(path):
     """
     Creates a directory. Same behaviour as 'mkdir -p'.
@@ -205,3 +223,29 @@ def dump_event(event_data, prefix="emitted"):
             else:
                 dump_created = True
     return dump_created
+
+def dump_events(events_data, prefix="emitted"):
+    """
+    Save a batch of events in a single file in JSON format in the log directory
+    """
+    dump_created = False
+    if events_data:
+        try:
+            logs_dirname = os.path.dirname(logger.handlers[0].baseFilename)
+        except:
+            logger.exception("Logger's target directory not found")
+        else:
+            base_dirname = os.path.join(logs_dirname, prefix)
+            now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            filename = "{}_{}_events.json".format(now, len(events_data))
+            try:
+                if not os.path.exists(base_dirname):
+                    _mkdir_p(base_dirname)
+                with open(os.path.join(base_dirname, filename), "w") as f:
+                    json.dump(events_data, f, indent=2)
+            except:
+                logger.exception("Impossible to dump events")
+            else:
+                logger.info("Dumped %i events in '%s'", len(events_data), filename)
+                dump_created = True
+    return dump_created
@@ -0,0 +1,52 @@
+"""maintenance_jobs
+
+Revision ID: 2a7b9d4e6c15
+Revises: 9c3e5a1f2d48
+Create Date: 2026-10-18 12:02:11.873520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+import adsputils
+
+# revision identifiers, used by Alembic.
+revision = '2a7b9d4e6c15'
+down_revision = '9c3e5a1f2d48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('maintenance_job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.Text(), nullable=True),
+    sa.Column('params', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('n_chunks', sa.Integer(), nullable=True),
+    sa.Column('status', postgresql.ENUM('PENDING', 'DONE', name='maintenance_status_type'), nullable=True),
+    sa.Column('created', adsputils.UTCDateTime(timezone=True), nullable=True),
+    sa.Column('updated', adsputils.UTCDateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    schema='public'
+    )
+    op.create_table('maintenance_job_chunk',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('job_id', sa.Integer(), nullable=True),
+    sa.Column('after_content', sa.Text(), nullable=True),
+    sa.Column('last_content', sa.Text(), nullable=True),
+    sa.Column('n_records', sa.Integer(), nullable=True),
+    sa.Column('status', postgresql.ENUM('PENDING', 'DONE', name='maintenance_status_type', create_type=False), nullable=True),
+    sa.Column('created', adsputils.UTCDateTime(timezone=True), nullable=True),
+    sa.Column('updated', adsputils.UTCDateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['job_id'], ['public.maintenance_job.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    schema='public'
+    )
+    op.create_index('ix_maintenance_job_chunk_job_id', 'maintenance_job_chunk', ['job_id'], unique=False, schema='public')
+
+
+def downgrade():
+    op.drop_index('ix_maintenance_job_chunk_job_id', table_name='maintenance_job_chunk', schema='public')
+    op.drop_table('maintenance_job_chunk', schema='public')
+    op.drop_table('maintenance_job', schema='public')
+    op.execute("DROP TYPE maintenance_status_type")
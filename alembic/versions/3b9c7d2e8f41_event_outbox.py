@@ -0,0 +1,38 @@
+"""event_outbox
+
+Revision ID: 3b9c7d2e8f41
+Revises: 8e4f2b6d1c93
+Create Date: 2026-10-18 17:25:09.184702
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+import adsputils
+
+# revision identifiers, used by Alembic.
+revision = '3b9c7d2e8f41'
+down_revision = '8e4f2b6d1c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    event_status_type = postgresql.ENUM('PENDING', 'EMITTED', 'FAILED', name='event_status_type')
+    event_status_type.create(op.get_bind())
+    op.add_column('event', sa.Column('status', event_status_type, nullable=True), schema='public')
+    op.add_column('event', sa.Column('dump_prefix', sa.Text(), nullable=True), schema='public')
+    op.add_column('event', sa.Column('attempts', sa.Integer(), nullable=True), schema='public')
+    op.add_column('event', sa.Column('next_attempt', adsputils.UTCDateTime(timezone=True), nullable=True), schema='public')
+    # Events stored before the outbox existed were already emitted
+    op.execute("UPDATE public.event SET status = 'EMITTED', attempts = 0")
+    op.create_index('ix_event_pending', 'event', ['id'], unique=False, schema='public', postgresql_where=sa.text("status = 'PENDING'"))
+
+
+def downgrade():
+    op.drop_index('ix_event_pending', table_name='event', schema='public')
+    op.drop_column('event', 'next_attempt', schema='public')
+    op.drop_column('event', 'attempts', schema='public')
+    op.drop_column('event', 'dump_prefix', schema='public')
+    op.drop_column('event', 'status', schema='public')
+    op.execute("DROP TYPE event_status_type")
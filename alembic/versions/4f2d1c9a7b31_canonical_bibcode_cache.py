@@ -0,0 +1,31 @@
+"""canonical_bibcode_cache
+
+Revision ID: 4f2d1c9a7b31
+Revises: eb2407373369
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import adsputils
+
+# revision identifiers, used by Alembic.
+revision = '4f2d1c9a7b31'
+down_revision = 'eb2407373369'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('canonical_bibcode',
+    sa.Column('bibcode', sa.Text(), nullable=False),
+    sa.Column('canonical', sa.Text(), nullable=True),
+    sa.Column('created', adsputils.UTCDateTime(timezone=True), nullable=True),
+    sa.Column('updated', adsputils.UTCDateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('bibcode'),
+    schema='public'
+    )
+
+
+def downgrade():
+    op.drop_table('canonical_bibcode', schema='public')
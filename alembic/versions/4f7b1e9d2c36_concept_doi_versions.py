@@ -0,0 +1,32 @@
+"""concept_doi_versions
+
+Revision ID: 4f7b1e9d2c36
+Revises: 9c2d5f7a3e18
+Create Date: 2026-10-18 20:11:45.906213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+import adsputils
+
+# revision identifiers, used by Alembic.
+revision = '4f7b1e9d2c36'
+down_revision = '9c2d5f7a3e18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('concept_doi_versions',
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('versions', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('created', adsputils.UTCDateTime(timezone=True), nullable=True),
+    sa.Column('updated', adsputils.UTCDateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('content'),
+    schema='public'
+    )
+
+
+def downgrade():
+    op.drop_table('concept_doi_versions', schema='public')
@@ -0,0 +1,29 @@
+"""canonical_citing
+
+Revision ID: 5e1a9c4b7d20
+Revises: 3b9c7d2e8f41
+Create Date: 2026-10-18 18:02:51.640127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+import adsputils
+
+# revision identifiers, used by Alembic.
+revision = '5e1a9c4b7d20'
+down_revision = '3b9c7d2e8f41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing citations get their canonical citing bibcode the next time
+    # their target is output or when the canonical maintenance is executed
+    op.add_column('citation', sa.Column('canonical_citing', sa.Text(), nullable=True), schema='public')
+    op.add_column('citation_version', sa.Column('canonical_citing', sa.Text(), nullable=True), schema='public')
+
+
+def downgrade():
+    op.drop_column('citation_version', 'canonical_citing', schema='public')
+    op.drop_column('citation', 'canonical_citing', schema='public')
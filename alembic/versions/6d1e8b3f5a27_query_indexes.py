@@ -0,0 +1,41 @@
+"""query_indexes
+
+Revision ID: 6d1e8b3f5a27
+Revises: 2a7b9d4e6c15
+Create Date: 2026-10-18 15:20:43.512306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+import adsputils
+
+# revision identifiers, used by Alembic.
+revision = '6d1e8b3f5a27'
+down_revision = '2a7b9d4e6c15'
+branch_labels = None
+depends_on = None
+
+# Indexes are built without locking the tables against writes, hence the
+# pipeline can keep running while the migration is applied
+indexes = (
+    ('ix_citation_target_bibcode', 'citation_target', '(bibcode)'),
+    ('ix_citation_target_alternate_bibcode', 'citation_target', "USING gin ((parsed_cited_metadata -> 'alternate_bibcode'))"),
+    ('ix_citation_content_status', 'citation', '(content, status)'),
+    ('ix_readers_bibcode_status', 'readers', '(bibcode, status)'),
+    ('ix_readers_bibcode_reader', 'readers', '(bibcode, reader)'),
+)
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for name, table, definition in indexes:
+            op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON public.{} {}'.format(name, table, definition))
+
+
+def downgrade():
+    # DROP INDEX CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for name, table, definition in reversed(indexes):
+            op.execute('DROP INDEX CONCURRENTLY IF EXISTS public.{}'.format(name))
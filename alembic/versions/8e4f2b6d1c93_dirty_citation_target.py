@@ -0,0 +1,33 @@
+"""dirty_citation_target
+
+Revision ID: 8e4f2b6d1c93
+Revises: 6d1e8b3f5a27
+Create Date: 2026-10-18 16:41:27.310285
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+import adsputils
+
+# revision identifiers, used by Alembic.
+revision = '8e4f2b6d1c93'
+down_revision = '6d1e8b3f5a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('dirty_citation_target',
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('status', postgresql.ENUM('NEW', 'DELETED', 'UPDATED', name='citation_change_type', create_type=False), nullable=True),
+    sa.Column('n_marks', sa.Integer(), nullable=True),
+    sa.Column('created', adsputils.UTCDateTime(timezone=True), nullable=True),
+    sa.Column('updated', adsputils.UTCDateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('content'),
+    schema='public'
+    )
+
+
+def downgrade():
+    op.drop_table('dirty_citation_target', schema='public')
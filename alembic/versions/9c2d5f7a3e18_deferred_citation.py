@@ -0,0 +1,34 @@
+"""deferred_citation
+
+Revision ID: 9c2d5f7a3e18
+Revises: 5e1a9c4b7d20
+Create Date: 2026-10-18 19:24:08.512734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+import adsputils
+
+# revision identifiers, used by Alembic.
+revision = '9c2d5f7a3e18'
+down_revision = '5e1a9c4b7d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('deferred_citation',
+    sa.Column('citing', sa.Text(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('citation_change', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('created', adsputils.UTCDateTime(timezone=True), nullable=True),
+    sa.Column('updated', adsputils.UTCDateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('citing', 'content'),
+    schema='public'
+    )
+
+
+def downgrade():
+    op.drop_table('deferred_citation', schema='public')
@@ -0,0 +1,34 @@
+"""doi_metadata_cache
+
+Revision ID: 9c3e5a1f2d48
+Revises: 4f2d1c9a7b31
+Create Date: 2026-10-18 11:05:27.604119
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import adsputils
+
+# revision identifiers, used by Alembic.
+revision = '9c3e5a1f2d48'
+down_revision = '4f2d1c9a7b31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('doi_metadata_cache',
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('source', sa.Text(), nullable=True),
+    sa.Column('etag', sa.Text(), nullable=True),
+    sa.Column('last_modified', sa.Text(), nullable=True),
+    sa.Column('content_hash', sa.String(length=64), nullable=True),
+    sa.Column('created', adsputils.UTCDateTime(timezone=True), nullable=True),
+    sa.Column('updated', adsputils.UTCDateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('content'),
+    schema='public'
+    )
+
+
+def downgrade():
+    op.drop_table('doi_metadata_cache', schema='public')
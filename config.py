@@ -12,6 +12,10 @@ OUTPUT_TASKNAME = 'adsmp.tasks.task_update_record'
 SQLALCHEMY_URL = 'postgres://postgres@localhost:5432/citation_capture_pipeline'
 SQLALCHEMY_ECHO = False
 
+# Number of citation changes grouped in a single message sent to
+# 'task_process_citation_changes' (it can be overridden with --chunk-size)
+CITATION_CHANGES_CHUNK_SIZE = 100
+
 ADS_WEBHOOK_URL = "http://adsabs.harvard.edu/webhooks/trigger"
 ADS_WEBHOOK_AUTH_TOKEN = "This is a secret!"
 DOI_URL = "https://doi.org/"
@@ -20,6 +24,83 @@ ASCL_URL = "http://ascl.net/"
 
 ADS_API_TOKEN = "<secret>"
 ADS_API_URL = "https://ui.adsabs.harvard.edu/v1/"
+# Canonical bibcodes resolved via the ADS API are cached by each worker
+# (least recently used entries are evicted when the size is exceeded)
+CANONICAL_BIBCODE_CACHE_SIZE = 100000
+CANONICAL_BIBCODE_CACHE_TTL = 24*60*60 # seconds
+# When 'True', resolved canonical bibcodes are also stored in the database
+# so that they survive worker restarts
+CANONICAL_BIBCODE_CACHE_PERSIST = False
+# Bibcodes that cannot be resolved (e.g., citing papers not ingested yet) are
+# not requested again to the API by the same worker during this time
+UNRESOLVED_BIBCODE_CACHE_SIZE = 100000
+UNRESOLVED_BIBCODE_CACHE_TTL = 60*60 # seconds
+# New citations whose citing bibcode is not resolved are deferred and checked
+# again at the end of each ingestion (once the delay has passed, to let the
+# workers process the current ingestion), they are discarded after this
+# number of checks
+DEFERRED_CITATIONS_DELAY = 10*60 # seconds
+DEFERRED_CITATIONS_MAX_ATTEMPTS = 30
+# Canonical bibcodes are requested to bigquery in chunks of 2000 bibcodes,
+# up to this number of chunks are requested simultaneously
+CANONICAL_BIBCODES_MAX_CONCURRENT_CHUNKS = 4
+# Failed chunk requests are retried after a random delay between zero and
+# backoff * 2^retry seconds (capped to the maximum backoff)
+CANONICAL_BIBCODES_RETRIES = 3
+CANONICAL_BIBCODES_BACKOFF = 1 # seconds
+CANONICAL_BIBCODES_MAX_BACKOFF = 30 # seconds
+
+# Outgoing HTTP requests re-use keep-alive connections per host and worker
+# process, connection errors and 502/503/504 answers are retried with
+# exponential backoff (backoff_factor * 2^(retry - 1) seconds)
+HTTP_TIMEOUT = 30 # seconds
+HTTP_RETRIES = 2
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_POOL_MAXSIZE = 10
+# Pool size overrides per host (e.g., {"api.datacite.org": 20})
+HTTP_POOL_MAXSIZE_PER_HOST = {}
+# Maximum number of simultaneous requests to the same host per worker process
+HTTP_MAX_CONCURRENCY_PER_HOST = 8
+# Number of threads used by maintenance tasks to fetch metadata concurrently
+MAINTENANCE_FETCH_WORKERS = 8
+# Versions of concept DOIs are stored and re-used by all their version DOIs
+# during this time (they are refreshed when a concept DOI is processed)
+CONCEPT_DOI_VERSIONS_TTL = 24*60*60 # seconds
+# Number of citation targets processed by each subtask when a maintenance
+# operation (canonical, metadata or resend) is executed for all the records
+MAINTENANCE_CHUNK_SIZE = 500
+# Update nonbib files after processing citation changes by merging only the
+# bibcodes modified since the last export (maintenance always rewrites them).
+# Disabled by default, enable it in local_config.py
+NONBIB_EXPORT_INCREMENTAL = False
+# Seconds subtracted from the date of the last export when looking for modified
+# rows, to include changes committed by transactions that were still running
+NONBIB_EXPORT_WATERMARK_OVERLAP = 3600
+# Seconds during which the changes to a citation target are coalesced before
+# forwarding a single record to master (0 to forward every change right away).
+# Disabled by default, enable it in local_config.py (e.g., 300 seconds)
+OUTPUT_RESULTS_WINDOW = 0
+# Nonbib records forwarded to master by a task are packed in NonBibRecordList
+# messages sent when they reach OUTPUT_BATCH_MAX_RECORDS records or
+# OUTPUT_BATCH_MAX_BYTES bytes, when a record is added OUTPUT_BATCH_MAX_DELAY
+# seconds after the first buffered one, or when the task ends (1 record to
+# forward every record in its own message)
+OUTPUT_BATCH_MAX_RECORDS = 100
+OUTPUT_BATCH_MAX_BYTES = 1024*1024
+OUTPUT_BATCH_MAX_DELAY = 5 # seconds
+# Events are stored in an outbox in the same transaction as the citation
+# changes and emitted to the webhook in batches of EVENT_OUTBOX_BATCH_SIZE
+# events per HTTP POST, EVENT_OUTBOX_FLUSH_DELAY seconds after they were
+# stored (0 to emit every event in its own request right away). Disabled by
+# default, enable it in local_config.py (e.g., 100 events)
+EVENT_OUTBOX_BATCH_SIZE = 0
+EVENT_OUTBOX_FLUSH_DELAY = 10 # seconds
+# Failed batches are retried after EVENT_OUTBOX_RETRY_BACKOFF * 2^(attempt - 1)
+# seconds (up to EVENT_OUTBOX_RETRY_MAX_DELAY) and marked as FAILED after
+# EVENT_OUTBOX_MAX_ATTEMPTS attempts
+EVENT_OUTBOX_RETRY_BACKOFF = 60 # seconds
+EVENT_OUTBOX_RETRY_MAX_DELAY = 3600 # seconds
+EVENT_OUTBOX_MAX_ATTEMPTS = 10
 
 GITHUB_API_TOKEN = "<secret>"
 GITHUB_API_URL = "https://api.github.com/"
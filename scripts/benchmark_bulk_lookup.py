@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Benchmark: citation target lookups by bibcode and by alternate bibcode, one
+query per requested bibcode (as db.get_citation_targets_by_bibcode and
+db.get_citation_targets_by_alt_bibcode used to do) versus the set-based
+queries now used by these functions.
+
+It inserts synthetic citation targets (content prefixed by 'benchmark/') in
+the database configured for the pipeline and removes them at the end, hence
+it must only be run against a development database.
+
+Usage: python scripts/benchmark_bulk_lookup.py [--records 10000]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '../')))
+from ADSCitationCapture import tasks
+from ADSCitationCapture import db
+from ADSCitationCapture.models import CitationTarget
+
+app = tasks.app
+CONTENT_PREFIX = 'benchmark/'
+
+
+def _insert_records(n_records):
+    values = [
+        {
+            'content': CONTENT_PREFIX+str(i),
+            'content_type': 'DOI',
+            'bibcode': '2000bnch.{:010d}B'.format(i),
+            'parsed_cited_metadata': {'bibcode': '2000bnch.{:010d}B'.format(i), 'alternate_bibcode': ['2000bnch.{:010d}A'.format(i)]},
+            'curated_metadata': {},
+            'status': 'REGISTERED',
+        }
+        for i in range(n_records)
+    ]
+    with app.session_scope() as session:
+        session.execute(CitationTarget.__table__.insert(), values)
+        session.commit()
+
+def _delete_records():
+    with app.session_scope() as session:
+        session.query(CitationTarget).filter(CitationTarget.content.startswith(CONTENT_PREFIX)).delete(synchronize_session=False)
+        session.commit()
+
+def _per_item_lookup(bibcodes, alternate=False):
+    with app.session_scope() as session:
+        records_db = []
+        for bibcode in bibcodes:
+            if alternate:
+                query = session.query(CitationTarget).filter(CitationTarget.parsed_cited_metadata['alternate_bibcode'].contains([bibcode]))
+            else:
+                query = session.query(CitationTarget).filter(CitationTarget.bibcode == bibcode)
+            record_db = query.filter_by(status='REGISTERED').first()
+            if record_db:
+                records_db.append(record_db)
+        return db._extract_key_citation_target_data(records_db)
+
+def _measure(label, lookup, bibcodes):
+    start = time.perf_counter()
+    records = lookup(bibcodes)
+    elapsed = time.perf_counter() - start
+    print("{:<28} {} bibcodes, {} records in {:.2f} s ({:.1f} bibcodes/s)".format(label, len(bibcodes), len(records), elapsed, len(bibcodes)/elapsed))
+    return records
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark citation target lookups by bibcode')
+    parser.add_argument('--records', dest='n_records', type=int, default=10000, help='Number of synthetic citation targets and requested bibcodes')
+    args = parser.parse_args()
+
+    _insert_records(args.n_records)
+    try:
+        bibcodes = ['2000bnch.{:010d}B'.format(i) for i in range(args.n_records)]
+        alt_bibcodes = ['2000bnch.{:010d}A'.format(i) for i in range(args.n_records)]
+        expected = _measure("per-item by bibcode", _per_item_lookup, bibcodes)
+        records = _measure("set-based by bibcode", lambda b: db.get_citation_targets_by_bibcode(app, b), bibcodes)
+        assert records == expected
+        expected = _measure("per-item by alt bibcode", lambda b: _per_item_lookup(b, alternate=True), alt_bibcodes)
+        records = _measure("set-based by alt bibcode", lambda b: db.get_citation_targets_by_alt_bibcode(app, b), alt_bibcodes)
+        assert records == expected
+    finally:
+        _delete_records()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Benchmark: throughput of citation changes messages for different chunk sizes
+(i.e., number of citation changes grouped per message, see
+CITATION_CHANGES_CHUNK_SIZE and run.py --chunk-size).
+
+For every chunk size, synthetic new citation changes are grouped in
+adsmsg.CitationChanges messages, serialized as they would be sent to the
+broker and consumed by task_process_citation_changes, which checks all the
+changes of a message against the database with a single query. The tasks that
+each change would be dispatched to are not executed (only counted).
+
+The synthetic citations do not exist in the database and nothing is written
+to it, but the database configured for the pipeline is queried, hence it
+should only be run against a development database.
+
+Usage: python scripts/benchmark_citation_changes_chunks.py [--changes 10000] [--chunk-sizes 1 100 1000]
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '../')))
+import adsmsg
+from ADSCitationCapture import tasks
+
+app = tasks.app
+CONTENT_PREFIX = '10.0000/benchmark.'
+
+
+def _build_messages(n_changes, chunk_size):
+    messages = []
+    timestamp = datetime.utcnow()
+    for start in range(0, n_changes, chunk_size):
+        citation_changes = adsmsg.CitationChanges()
+        for i in range(start, min(start+chunk_size, n_changes)):
+            citation_change = citation_changes.changes.add()
+            citation_change.citing = '2000bnch.{:010d}C'.format(i)
+            citation_change.cited = '...................'
+            citation_change.content = CONTENT_PREFIX+str(i)
+            citation_change.content_type = adsmsg.CitationChangeContentType.doi
+            citation_change.resolved = False
+            citation_change.timestamp.FromDatetime(timestamp)
+            citation_change.status = adsmsg.Status.new
+        messages.append(citation_changes)
+    return messages
+
+def _process(messages):
+    n_dispatched = 0
+    with mock.patch.object(tasks.task_process_new_citation, 'delay') as task_process_new_citation:
+        for citation_changes in messages:
+            # Round trip through the serialized form sent to the broker
+            citation_changes = adsmsg.CitationChanges.deserializer(citation_changes.serialize())
+            tasks.task_process_citation_changes(citation_changes)
+        n_dispatched = task_process_new_citation.call_count
+    return n_dispatched
+
+def _measure(chunk_size, n_changes):
+    messages = _build_messages(n_changes, chunk_size)
+    start = time.perf_counter()
+    n_dispatched = _process(messages)
+    elapsed = time.perf_counter() - start
+    print("chunk size {:<6} {} messages, {} changes in {:.2f} s ({:.1f} messages/s, {:.1f} changes/s)".format(chunk_size, len(messages), n_dispatched, elapsed, len(messages)/elapsed, n_changes/elapsed))
+    return n_dispatched
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark citation changes throughput for different chunk sizes')
+    parser.add_argument('--changes', dest='n_changes', type=int, default=10000, help='Number of synthetic citation changes')
+    parser.add_argument('--chunk-sizes', dest='chunk_sizes', type=int, nargs='+', default=[1, 100, 1000], help='Number of citation changes per message')
+    args = parser.parse_args()
+
+    for chunk_size in args.chunk_sizes:
+        n_dispatched = _measure(chunk_size, args.n_changes)
+        assert n_dispatched == args.n_changes
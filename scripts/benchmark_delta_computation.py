@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Benchmark: runtime of reading chunks of citation changes with OFFSET/LIMIT
+(as DeltaComputation used to do) versus keyset pagination ('WHERE id > last
+id ORDER BY id LIMIT n', as it does now) at increasing depths of a large
+citation_changes table, and of a full pass with the DeltaComputation
+iterator. OFFSET chunks get slower the deeper they are, keyset chunks should
+take the same time anywhere in the table.
+
+It creates the schema 'benchmark_citation_capture_delta' with a synthetic
+citation_changes table in the database configured for the pipeline (it is
+dropped at the end), hence it must only be run against a development database.
+
+Usage: python scripts/benchmark_delta_computation.py [--rows 1000000] [--chunk-size 100]
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '../')))
+from ADSCitationCapture import tasks
+from ADSCitationCapture.delta_computation import DeltaComputation
+from ADSCitationCapture.models import CitationChanges
+
+app = tasks.app
+SCHEMA_NAME = 'benchmark_citation_capture_delta'
+
+
+def _create_table(delta, n_rows):
+    delta._execute_sql("create schema {0};", SCHEMA_NAME)
+    delta._execute_sql("create table {0}.{1} ( \
+            id serial primary key, new_id integer, new_citing text, new_cited text, \
+            new_doi boolean, new_pid boolean, new_url boolean, new_content text, new_resolved boolean, \
+            previous_citing text, previous_cited text, previous_doi boolean, previous_pid boolean, \
+            previous_url boolean, previous_content text, previous_resolved boolean, status text);", SCHEMA_NAME, delta.joint_table_name)
+    delta._execute_sql("insert into {0}.{1} (new_id, new_citing, new_cited, new_doi, new_pid, new_url, new_content, new_resolved, status) \
+            select i, '2000bnch.' || lpad(i::text, 10, '0') || 'C', '...................', true, false, false, '10.0000/benchmark.' || i, false, 'NEW' \
+            from generate_series(1, {2}) as i;", SCHEMA_NAME, delta.joint_table_name, n_rows)
+    delta._execute_sql("analyze {0}.{1};", SCHEMA_NAME, delta.joint_table_name)
+
+def _measure(label, query, repeat=5):
+    start = time.perf_counter()
+    for i in range(repeat):
+        n_rows = len(query.all())
+    elapsed = (time.perf_counter() - start) / repeat
+    print("{:<24} {} rows in {:.2f} ms".format(label, n_rows, elapsed*1e3))
+    return elapsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark OFFSET versus keyset pagination over citation changes')
+    parser.add_argument('--rows', dest='n_rows', type=int, default=1000000, help='Number of synthetic citation changes')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=100, help='Number of citation changes per chunk')
+    args = parser.parse_args()
+
+    delta = DeltaComputation(app.conf['SQLALCHEMY_URL'], group_changes_in_chunks_of=args.chunk_size)
+    try:
+        _create_table(delta, args.n_rows)
+        delta.schema_name = SCHEMA_NAME
+        delta.n_changes = args.n_rows
+        delta.last_modification_date = datetime.utcnow()
+        for position in (0, args.n_rows // 2, args.n_rows - args.chunk_size):
+            offset_query = delta._citation_changes_query().offset(position).limit(args.chunk_size)
+            keyset_query = delta._citation_changes_query().filter(CitationChanges.id > position).order_by(CitationChanges.id).limit(args.chunk_size)
+            offset_elapsed = _measure("offset at {}".format(position), offset_query)
+            keyset_elapsed = _measure("keyset at {}".format(position), keyset_query)
+            print("{:<24} {:.1f}x".format("speedup", offset_elapsed/keyset_elapsed))
+            delta.session.commit()
+        # Full pass with the iterator (keyset pagination)
+        start = time.perf_counter()
+        n_changes = 0
+        for citation_changes in delta:
+            n_changes += len(citation_changes.changes)
+        elapsed = time.perf_counter() - start
+        assert n_changes == args.n_rows
+        print("full pass of {} changes in chunks of {}: {:.2f} s ({:.1f} changes/s)".format(n_changes, args.chunk_size, elapsed, n_changes/elapsed))
+    finally:
+        delta.session.rollback()
+        delta._execute_sql("drop schema if exists {0} cascade;", SCHEMA_NAME)
+        delta.connection.close()
+        CitationChanges.__table__.schema = "public"
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Benchmark: throughput of emitting events to a local stub webhook one HTTP
+POST per event (as task_emit_event does) versus draining the event outbox
+in batches with task_flush_events.
+
+The stub webhook listens on localhost and only counts the received events.
+The benchmark stores synthetic events in the database configured for the
+pipeline and removes them at the end, hence it must only be run against a
+development database.
+
+Usage: python scripts/benchmark_event_outbox.py [--events 5000] [--batch-size 100]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '../')))
+from ADSCitationCapture import tasks
+from ADSCitationCapture import db
+from ADSCitationCapture import webhook
+from ADSCitationCapture.models import Event
+
+app = tasks.app
+DUMP_PREFIX = 'benchmark'
+
+
+class StubWebhook(BaseHTTPRequestHandler):
+    n_requests = 0
+    n_events = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        StubWebhook.n_requests += 1
+        StubWebhook.n_events += len(json.loads(body))
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def _events_data(n_events):
+    return [webhook.identical_bibcode_and_doi_event_data("2000bnch.{:010d}B".format(i), "10.5281/benchmark.{}".format(i)) for i in range(n_events)]
+
+def _delete_events():
+    with app.session_scope() as session:
+        session.query(Event).filter(Event.dump_prefix == DUMP_PREFIX).delete(synchronize_session=False)
+        session.commit()
+
+def _measure(label, emit, n_events):
+    StubWebhook.n_requests = 0
+    StubWebhook.n_events = 0
+    start = time.perf_counter()
+    emit()
+    elapsed = time.perf_counter() - start
+    print("{:<12} {} events in {} requests: {:.2f} s ({:.1f} events/s)".format(label, StubWebhook.n_events, StubWebhook.n_requests, elapsed, n_events/elapsed))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark batched event emission')
+    parser.add_argument('--events', dest='n_events', type=int, default=5000, help='Number of synthetic events')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=100, help='Number of events per HTTP POST')
+    args = parser.parse_args()
+
+    server = HTTPServer(('localhost', 0), StubWebhook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app.conf['ADS_WEBHOOK_URL'] = "http://localhost:{}/webhooks/trigger".format(server.server_port)
+    app.conf['TESTING_MODE'] = False
+    app.conf['EVENT_OUTBOX_BATCH_SIZE'] = args.batch_size
+    events_data = _events_data(args.n_events)
+    # Dumps are written in the log directory by both methods, do not count them
+    webhook.dump_event = lambda *args, **kwargs: True
+    webhook.dump_events = lambda *args, **kwargs: True
+    try:
+        def per_event():
+            for event_data in events_data:
+                webhook.emit_event(app.conf['ADS_WEBHOOK_URL'], app.conf['ADS_WEBHOOK_AUTH_TOKEN'], event_data)
+                db.store_event(app, event_data, dump_prefix=DUMP_PREFIX)
+        _measure("per event", per_event, args.n_events)
+        for event_data in events_data:
+            db.store_event(app, event_data, status='PENDING', dump_prefix=DUMP_PREFIX)
+        _measure("outbox", tasks.task_flush_events, args.n_events)
+    finally:
+        _delete_events()
+        server.shutdown()
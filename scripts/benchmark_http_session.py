@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark: per-call latency of bare requests.get (new connection per
+call) versus the shared keep-alive sessions from ADSCitationCapture.http_session,
+measured against a local stub HTTP server.
+
+Usage: python scripts/benchmark_http_session.py [--requests 500]
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '../')))
+from ADSCitationCapture import http_session
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive support
+    disable_nagle_algorithm = True # Avoid delayed ACK stalls on re-used connections
+    body = b"<resource/>"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+def _measure(label, get, url, n_requests):
+    latencies = []
+    for i in range(n_requests):
+        start = time.perf_counter()
+        r = get(url)
+        r.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print("{:<24} mean {:.3f} ms | p50 {:.3f} ms | p95 {:.3f} ms".format(label,
+        1000*sum(latencies)/len(latencies), 1000*latencies[len(latencies)//2], 1000*latencies[int(len(latencies)*0.95)]))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark HTTP connection re-use')
+    parser.add_argument('--requests', dest='n_requests', type=int, default=500, help='Number of requests per strategy')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = "http://127.0.0.1:{}/10.5281/zenodo.11020".format(server.server_address[1])
+    try:
+        _measure("requests.get", lambda u: requests.get(u, timeout=30), url, args.n_requests)
+        _measure("http_session.get", lambda u: http_session.get(u, timeout=30), url, args.n_requests)
+    finally:
+        http_session.close_sessions()
+        server.shutdown()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Benchmark: runtime of importing a synthetic readers file and applying its
+changes to the public readers table with ReaderImport.apply (set-based).
+
+It creates schemas with the prefix 'benchmark_citation_capture_readers_' and
+inserts readers in the database configured for the pipeline (rows are
+removed at the end), hence it must only be run against a development
+database.
+
+Usage: python scripts/benchmark_reader_import.py [--rows 5000000] [--bibcodes 50000]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '../')))
+from ADSCitationCapture import tasks
+from ADSCitationCapture.reader_import import ReaderImport
+
+app = tasks.app
+SCHEMA_PREFIX = 'benchmark_citation_capture_readers_'
+
+
+def _write_readers_file(filename, n_rows, n_bibcodes):
+    with open(filename, 'w') as f:
+        for i in range(n_rows):
+            f.write("2000zndo.{:010d}B\t{:016x}\n".format(i % n_bibcodes, i))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark set-based reader ingestion')
+    parser.add_argument('--rows', dest='n_rows', type=int, default=5000000, help='Number of (bibcode, reader) rows in the synthetic file')
+    parser.add_argument('--bibcodes', dest='n_bibcodes', type=int, default=50000, help='Number of distinct bibcodes in the synthetic file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, 'reads.txt')
+        _write_readers_file(filename, args.n_rows, args.n_bibcodes)
+        readers = ReaderImport(app.conf['SQLALCHEMY_URL'], schema_prefix=SCHEMA_PREFIX)
+        try:
+            start = time.perf_counter()
+            readers.compute(filename)
+            computed = time.perf_counter()
+            bibcodes = readers.apply()
+            applied = time.perf_counter()
+            print("{} rows: compute {:.1f} s, apply {:.1f} s ({:.0f} rows/s), {} citation targets to output".format(
+                args.n_rows, computed - start, applied - computed, args.n_rows/(applied - computed), len(bibcodes)))
+        finally:
+            readers._execute_sql("delete from public.readers where bibcode like '2000zndo.%%B';")
+            readers._execute_sql("drop schema {0} cascade;", readers.schema_name)
+            readers.connection.close()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Benchmark: runtime of iterating over the reader changes grouped by bibcode
+with ReaderImport for increasing numbers of changes, the time per change
+should remain constant (linear time) since the changes are streamed once.
+
+It creates schemas with the prefix 'benchmark_citation_capture_readers_' in
+the database configured for the pipeline (they are dropped at the end), hence
+it must only be run against a development database.
+
+Usage: python scripts/benchmark_reader_iteration.py [--rows 10000 20000 40000 80000] [--changes-per-bibcode 5]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '../')))
+from ADSCitationCapture import tasks
+from ADSCitationCapture.reader_import import ReaderImport
+
+app = tasks.app
+SCHEMA_PREFIX = 'benchmark_citation_capture_readers_'
+
+
+def _write_readers_file(filename, n_rows, changes_per_bibcode):
+    # Unordered rows, the changes of each bibcode are spread over the file
+    rows = ["2000zndo.{:010d}B\t{:016x}\n".format(i // changes_per_bibcode, i) for i in range(n_rows)]
+    random.Random(n_rows).shuffle(rows)
+    with open(filename, 'w') as f:
+        f.write("".join(rows))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark grouped iteration over reader changes')
+    parser.add_argument('--rows', dest='rows', type=int, nargs='+', default=[10000, 20000, 40000, 80000], help='Number of reader changes of each run')
+    parser.add_argument('--changes-per-bibcode', dest='changes_per_bibcode', type=int, default=5, help='Number of reader changes for each bibcode')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_rows in args.rows:
+            filename = os.path.join(tmp_dir, 'reads_{}.txt'.format(n_rows))
+            _write_readers_file(filename, n_rows, args.changes_per_bibcode)
+            readers = ReaderImport(app.conf['SQLALCHEMY_URL'], schema_prefix=SCHEMA_PREFIX, force=True)
+            try:
+                readers.compute(filename)
+                start = time.perf_counter()
+                n_groups = n_changes = 0
+                for reader_changes in readers:
+                    n_groups += 1
+                    n_changes += len(reader_changes)
+                elapsed = time.perf_counter() - start
+                assert n_changes == n_rows
+                print("{} changes in {} groups: {:.2f} s ({:.1f} us/change)".format(n_changes, n_groups, elapsed, elapsed/n_changes*1e6))
+            finally:
+                readers._execute_sql("drop schema {0} cascade;", readers.schema_name)
+                readers.connection.close()
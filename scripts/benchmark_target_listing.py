@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Benchmark: time and peak memory of listing citation targets loading full ORM
+rows (including the raw DataCite XML, as db.get_citation_targets used to do)
+versus projecting only the columns used by the listings.
+
+It inserts synthetic citation targets (content prefixed by 'benchmark/') in
+the database configured for the pipeline and removes them at the end, hence
+it must only be run against a development database.
+
+Usage: python scripts/benchmark_target_listing.py [--records 100000] [--raw-size 8000]
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '../')))
+from ADSCitationCapture import tasks
+from ADSCitationCapture import db
+from ADSCitationCapture.models import CitationTarget
+
+app = tasks.app
+CONTENT_PREFIX = 'benchmark/'
+
+
+def _raw_metadata(i, raw_size):
+    # DataCite XML records are typically a few KB long (many creators/descriptions)
+    creator = '<creator><creatorName nameType="Personal">Surname{0}, Name</creatorName><givenName>Name</givenName><familyName>Surname{0}</familyName></creator>'.format(i)
+    creators = creator * max(1, raw_size // len(creator))
+    return '<?xml version="1.0" encoding="UTF-8"?><resource><identifier identifierType="DOI">{}{}</identifier><creators>{}</creators></resource>'.format(CONTENT_PREFIX, i, creators)
+
+def _insert_records(n_records, raw_size, batch_size=5000):
+    with app.session_scope() as session:
+        for start in range(0, n_records, batch_size):
+            values = [
+                {
+                    'content': CONTENT_PREFIX+str(i),
+                    'content_type': 'DOI',
+                    'bibcode': '2000bnch.{:010d}B'.format(i),
+                    'raw_cited_metadata': _raw_metadata(i, raw_size),
+                    'parsed_cited_metadata': {'bibcode': '2000bnch.{:010d}B'.format(i), 'alternate_bibcode': [], 'version': '1.0'},
+                    'curated_metadata': {},
+                    'status': 'REGISTERED',
+                }
+                for i in range(start, min(start+batch_size, n_records))
+            ]
+            session.execute(CitationTarget.__table__.insert(), values)
+        session.commit()
+
+def _delete_records():
+    with app.session_scope() as session:
+        session.query(CitationTarget).filter(CitationTarget.content.startswith(CONTENT_PREFIX)).delete(synchronize_session=False)
+        session.commit()
+
+def _full_rows_listing():
+    with app.session_scope() as session:
+        records_db = session.query(CitationTarget).filter(CitationTarget.status == 'REGISTERED').all()
+        return db._extract_key_citation_target_data(records_db)
+
+def _measure(label, listing):
+    tracemalloc.start()
+    start = time.perf_counter()
+    records = listing()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("{:<20} {} records in {:.2f} s, peak memory {:.1f} MB".format(label, len(records), elapsed, peak/1024/1024))
+    return records
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark citation target listings')
+    parser.add_argument('--records', dest='n_records', type=int, default=100000, help='Number of synthetic citation targets')
+    parser.add_argument('--raw-size', dest='raw_size', type=int, default=8000, help='Approximate size in bytes of the raw metadata of each target')
+    args = parser.parse_args()
+
+    _insert_records(args.n_records, args.raw_size)
+    try:
+        expected = _measure("full rows", _full_rows_listing)
+        records = _measure("key columns", lambda: db.get_citation_targets(app, only_status='REGISTERED'))
+        assert sorted(records, key=lambda r: r['content']) == sorted(expected, key=lambda r: r['content'])
+    finally:
+        _delete_records()
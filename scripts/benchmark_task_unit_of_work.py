@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Benchmark: database round-trips (connection checkouts, commits and
+statements) and runtime per task_process_updated_citation when the task runs
+in a single unit of work (db.task_session_scope) versus one session and
+commit per db helper (the task function without the _unit_of_work wrapper).
+
+Remote requests (doi.org versions and Solr canonical bibcodes) and the output
+to master/broker are replaced by no-ops, only database access is measured.
+
+It inserts a synthetic citation target and citations (content prefixed by
+'benchmark/') in the database configured for the pipeline and removes them
+at the end, hence it must only be run against a development database.
+
+Usage: python scripts/benchmark_task_unit_of_work.py [--citations 1000]
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '../')))
+import adsmsg
+from sqlalchemy import event
+from sqlalchemy_continuum import version_class
+from ADSCitationCapture import tasks
+from ADSCitationCapture import api
+from ADSCitationCapture.models import Citation, CitationTarget
+
+app = tasks.app
+CONTENT = 'benchmark/unit-of-work'
+BIBCODE = '2000bnch.0000000000B'
+
+
+def _citing(i):
+    return '2000bnch.{:010d}C'.format(i)
+
+def _insert_records(n_citations):
+    with app.session_scope() as session:
+        session.execute(CitationTarget.__table__.insert(), [{
+            'content': CONTENT,
+            'content_type': 'DOI',
+            'bibcode': BIBCODE,
+            'raw_cited_metadata': '',
+            'parsed_cited_metadata': {'bibcode': BIBCODE, 'alternate_bibcode': [], 'doctype': 'software'},
+            'curated_metadata': {},
+            'status': 'REGISTERED',
+        }])
+        session.execute(Citation.__table__.insert(), [{
+            'content': CONTENT,
+            'citing': _citing(i),
+            'canonical_citing': _citing(i),
+            'cited': '...................',
+            'resolved': False,
+            'timestamp': datetime(2000, 1, 1),
+            'status': 'REGISTERED',
+        } for i in range(n_citations)])
+        session.commit()
+
+def _delete_records():
+    with app.session_scope() as session:
+        for model in (Citation, version_class(Citation), CitationTarget, version_class(CitationTarget)):
+            session.query(model).filter(model.content == CONTENT).delete(synchronize_session=False)
+        session.commit()
+
+def _measure(label, process, citation_changes):
+    counts = {'checkouts': 0, 'commits': 0, 'statements': 0}
+    def count(name):
+        def listener(*args, **kwargs):
+            counts[name] += 1
+        return listener
+    listeners = ((app._engine.pool, 'checkout', count('checkouts')), (app._engine, 'commit', count('commits')), (app._engine, 'before_cursor_execute', count('statements')))
+    for target, name, listener in listeners:
+        event.listen(target, name, listener)
+    try:
+        start = time.perf_counter()
+        for citation_change in citation_changes:
+            process(citation_change)
+        elapsed = time.perf_counter() - start
+    finally:
+        for target, name, listener in listeners:
+            event.remove(target, name, listener)
+    n_tasks = len(citation_changes)
+    print("{:<18} {} tasks: {:.1f} checkouts, {:.1f} commits and {:.1f} statements per task, {:.2f} s ({:.2f} ms/task)".format(label, n_tasks, counts['checkouts']/n_tasks, counts['commits']/n_tasks, counts['statements']/n_tasks, elapsed, elapsed/n_tasks*1e3))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark database round-trips per task with and without unit of work')
+    parser.add_argument('--citations', dest='n_citations', type=int, default=1000, help='Number of synthetic citations (half of them are updated by each method)')
+    args = parser.parse_args()
+
+    citation_changes = [adsmsg.CitationChange(citing=_citing(i), content=CONTENT, content_type=adsmsg.CitationChangeContentType.doi, status=adsmsg.Status.updated, timestamp=datetime.now()) for i in range(args.n_citations)]
+    half = args.n_citations // 2
+    _insert_records(args.n_citations)
+    try:
+        with mock.patch.object(tasks, '_collect_associated_works', return_value=None), \
+                mock.patch.object(api, 'resolve_canonical_bibcodes', return_value={}), \
+                mock.patch.object(tasks, '_output_citation_target', return_value=None), \
+                mock.patch.object(tasks, '_emit_citation_change', return_value=None):
+            _measure("separate sessions", tasks.task_process_updated_citation.run.__wrapped__, citation_changes[:half])
+            _measure("unit of work", tasks.task_process_updated_citation, citation_changes[half:])
+    finally:
+        _delete_records()